@@ -0,0 +1,87 @@
+"""Benchmark of the memory-mapped line and FASTA header counting.
+
+Counting the lines of a plain file by iterating over it (as
+validate_file_has_min_lines used to do for every file) creates a bytes
+object per line. count_lines counts the newlines in chunks of a memory
+mapped file instead, and fasta_stats finds the number of sequences and their
+total length without reading the sequence lines one by one. Both are timed
+against the line iterator on synthetic FASTQ and FASTA files.
+
+Usage:
+    python benchmarks/bench_line_counting.py --sizes 1000000 100000000 --json results.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from input_trees import fasta_content, fastq_content
+
+from juno_library.helper_functions import count_lines, fasta_stats
+
+
+def iterate_lines(file_path: Path) -> int:
+    with open(file_path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def iterate_fasta(file_path: Path) -> dict[str, int]:
+    sequences, total_length = 0, 0
+    with open(file_path, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                sequences += 1
+            else:
+                total_length += len(line.rstrip(b"\r\n"))
+    return {"sequences": sequences, "total_length": total_length}
+
+
+def best_of(function: Callable[[Path], Any], file_path: Path, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(file_path)
+        times.append(time.perf_counter() - start)
+    return round(min(times), 4)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000_000, 10_000_000, 100_000_000],
+        help="File sizes in bytes.",
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", type=Path, help="File to write the results to.")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            fastq = Path(tmp_dir, "reads.fastq")
+            fastq.write_bytes(fastq_content(size))
+            fasta = Path(tmp_dir, "assembly.fasta")
+            fasta.write_bytes(fasta_content(size))
+            assert count_lines(fastq) == iterate_lines(fastq)
+            assert fasta_stats(fasta) == iterate_fasta(fasta)
+            results[str(size)] = {
+                "lines_iterator_seconds": best_of(iterate_lines, fastq, args.repeats),
+                "lines_mmap_seconds": best_of(count_lines, fastq, args.repeats),
+                "fasta_iterator_seconds": best_of(iterate_fasta, fasta, args.repeats),
+                "fasta_mmap_seconds": best_of(fasta_stats, fasta, args.repeats),
+            }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Simulation of the time to the first results of urgent samples, with and without prioritization.
+
+A batch of samples runs on a cluster with fewer slots than jobs. Every
+sample is a chain of jobs (e.g. trimming, assembly, typing) with random
+durations, and a few samples (e.g. of an outbreak) are urgent. Whenever a
+slot is free the scheduler starts a ready job. Like snakemake, it starts
+the ready jobs with the highest priority first and picks any of the ready
+jobs with the same priority:
+
+- unprioritized: all jobs have the same priority,
+- prioritized: the jobs of the urgent samples have the highest priority,
+  as Pipeline runs them (see juno_library.prioritization).
+
+For every policy the time until the first and the last urgent sample is
+finished and the time until all samples are finished (makespan) are
+reported, in hours of simulated time.
+
+Usage:
+    python benchmarks/bench_prioritization.py --samples 500 --urgent 10 --slots 50 --json results.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import random
+import statistics
+from pathlib import Path
+from typing import Any
+
+from juno_library.prioritization import priority_targets
+
+# Rules of every sample, in the order they run, with their mean duration in minutes
+RULES = [("trimming", 10.0), ("assembly", 60.0), ("qc", 15.0), ("typing", 20.0)]
+
+
+def make_jobs(samples: list[str], rng: random.Random) -> dict[str, list[float]]:
+    """The durations of the jobs of every sample (the mean of its rule +-50%)."""
+    return {
+        sample: [mean * rng.uniform(0.5, 1.5) for _, mean in RULES]
+        for sample in samples
+    }
+
+
+def dry_run_jobs(samples: list[str]) -> list[dict[str, Any]]:
+    """The jobs of the samples as capacity.DryRunJobs reports them."""
+    return [
+        {
+            "rule": rule,
+            "input": [f"{sample}.{RULES[i - 1][0]}" if i else f"{sample}.fastq"],
+            "output": [f"{sample}.{rule}"],
+            "wildcards": {"sample": sample},
+        }
+        for sample in samples
+        for i, (rule, _) in enumerate(RULES)
+    ]
+
+
+def simulate(
+    durations: dict[str, list[float]],
+    prioritized: set[str],
+    slots: int,
+    rng: random.Random,
+) -> dict[str, float]:
+    """Run the jobs on the slots and return when the samples finished (in minutes).
+
+    Args:
+        durations: The durations of the jobs of every sample.
+        prioritized: The samples whose jobs have the highest priority.
+        slots: Number of jobs that can run at the same time.
+        rng: Picks among the ready jobs with the same priority.
+    """
+    # Ready jobs: (priority, random tie breaker, sample, index of the job)
+    ready: list[tuple[int, float, str, int]] = []
+
+    def make_ready(sample: str, job: int) -> None:
+        priority = 0 if sample in prioritized else 1
+        heapq.heappush(ready, (priority, rng.random(), sample, job))
+
+    for sample in durations:
+        make_ready(sample, 0)
+    running: list[tuple[float, str, int]] = []
+    finished: dict[str, float] = {}
+    now = 0.0
+    while ready or running:
+        while ready and len(running) < slots:
+            _, _, sample, job = heapq.heappop(ready)
+            heapq.heappush(running, (now + durations[sample][job], sample, job))
+        now, sample, job = heapq.heappop(running)
+        if job + 1 < len(durations[sample]):
+            make_ready(sample, job + 1)
+        else:
+            finished[sample] = now
+    return finished
+
+
+def summarize(finished: dict[str, float], urgent: set[str]) -> dict[str, float]:
+    urgent_finished = [finished[sample] for sample in urgent]
+    return {
+        "first_urgent_result_hours": round(min(urgent_finished) / 60, 2),
+        "last_urgent_result_hours": round(max(urgent_finished) / 60, 2),
+        "mean_urgent_result_hours": round(statistics.mean(urgent_finished) / 60, 2),
+        "makespan_hours": round(max(finished.values()) / 60, 2),
+    }
+
+
+def run_benchmark(
+    n_samples: int, n_urgent: int, slots: int, seed: int
+) -> dict[str, Any]:
+    rng = random.Random(seed)
+    samples = sorted(f"sample{i:05d}" for i in range(n_samples))
+    urgent = set(rng.sample(samples, n_urgent))
+    durations = make_jobs(samples, rng)
+    # The jobs that get the highest priority follow from the targets, as
+    # in Pipeline._set_priority_targets
+    targets = priority_targets(dry_run_jobs(samples), urgent)
+    assert all(len(outputs) == 1 for outputs in targets.values())
+    policies = {"unprioritized": set(), "prioritized": set(targets)}
+    results: dict[str, Any] = {
+        "samples": n_samples,
+        "urgent_samples": n_urgent,
+        "slots": slots,
+        "jobs": n_samples * len(RULES),
+    }
+    for policy, prioritized in policies.items():
+        finished = simulate(durations, prioritized, slots, random.Random(seed))
+        results[policy] = summarize(finished, urgent)
+    results["speedup_first_urgent_result"] = round(
+        results["unprioritized"]["first_urgent_result_hours"]
+        / results["prioritized"]["first_urgent_result_hours"],
+        2,
+    )
+    results["speedup_last_urgent_result"] = round(
+        results["unprioritized"]["last_urgent_result_hours"]
+        / results["prioritized"]["last_urgent_result_hours"],
+        2,
+    )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--urgent", type=int, default=10)
+    parser.add_argument("--slots", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", type=Path, help="File to write the results to.")
+    args = parser.parse_args()
+    results = run_benchmark(args.samples, args.urgent, args.slots, args.seed)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
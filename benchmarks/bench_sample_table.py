@@ -0,0 +1,100 @@
+"""Benchmark of the memory used by a SampleTable against a dict of dicts.
+
+A sample_dict with paired fastq files and an assembly per sample, all under
+one long (realistic) input directory, is built both as the nested
+dictionaries of strings that used to be the sample_dict and as a
+SampleTable. The memory allocated for each is measured with tracemalloc.
+The time needed to dump them to yaml (as done for the sample sheet) can
+optionally be measured as well.
+
+Usage:
+    python benchmarks/bench_sample_table.py --samples 100000 --json results.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import Any, Callable
+
+import yaml
+
+from juno_library.sample_table import SampleTable
+
+INPUT_DIR = "/mnt/scratch/bioinformatics/projects/surveillance_2024/run_0421_NB551234/juno_assembly_output"
+
+
+def build_sample_dict(n_samples: int) -> dict[str, dict[str, str]]:
+    sample_dict = {}
+    for i in range(n_samples):
+        sample = f"sample_{i:07d}"
+        sample_dict[sample] = {
+            "R1": f"{INPUT_DIR}/clean_fastq/{sample}_R1.fastq.gz",
+            "R2": f"{INPUT_DIR}/clean_fastq/{sample}_R2.fastq.gz",
+            "assembly": f"{INPUT_DIR}/de_novo_assembly_filtered/{sample}.fasta",
+        }
+    return sample_dict
+
+
+def build_sample_table(n_samples: int) -> SampleTable:
+    # Built sample by sample, as Pipeline does, so the plain dictionaries
+    # never exist all at the same time
+    table = SampleTable()
+    for i in range(n_samples):
+        sample = f"sample_{i:07d}"
+        record = table.setdefault(sample, {})
+        record["R1"] = f"{INPUT_DIR}/clean_fastq/{sample}_R1.fastq.gz"
+        record["R2"] = f"{INPUT_DIR}/clean_fastq/{sample}_R2.fastq.gz"
+        record["assembly"] = f"{INPUT_DIR}/de_novo_assembly_filtered/{sample}.fasta"
+    return table
+
+
+def measure(build: Callable[[int], Any], n_samples: int, dump: bool) -> dict[str, Any]:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    samples = build(n_samples)
+    build_seconds = time.perf_counter() - start
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        "build_seconds": round(build_seconds, 3),
+        "memory_mb": round(allocated / 1024**2, 1),
+        "peak_memory_mb": round(peak / 1024**2, 1),
+    }
+    if dump:
+        start = time.perf_counter()
+        yaml.dump(samples, Dumper=getattr(yaml, "CDumper", yaml.Dumper))
+        result["yaml_dump_seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--samples", type=int, default=100_000)
+    parser.add_argument(
+        "--dump", action="store_true", help="Also time the dump to yaml."
+    )
+    parser.add_argument("--json", help="File to write the results to.")
+    args = parser.parse_args()
+    dict_of_dicts = measure(build_sample_dict, args.samples, args.dump)
+    sample_table = measure(build_sample_table, args.samples, args.dump)
+    results = {
+        "samples": args.samples,
+        "dict_of_dicts": dict_of_dicts,
+        "sample_table": sample_table,
+        "memory_ratio": round(
+            sample_table["memory_mb"] / dict_of_dicts["memory_mb"], 2
+        ),
+    }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
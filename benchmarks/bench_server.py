@@ -0,0 +1,167 @@
+"""Benchmark of launches through the warm pipeline server against cold launches.
+
+A small pipeline (one rule per sample and a summary) is dry-run on a
+synthetic input tree, which is the kind of short run that automation starts
+many times a day. Every launch is timed from start to exit status:
+
+- cold: a new interpreter that imports the library and runs the pipeline,
+- warm_cli: the client of the server (python -m juno_library.server run),
+  a new interpreter that only imports the standard library,
+- warm_request: a request from this process (request_run), which shows the
+  time spent by the server itself.
+
+Usage:
+    python benchmarks/bench_server.py --samples 10 --launches 20 --json results.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable
+
+from input_trees import generate_input_tree
+
+from juno_library import Pipeline
+from juno_library.server import PipelineServer, request_run
+
+SNAKEFILE = """
+import yaml
+with open(config["sample_sheet"]) as f:
+    SAMPLES = yaml.safe_load(f)
+OUT = config["output_dir"]
+
+rule all:
+    input: OUT + "/summary.txt"
+
+rule per_sample:
+    input: lambda wildcards: SAMPLES[wildcards.sample]["assembly"]
+    output: OUT + "/per_sample/{sample}.txt"
+    shell: "cp {input} {output}"
+
+rule summary:
+    input: expand(OUT + "/per_sample/{sample}.txt", sample=SAMPLES)
+    output: OUT + "/summary.txt"
+    shell: "cat {input} > {output}"
+"""
+
+COLD_LAUNCH = """
+import sys
+from juno_library import Pipeline
+Pipeline(
+    pipeline_name="bench_pipeline",
+    pipeline_version="0.1",
+    input_type="fasta",
+    snakefile=sys.argv[1],
+    argv=sys.argv[2:],
+).run()
+"""
+
+
+def timed_launches(launch: Callable[[], int], launches: int) -> dict[str, float]:
+    times = []
+    for _ in range(launches):
+        start = time.perf_counter()
+        exit_status = launch()
+        times.append(time.perf_counter() - start)
+        assert exit_status == 0, f"A launch failed with exit status {exit_status}"
+    return {
+        "median_seconds": round(statistics.median(times), 4),
+        "min_seconds": round(min(times), 4),
+        "max_seconds": round(max(times), 4),
+    }
+
+
+def run_benchmark(n_samples: int, launches: int, tmp_dir: Path) -> dict[str, Any]:
+    input_dir = generate_input_tree("fasta", n_samples, tmp_dir.joinpath("input"))
+    snakefile = tmp_dir.joinpath("Snakefile")
+    snakefile.write_text(SNAKEFILE)
+    socket_path = tmp_dir.joinpath("server.sock")
+    argv = ["-i", str(input_dir), "-o", str(tmp_dir.joinpath("output"))]
+    argv += ["--local", "-n", "--no-run-registry"]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+    def cold() -> int:
+        return subprocess.run(
+            [sys.executable, "-c", COLD_LAUNCH, str(snakefile), *argv],
+            cwd=tmp_dir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode
+
+    def warm_cli() -> int:
+        return subprocess.run(
+            [sys.executable, "-m", "juno_library.server"]
+            + ["--socket", str(socket_path), "run", "--", *argv],
+            cwd=tmp_dir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode
+
+    devnull = os.open(os.devnull, os.O_RDWR)
+
+    def warm_request() -> int:
+        return request_run(
+            argv, socket_path, cwd=str(tmp_dir), fds=(devnull, devnull, devnull)
+        )
+
+    pipeline_factory = partial(
+        Pipeline,
+        pipeline_name="bench_pipeline",
+        pipeline_version="0.1",
+        input_type="fasta",
+        snakefile=str(snakefile),
+    )
+    server = multiprocessing.get_context("fork").Process(
+        target=PipelineServer(pipeline_factory, socket_path).serve_forever
+    )
+    start = time.perf_counter()
+    server.start()
+    while not socket_path.exists():
+        time.sleep(0.01)
+    server_startup = time.perf_counter() - start
+    try:
+        results: dict[str, Any] = {
+            "samples": n_samples,
+            "launches": launches,
+            "server_startup_seconds": round(server_startup, 3),
+            "cold": timed_launches(cold, launches),
+            "warm_cli": timed_launches(warm_cli, launches),
+            "warm_request": timed_launches(warm_request, launches),
+        }
+    finally:
+        server.terminate()
+        server.join()
+        os.close(devnull)
+    results["speedup_cli"] = round(
+        results["cold"]["median_seconds"] / results["warm_cli"]["median_seconds"], 2
+    )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--launches", type=int, default=10)
+    parser.add_argument("--json", type=Path, help="File to write the results to.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_benchmark(args.samples, args.launches, Path(tmp_dir))
+    print(json.dumps(results, indent=2))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
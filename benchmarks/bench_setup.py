@@ -0,0 +1,198 @@
+"""Benchmark suite for the launch of a pipeline on synthetic input trees.
+
+For every layout (see input_trees.py) and number of samples, an input tree
+is generated and the phases that run before snakemake starts are timed:
+Pipeline.setup (finding and validating the samples), the writing of the
+sample sheet and the generation of the audit trail. Every measurement is
+repeated and the median is reported.
+
+The results are written as JSON together with the commit they were
+measured on. Giving the results of an earlier commit with --compare reports
+the timings that got slower than the tolerance allows (and exits with 1).
+
+Usage:
+    python benchmarks/bench_setup.py --samples 100 1000 --json new.json
+    python benchmarks/bench_setup.py --samples 100 1000 --compare old.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import yaml
+
+from input_trees import LAYOUT_INPUT_TYPES, generate_input_tree
+from juno_library import Pipeline
+
+PHASES = ["setup_seconds", "sample_sheet_seconds", "audit_trail_seconds"]
+
+
+def timed(function: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def launch_phases(layout: str, input_dir: Path, work_dir: Path) -> dict[str, float]:
+    """Time the launch phases of one pipeline run on input_dir."""
+    config_dir = work_dir.joinpath("config")
+    config_dir.mkdir(parents=True, exist_ok=True)
+    pipeline = Pipeline(
+        pipeline_name="benchmark",
+        pipeline_version="v0.0.0",
+        input_type=LAYOUT_INPUT_TYPES[layout],
+        sample_sheet=config_dir.joinpath("sample_sheet.yaml"),
+        user_parameters_file=config_dir.joinpath("user_parameters.yaml"),
+        argv=["-i", str(input_dir), "-o", str(work_dir.joinpath("output"))],
+    )
+    setup_seconds = timed(pipeline.setup)
+
+    def write_sample_sheet() -> None:
+        with open(pipeline.sample_sheet, "w") as f:
+            yaml.dump(pipeline.sample_dict, f)
+
+    sample_sheet_seconds = timed(write_sample_sheet)
+    with open(pipeline.user_parameters_file, "w") as f:
+        yaml.dump(pipeline.user_parameters, f)
+    audit_trail_seconds = timed(pipeline._generate_audit_trail)
+    return {
+        "setup_seconds": setup_seconds,
+        "sample_sheet_seconds": sample_sheet_seconds,
+        "audit_trail_seconds": audit_trail_seconds,
+    }
+
+
+def run_suite(
+    layouts: list[str],
+    sample_counts: list[int],
+    file_size: int,
+    repeats: int,
+    tmp_dir: Path,
+) -> dict[str, dict[str, float]]:
+    results = {}
+    for layout in layouts:
+        for n_samples in sample_counts:
+            input_dir = generate_input_tree(
+                layout,
+                n_samples,
+                tmp_dir.joinpath(f"{layout}_{n_samples}", "input"),
+                file_size=file_size,
+            )
+            runs = [
+                launch_phases(
+                    layout,
+                    input_dir,
+                    tmp_dir.joinpath(f"{layout}_{n_samples}", f"run{i}"),
+                )
+                for i in range(repeats)
+            ]
+            results[f"{layout}/{n_samples}"] = {
+                phase: round(statistics.median(run[phase] for run in runs), 4)
+                for phase in PHASES
+            }
+            print(f"{layout}/{n_samples}: {results[f'{layout}/{n_samples}']}")
+    return results
+
+
+def compare(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float,
+    min_seconds: float,
+) -> list[str]:
+    """Timings that are slower than the baseline by more than the tolerance.
+
+    Timings below min_seconds in both runs are ignored, they are too noisy.
+    """
+    regressions = []
+    for case, timings in results.items():
+        for phase, seconds in timings.items():
+            old_seconds = baseline.get(case, {}).get(phase)
+            if old_seconds is None or max(seconds, old_seconds) < min_seconds:
+                continue
+            if seconds > old_seconds * (1 + tolerance):
+                regressions.append(
+                    f"{case} {phase}: {old_seconds:.4f}s -> {seconds:.4f}s"
+                )
+    return regressions
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], text=True, cwd=Path(__file__).parent
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--layouts",
+        nargs="+",
+        choices=list(LAYOUT_INPUT_TYPES),
+        default=list(LAYOUT_INPUT_TYPES),
+    )
+    parser.add_argument("--samples", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument(
+        "--file-size", type=int, default=10_000, help="Size of every file in bytes."
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", type=Path, help="File to write the results to.")
+    parser.add_argument(
+        "--compare", type=Path, help="Results of an earlier run to compare with."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="Allowed relative slowdown compared to --compare.",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.01,
+        help="Timings below this value are not compared.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_suite(
+            args.layouts, args.samples, args.file_size, args.repeats, Path(tmp_dir)
+        )
+    output = {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "file_size": args.file_size,
+        "repeats": args.repeats,
+        "results": results,
+    }
+    if args.json:
+        args.json.write_text(json.dumps(output, indent=2))
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(
+            results, baseline["results"], args.tolerance, args.min_seconds
+        )
+        if regressions:
+            print(f"Regressions compared to {baseline['commit']}:")
+            print("\n".join(regressions))
+            sys.exit(1)
+        print(f"No regressions compared to {baseline['commit']}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Generator of synthetic input directories for the Juno pipelines.
+
+Every layout mimics one kind of input that Pipeline.setup recognizes:
+
+- fastq, fasta, vcf, bam: raw input files of one type in a flat directory
+  (vcf also gets a reference/reference.fasta).
+- assembly: output of Juno-assembly (clean_fastq, de_novo_assembly_filtered).
+- mapping: output of Juno-mapping (mapped_reads/duprem, variants, reference).
+- variant_typing: output of Juno-variant-typing (<typing>/consensus, audit_trail).
+
+The content of the files is synthetic but has the right format, so the
+files pass the checks of the library (e.g. minimum number of lines, BAM
+structure).
+
+Usage:
+    python benchmarks/input_trees.py assembly 1000 input_dir --file-size 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import zlib
+from pathlib import Path
+from typing import Tuple, Union
+
+InputType = Union[str, Tuple[str, ...]]
+
+# Input type that a Pipeline needs for every layout
+LAYOUT_INPUT_TYPES: dict[str, InputType] = {
+    "fastq": "fastq",
+    "fasta": "fasta",
+    "vcf": "vcf",
+    "bam": "bam",
+    "assembly": "both",
+    "mapping": ("bam", "vcf"),
+    "variant_typing": "fasta",
+}
+
+
+def _repeat_to_size(record: str, file_size: int) -> bytes:
+    n_records = max(1, file_size // len(record))
+    return (record * n_records).encode()
+
+
+def fastq_content(file_size: int) -> bytes:
+    read = "ACGT" * 37 + "AC"
+    return _repeat_to_size(f"@read\n{read}\n+\n{'I' * len(read)}\n", file_size)
+
+
+def fasta_content(file_size: int) -> bytes:
+    return b">contig_1\n" + _repeat_to_size("ACGT" * 15 + "\n", file_size)
+
+
+def vcf_content(file_size: int) -> bytes:
+    header = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+    return header.encode() + _repeat_to_size(
+        "contig_1\t100\t.\tA\tG\t60\tPASS\tDP=50\n", file_size
+    )
+
+
+def _bgzf_block(data: bytes, level: int = 0) -> bytes:
+    # Stored (level 0) by default, so the block is about as large as the data
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    block_size = 18 + len(compressed) + 8
+    return (
+        b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+        + (block_size - 1).to_bytes(2, "little")
+        + compressed
+        + zlib.crc32(data).to_bytes(4, "little")
+        + len(data).to_bytes(4, "little")
+    )
+
+
+def bam_content(file_size: int) -> bytes:
+    # A valid BAM (header with comment lines up to the size, no references
+    # nor alignments) in BGZF blocks of at most 60 kB, ending with the EOF block
+    text = b"@HD\tVN:1.6\n" + _repeat_to_size("@CO\tsynthetic comment\n", file_size)
+    data = b"BAM\x01" + len(text).to_bytes(4, "little") + text + bytes(4)
+    blocks = [_bgzf_block(data[i : i + 60000]) for i in range(0, len(data), 60000)]
+    # The standard EOF block is an empty block compressed at the default level
+    return b"".join(blocks) + _bgzf_block(b"", level=6)
+
+
+class InputTreeWriter:
+    """Write the files of a synthetic input tree with content of a given size.
+
+    The content is generated once per file type and reused for all the
+    files, so the time to generate large trees is dominated by the writes.
+    """
+
+    def __init__(self, file_size: int, gzip_fastq: bool = True) -> None:
+        self.gzip_fastq = gzip_fastq
+        fastq = fastq_content(file_size)
+        self.content: dict[str, bytes] = {
+            "fastq": gzip.compress(fastq, compresslevel=1) if gzip_fastq else fastq,
+            "fasta": fasta_content(file_size),
+            "vcf": vcf_content(file_size),
+            "bam": bam_content(file_size),
+        }
+
+    def write(self, path: Path, file_type: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(self.content[file_type])
+
+    def fastq_pair(self, dir: Path, sample: str) -> None:
+        extension = ".fastq.gz" if self.gzip_fastq else ".fastq"
+        self.write(dir.joinpath(f"{sample}_R1{extension}"), "fastq")
+        self.write(dir.joinpath(f"{sample}_R2{extension}"), "fastq")
+
+
+def write_sample(
+    writer: InputTreeWriter, layout: str, input_dir: Path, sample: str
+) -> None:
+    """Write the files of one sample in the given layout."""
+    if layout == "fastq":
+        writer.fastq_pair(input_dir, sample)
+    elif layout in ["fasta", "vcf", "bam"]:
+        writer.write(input_dir.joinpath(f"{sample}.{layout}"), layout)
+    elif layout == "assembly":
+        writer.fastq_pair(input_dir.joinpath("clean_fastq"), sample)
+        writer.write(
+            input_dir.joinpath("de_novo_assembly_filtered", f"{sample}.fasta"), "fasta"
+        )
+    elif layout == "mapping":
+        writer.write(
+            input_dir.joinpath("mapped_reads", "duprem", f"{sample}.bam"), "bam"
+        )
+        writer.write(input_dir.joinpath("variants", f"{sample}.vcf"), "vcf")
+    elif layout == "variant_typing":
+        writer.write(
+            input_dir.joinpath("mtb_typing", "consensus", f"{sample}.fasta"), "fasta"
+        )
+
+
+def generate_input_tree(
+    layout: str,
+    n_samples: int,
+    input_dir: Path,
+    file_size: int = 10_000,
+    gzip_fastq: bool = True,
+) -> Path:
+    """Generate a synthetic input directory.
+
+    Args:
+        layout (str): One of the keys of LAYOUT_INPUT_TYPES.
+        n_samples (int): Number of samples.
+        input_dir (Path): Directory to create the files in.
+        file_size (int, optional): Approximate size of every file in bytes (before compression). Defaults to 10_000.
+        gzip_fastq (bool, optional): Write gzipped fastq files. Defaults to True.
+
+    Returns:
+        Path: The input directory.
+    """
+    assert (
+        layout in LAYOUT_INPUT_TYPES
+    ), f"Unknown layout {layout}, use one of {list(LAYOUT_INPUT_TYPES)}"
+    writer = InputTreeWriter(file_size, gzip_fastq=gzip_fastq)
+    input_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(n_samples):
+        write_sample(writer, layout, input_dir, f"sample{i:06d}")
+    if layout in ["vcf", "mapping"]:
+        writer.write(input_dir.joinpath("reference", "reference.fasta"), "fasta")
+    if layout == "variant_typing":
+        input_dir.joinpath("audit_trail").mkdir(exist_ok=True)
+    return input_dir
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("layout", choices=list(LAYOUT_INPUT_TYPES))
+    parser.add_argument("samples", type=int)
+    parser.add_argument("input_dir", type=Path)
+    parser.add_argument("--file-size", type=int, default=10_000)
+    parser.add_argument("--no-gzip", action="store_true")
+    args = parser.parse_args()
+    generate_input_tree(
+        args.layout,
+        args.samples,
+        args.input_dir,
+        file_size=args.file_size,
+        gzip_fastq=not args.no_gzip,
+    )
+
+
+if __name__ == "__main__":
+    main()
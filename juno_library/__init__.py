@@ -1,3 +1,19 @@
-from juno_library.juno_library import Pipeline
+from typing import TYPE_CHECKING, Any
 
-__all__ = ["Pipeline"]
+from juno_library.pipeline_config import PipelineConfig
+
+if TYPE_CHECKING:
+    from juno_library.juno_library import Pipeline
+
+__all__ = ["Pipeline", "PipelineConfig"]
+
+
+def __getattr__(name: str) -> Any:
+    # Pipeline (and with it snakemake and pandas) is only imported when it is
+    # used, so the command line tools of the submodules (e.g. the client of
+    # juno_library.server) start without them
+    if name == "Pipeline":
+        from juno_library.juno_library import Pipeline
+
+        return Pipeline
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
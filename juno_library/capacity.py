@@ -0,0 +1,229 @@
+"""Estimation of the resources a pipeline run needs, before it is submitted.
+
+The jobs of the run are taken from a dry run of snakemake: every job it
+would run is reported (as a job_info log message) with its rule, threads
+and resources. Together with the size of the input files in the
+sample_dict this gives an estimate of:
+
+- the CPU-hours (threads x runtime of every job),
+- the memory of the largest job and of the jobs that can run at the same time,
+- the disk space of the output,
+- the wall time of the run,
+
+which are compared with the free space in the output directory and the
+settings of the queue (time limit per job, number of concurrent jobs).
+
+The runtime of a job is its runtime resource (in minutes) if the rule
+declares one, otherwise the time limit of the queue, which is an upper
+bound. The output size is the sum of the disk_mb resources if the rules
+declare them, otherwise the size of the input files times an output
+factor.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Iterable, Mapping, Optional
+
+# Output of a run relative to the size of its input files, used when the
+# rules do not declare a disk_mb resource
+DEFAULT_OUTPUT_FACTOR = 3.0
+
+
+class DryRunJobs:
+    """Snakemake log handler that collects the jobs reported by a dry run.
+
+    Jobs without output files (e.g. rule all) only request the output of
+    other jobs and are left out. Besides their resources, the input and
+    output files and the wildcards of the jobs are kept (used by
+    prioritization.priority_targets).
+    """
+
+    def __init__(self) -> None:
+        self.jobs: list[dict[str, Any]] = []
+
+    def __call__(self, msg: dict[str, Any]) -> None:
+        if msg.get("level") != "job_info" or not msg.get("output"):
+            return
+        resources = msg.get("resources")
+        resources = dict(resources.items()) if resources is not None else {}
+        mem_gb = resources.get("mem_gb")
+        if mem_gb is None and resources.get("mem_mb") is not None:
+            mem_gb = resources["mem_mb"] / 1024
+        disk_mb = resources.get("disk_mb")
+        self.jobs.append(
+            {
+                "rule": msg["name"],
+                "threads": int(msg.get("threads") or 1),
+                "mem_gb": float(mem_gb) if mem_gb is not None else None,
+                "runtime": resources.get("runtime"),
+                "disk_mb": float(disk_mb) if disk_mb is not None else None,
+                "local": bool(msg.get("local")),
+                "input": list(msg.get("input") or []),
+                "output": list(msg["output"]),
+                "wildcards": dict(msg.get("wildcards") or {}),
+            }
+        )
+
+
+def input_bytes(
+    sample_dict: Mapping[str, Mapping[str, Any]], keys: Iterable[str]
+) -> int:
+    """Total size of the input files of the samples (every file counted once)."""
+    files = {
+        str(record[key])
+        for record in sample_dict.values()
+        for key in keys
+        if record.get(key) is not None
+    }
+    return sum(os.stat(file_).st_size for file_ in files if os.path.isfile(file_))
+
+
+def free_bytes(dir_: Path) -> int:
+    """Free space on the filesystem of dir_ (or of its closest existing parent)."""
+    while not dir_.exists() and dir_ != dir_.parent:
+        dir_ = dir_.parent
+    return shutil.disk_usage(dir_).free
+
+
+def plan_capacity(
+    jobs: list[dict[str, Any]],
+    total_input_bytes: int,
+    free_output_bytes: int,
+    time_limit: int,
+    max_concurrent_jobs: int,
+    cores: Optional[int] = None,
+    mem_gb: Optional[float] = None,
+    output_factor: float = DEFAULT_OUTPUT_FACTOR,
+) -> dict[str, Any]:
+    """Estimate the resources of a run from the jobs of its dry run.
+
+    Args:
+        jobs (list[dict[str, Any]]): The jobs collected by DryRunJobs.
+        total_input_bytes (int): Size of the input files.
+        free_output_bytes (int): Free space in the output directory.
+        time_limit (int): Time limit per job in minutes (the queue setting).
+        max_concurrent_jobs (int): Number of jobs that can run at the same time (nodes on a cluster).
+        cores (Optional[int], optional): For a local run, the cores that the jobs share. Defaults to None.
+        mem_gb (Optional[float], optional): For a local run, the memory that the jobs share. Defaults to None.
+        output_factor (float, optional): Output size relative to the input size if the rules do not declare disk_mb. Defaults to DEFAULT_OUTPUT_FACTOR.
+
+    Returns:
+        dict[str, Any]: The estimates, the resources per rule and the problems found (warnings). fits is False if any problem was found.
+    """
+    rules: dict[str, dict[str, Any]] = defaultdict(
+        lambda: {
+            "jobs": 0,
+            "cpu_hours": 0.0,
+            "minutes": 0.0,
+            "max_mem_gb": 0.0,
+            "max_runtime": 0,
+        }
+    )
+    warnings: list[str] = []
+    undeclared: dict[str, set[str]] = {"runtime": set(), "mem_gb": set()}
+    # (runtime, mem_gb) of every job
+    job_usage: list[tuple[float, float]] = []
+    for job in jobs:
+        runtime = job["runtime"]
+        if runtime is None:
+            undeclared["runtime"].add(job["rule"])
+            runtime = time_limit
+        elif runtime > time_limit:
+            warnings.append(
+                f"Jobs of rule {job['rule']} need {runtime} minutes, more than the time limit of {time_limit} minutes."
+            )
+        if job["mem_gb"] is None:
+            undeclared["mem_gb"].add(job["rule"])
+        rule = rules[job["rule"]]
+        rule["jobs"] += 1
+        rule["cpu_hours"] += job["threads"] * runtime / 60
+        rule["minutes"] += runtime
+        rule["max_mem_gb"] = max(rule["max_mem_gb"], job["mem_gb"] or 0.0)
+        rule["max_runtime"] = max(rule["max_runtime"], runtime)
+        job_usage.append((runtime, job["mem_gb"] or 0.0))
+        if cores is not None and job["threads"] > cores:
+            warnings.append(
+                f"Jobs of rule {job['rule']} use {job['threads']} threads, more than the {cores} available cores."
+            )
+        if mem_gb is not None and (job["mem_gb"] or 0.0) > mem_gb:
+            warnings.append(
+                f"Jobs of rule {job['rule']} need {job['mem_gb']} GB, more than the {mem_gb} GB available."
+            )
+    warnings = list(dict.fromkeys(warnings))
+
+    cpu_hours = sum(rule["cpu_hours"] for rule in rules.values())
+    # The rules are taken to run one after the other (as the rules of a
+    # pipeline usually depend on each other), every rule taking as long as
+    # its jobs need with the available cores (local) or nodes (cluster), but
+    # at least as long as its slowest job
+    wall_minutes = 0.0
+    for rule in rules.values():
+        if cores is not None:
+            rule_minutes = rule["cpu_hours"] * 60 / cores
+        else:
+            rule_minutes = rule["minutes"] / max_concurrent_jobs
+        wall_minutes += max(rule_minutes, rule["max_runtime"])
+
+    concurrent = sorted((mem for _, mem in job_usage), reverse=True)
+    peak_mem_gb = sum(concurrent[:max_concurrent_jobs])
+    if mem_gb is not None:
+        peak_mem_gb = min(peak_mem_gb, mem_gb)
+
+    declared_disk = [job["disk_mb"] for job in jobs if job["disk_mb"] is not None]
+    if declared_disk:
+        output_bytes = int(sum(declared_disk) * 1024**2)
+        output_source = "disk_mb"
+    else:
+        output_bytes = int(total_input_bytes * output_factor)
+        output_source = f"{output_factor} x input"
+    if output_bytes > free_output_bytes:
+        warnings.append(
+            f"The output needs about {output_bytes / 1024**3:.1f} GB but only {free_output_bytes / 1024**3:.1f} GB is free."
+        )
+
+    return {
+        "jobs": len(jobs),
+        "cpu_hours": round(cpu_hours, 2),
+        "max_job_mem_gb": max((mem for _, mem in job_usage), default=0.0),
+        "peak_mem_gb": round(peak_mem_gb, 2),
+        "wall_time_hours": round(wall_minutes / 60, 2),
+        "input_bytes": total_input_bytes,
+        "output_bytes": output_bytes,
+        "output_bytes_source": output_source,
+        "free_output_bytes": free_output_bytes,
+        "time_limit": time_limit,
+        "max_concurrent_jobs": max_concurrent_jobs,
+        "runtime_not_declared": sorted(undeclared["runtime"]),
+        "mem_gb_not_declared": sorted(undeclared["mem_gb"]),
+        "rules": {
+            name: dict(rule, cpu_hours=round(rule["cpu_hours"], 2))
+            for name, rule in sorted(rules.items())
+        },
+        "warnings": warnings,
+        "fits": not warnings,
+    }
+
+
+def format_capacity_report(report: Mapping[str, Any]) -> str:
+    """Human readable summary of a report of plan_capacity."""
+    lines = [
+        f"Jobs: {report['jobs']} ({len(report['rules'])} rules)",
+        f"CPU-hours: {report['cpu_hours']}",
+        f"Memory: {report['max_job_mem_gb']} GB for the largest job, {report['peak_mem_gb']} GB at the peak",
+        f"Output: ~{report['output_bytes'] / 1024**3:.2f} GB ({report['output_bytes_source']}), {report['free_output_bytes'] / 1024**3:.2f} GB free",
+        f"Wall time: ~{report['wall_time_hours']} hours with {report['max_concurrent_jobs']} concurrent jobs",
+    ]
+    if report["runtime_not_declared"]:
+        lines.append(
+            f"No runtime declared (time limit of {report['time_limit']} minutes used) for: {', '.join(report['runtime_not_declared'])}"
+        )
+    if report["mem_gb_not_declared"]:
+        lines.append(
+            f"No mem_gb declared for: {', '.join(report['mem_gb_not_declared'])}"
+        )
+    lines.extend(f"WARNING: {warning}" for warning in report["warnings"])
+    return "\n".join(lines)
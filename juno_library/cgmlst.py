@@ -0,0 +1,178 @@
+"""Input from juno-cgmlst: allele calls per scheme and per sample.
+
+juno-cgmlst writes one allele-call table (TSV) per sample and per scheme:
+
+    cgmlst/<scheme>/per_sample/<sample>.tsv
+
+Every table has a header with the loci (the first column is the input file)
+and one row with the allele calls of the sample. The schemes are scanned in
+parallel and every table is added to the sample_dict as cgmlst_<scheme>.
+
+For pipelines that compare samples (e.g. clustering), the calls of all the
+samples of a scheme can be stored as a compact allele matrix (NumPy,
+samples x loci, 0 for a missing call) in <matrix_dir>/allele_matrix.npz.
+The matrix is kept out of the input directory, so writing it does not change
+the fingerprint of the input (see fingerprint.py). The tables are read as a
+stream, one line at a time. The matrix is rebuilt only if the tables changed.
+"""
+
+from __future__ import annotations
+
+import csv
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Mapping, Tuple
+
+from juno_library.helper_functions import scan_dir_resolved
+
+CGMLST_KEY_PREFIX = "cgmlst_"
+ALLELE_MATRIX_FILE = "allele_matrix.npz"
+# Depth of the tables in a juno-cgmlst output directory, for the fingerprint
+CGMLST_FINGERPRINT_DEPTH = 4
+# Inferred alleles (e.g. INF-123 in chewBBACA) are numbered as well
+_ALLELE_CALL = re.compile(r"(?:INF-)?\*?(\d+)")
+
+
+def discover_cgmlst_results(
+    cgmlst_dir: Path,
+    validate: Callable[[str], bool],
+    max_workers: int = 8,
+) -> dict[str, dict[str, str]]:
+    """Find the allele-call tables of every scheme in cgmlst_dir.
+
+    Args:
+        cgmlst_dir (Path): The cgmlst directory of a juno-cgmlst output directory.
+        validate (Callable[[str], bool]): Check of a table (e.g. its minimum number of lines), tables that fail it are skipped.
+        max_workers (int, optional): Number of schemes scanned at the same time. Defaults to 8.
+
+    Returns:
+        dict[str, dict[str, str]]: {scheme: {sample: resolved path of the table}}
+    """
+    scheme_dirs = sorted(
+        entry.name for entry in os.scandir(cgmlst_dir) if entry.is_dir()
+    )
+
+    def scan_scheme(scheme: str) -> Tuple[str, dict[str, str]]:
+        per_sample_dir = cgmlst_dir.joinpath(scheme, "per_sample")
+        if not per_sample_dir.is_dir():
+            return scheme, {}
+        tables = {}
+        for entry, path in scan_dir_resolved(per_sample_dir):
+            if entry.name.endswith(".tsv") and validate(path):
+                tables[entry.name[: -len(".tsv")]] = path
+        return scheme, tables
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return {
+            scheme: tables
+            for scheme, tables in executor.map(scan_scheme, scheme_dirs)
+            if tables
+        }
+
+
+def cgmlst_tables(
+    sample_dict: Mapping[str, Mapping[str, Any]],
+) -> dict[str, dict[str, str]]:
+    """The allele-call tables in a sample_dict: {scheme: {sample: table}}."""
+    schemes: dict[str, dict[str, str]] = {}
+    for sample, files in sample_dict.items():
+        for key, table in files.items():
+            if key.startswith(CGMLST_KEY_PREFIX):
+                schemes.setdefault(key[len(CGMLST_KEY_PREFIX) :], {})[sample] = table
+    return schemes
+
+
+def read_allele_calls(table: str | Path) -> dict[str, int]:
+    """Allele calls of one sample ({locus: allele}, missing calls are left out)."""
+    with open(table, newline="") as f:
+        rows = csv.reader(f, delimiter="\t")
+        header = next(rows, None)
+        calls = next(rows, None)
+    if header is None or calls is None:
+        return {}
+    alleles = {}
+    for locus, call in zip(header[1:], calls[1:]):
+        if match := _ALLELE_CALL.fullmatch(call):
+            alleles[locus] = int(match.group(1))
+    return alleles
+
+
+def _tables_signature(tables: Mapping[str, str]) -> str:
+    """Hash of the paths, sizes and modification times of the tables."""
+    checksum = hashlib.sha256()
+    for sample in sorted(tables):
+        stat = os.stat(tables[sample])
+        checksum.update(
+            f"{sample}\t{tables[sample]}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode()
+        )
+    return checksum.hexdigest()
+
+
+def build_allele_matrix(tables: Mapping[str, str]) -> Tuple[list[str], list[str], Any]:
+    """Allele matrix of the samples of one scheme.
+
+    Returns:
+        Tuple[list[str], list[str], numpy.ndarray]: The samples (rows), the loci (columns, in order of appearance) and the alleles (uint32, 0 for a missing call).
+    """
+    import numpy as np
+
+    samples = sorted(tables)
+    loci_index: dict[str, int] = {}
+    rows = []
+    for sample in samples:
+        calls = read_allele_calls(tables[sample])
+        rows.append(
+            {
+                loci_index.setdefault(locus, len(loci_index)): a
+                for locus, a in calls.items()
+            }
+        )
+    matrix = np.zeros((len(samples), len(loci_index)), dtype=np.uint32)
+    for i, row in enumerate(rows):
+        if row:
+            matrix[i, list(row.keys())] = list(row.values())
+    return samples, list(loci_index), matrix
+
+
+def cached_allele_matrix(matrix_dir: Path, tables: Mapping[str, str]) -> Path:
+    """Path of the allele matrix of a scheme, built if it is missing or outdated.
+
+    The matrix is stored in matrix_dir/allele_matrix.npz (matrix_dir is
+    created if needed) together with a signature of the tables it was built
+    from.
+    """
+    import numpy as np
+
+    matrix_dir.mkdir(parents=True, exist_ok=True)
+    matrix_file = matrix_dir.joinpath(ALLELE_MATRIX_FILE)
+    signature = _tables_signature(tables)
+    if matrix_file.exists():
+        with np.load(matrix_file) as cached:
+            if str(cached["signature"]) == signature:
+                return matrix_file
+    samples, loci, matrix = build_allele_matrix(tables)
+    tmp_file = matrix_dir.joinpath(f".{ALLELE_MATRIX_FILE}.{os.getpid()}.tmp.npz")
+    np.savez_compressed(
+        tmp_file,
+        samples=np.array(samples),
+        loci=np.array(loci),
+        alleles=matrix,
+        signature=np.array(signature),
+    )
+    os.replace(tmp_file, matrix_file)
+    return matrix_file
+
+
+def load_allele_matrix(matrix_file: str | Path) -> Tuple[list[str], list[str], Any]:
+    """Read an allele matrix written by cached_allele_matrix (samples, loci, alleles)."""
+    import numpy as np
+
+    with np.load(matrix_file) as cached:
+        return (
+            cached["samples"].tolist(),
+            cached["loci"].tolist(),
+            cached["alleles"],
+        )
@@ -0,0 +1,201 @@
+"""Layout and compaction of the logs that cluster jobs write.
+
+Every cluster job writes an .out and an .err file. They are written to one
+subdirectory per rule (log/cluster/<rule>/<rule>_<wildcards>_<jobid>.out)
+instead of a single flat directory. After a run, the logs are packed in an
+(uncompressed) tar archive and the offset and size of every log in the
+archive are stored in an SQLite index, so the logs of one job are read
+with one lookup and one seek instead of a search through the archive.
+
+The index is shared by all the runs with the same output directory (every
+run has its own archive). Logs can be fetched with:
+
+    python -m juno_library.cluster_logs output/log/cluster_logs.sqlite --jobid 12
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tarfile
+import time
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+# <rule>/<rule>_<wildcards>_<jobid>.<out|err>
+CLUSTER_LOG_PATTERN = re.compile(
+    r"(?P<rule>[^/]+)/.*_(?P<jobid>\d+)\.(?P<stream>out|err)$"
+)
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cluster_logs (
+    archive TEXT NOT NULL,
+    member TEXT NOT NULL,
+    rule TEXT,
+    jobid INTEGER,
+    stream TEXT,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    compacted_at TEXT NOT NULL,
+    PRIMARY KEY (archive, member)
+);
+CREATE INDEX IF NOT EXISTS cluster_logs_jobid ON cluster_logs (jobid);
+CREATE INDEX IF NOT EXISTS cluster_logs_rule ON cluster_logs (rule);
+"""
+
+
+def cluster_log_options(cluster_log_dir: Path) -> str:
+    """bsub options that write the logs of a job in the subdirectory of its rule."""
+    log_file = f"{cluster_log_dir}/{{name}}/{{name}}_{{wildcards}}_{{jobid}}"
+    return f"-o {log_file}.out -e {log_file}.err"
+
+
+def make_rule_log_dirs(cluster_log_dir: Path, rule_names: Iterable[str]) -> None:
+    """Create the log subdirectory of every rule (before the jobs are submitted)."""
+    for rule_name in rule_names:
+        cluster_log_dir.joinpath(rule_name).mkdir(parents=True, exist_ok=True)
+
+
+def _connect(index_db: Path) -> sqlite3.Connection:
+    connection = sqlite3.connect(index_db, timeout=60)
+    connection.executescript(_INDEX_SCHEMA)
+    return connection
+
+
+def compact_cluster_logs(
+    cluster_log_dir: Path, archive: Path, index_db: Path
+) -> dict[str, Any]:
+    """Pack the logs in cluster_log_dir in an indexed tar archive.
+
+    The logs are only removed once the archive is complete and indexed.
+
+    Args:
+        cluster_log_dir (Path): Directory with the logs (one subdirectory per rule).
+        archive (Path): Tar archive to create.
+        index_db (Path): SQLite index to add the logs to (created if needed).
+
+    Returns:
+        dict[str, Any]: Report with the number of logs, their size and the time spent.
+    """
+    start = time.perf_counter()
+    log_files = sorted(p for p in cluster_log_dir.rglob("*") if p.is_file())
+    if not log_files:
+        return {"files": 0, "bytes": 0, "seconds": 0.0}
+    tmp_archive = archive.with_name(archive.name + ".tmp")
+    with tarfile.open(tmp_archive, "w", format=tarfile.PAX_FORMAT) as tar:
+        for log_file in log_files:
+            tar.add(log_file, arcname=str(log_file.relative_to(cluster_log_dir)))
+    os.replace(tmp_archive, archive)
+
+    rows = []
+    compacted_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    with tarfile.open(archive, "r") as tar:
+        for member in tar.getmembers():
+            match = CLUSTER_LOG_PATTERN.match(member.name)
+            rows.append(
+                (
+                    str(archive.resolve()),
+                    member.name,
+                    match.group("rule") if match else None,
+                    int(match.group("jobid")) if match else None,
+                    match.group("stream") if match else None,
+                    member.offset_data,
+                    member.size,
+                    compacted_at,
+                )
+            )
+    with _connect(index_db) as connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO cluster_logs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+    connection.close()
+
+    for log_file in log_files:
+        log_file.unlink()
+    for dir_ in sorted(cluster_log_dir.rglob("*"), reverse=True):
+        if dir_.is_dir() and not any(dir_.iterdir()):
+            dir_.rmdir()
+    return {
+        "archive": str(archive),
+        "files": len(rows),
+        "bytes": sum(row[6] for row in rows),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def lookup_cluster_logs(
+    index_db: Path,
+    jobid: Optional[int] = None,
+    rule: Optional[str] = None,
+    member_like: Optional[str] = None,
+) -> list[dict[str, Any]]:
+    """Find logs in the index (most recently compacted first).
+
+    Args:
+        index_db (Path): The SQLite index.
+        jobid (Optional[int], optional): Snakemake job id. Defaults to None.
+        rule (Optional[str], optional): Rule name. Defaults to None.
+        member_like (Optional[str], optional): SQL LIKE pattern on the path of the log in the archive (e.g. '%sample=s1%'). Defaults to None.
+
+    Returns:
+        list[dict[str, Any]]: One dictionary per log with the archive, member, offset and size.
+    """
+    conditions, parameters = [], []
+    for column, operator, value in [
+        ("jobid", "=", jobid),
+        ("rule", "=", rule),
+        ("member", "LIKE", member_like),
+    ]:
+        if value is not None:
+            conditions.append(f"{column} {operator} ?")
+            parameters.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    connection = _connect(index_db)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            f"SELECT * FROM cluster_logs {where} ORDER BY compacted_at DESC, member",
+            parameters,
+        ).fetchall()
+    finally:
+        connection.close()
+    return [dict(row) for row in rows]
+
+
+def read_cluster_log(archive: str | Path, offset: int, size: int) -> bytes:
+    """Read one log from an archive using its offset and size in the index."""
+    with open(archive, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Print the cluster logs of a job from the compacted log archives."
+    )
+    parser.add_argument("index_db", type=Path, help="Path to cluster_logs.sqlite.")
+    parser.add_argument("--jobid", type=int, help="Snakemake job id.")
+    parser.add_argument("--rule", help="Rule name.")
+    parser.add_argument(
+        "--match", help="Text that the name of the log contains (e.g. sample=s1)."
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="Only list the matching logs."
+    )
+    args = parser.parse_args(argv)
+    member_like = f"%{args.match}%" if args.match else None
+    logs = lookup_cluster_logs(args.index_db, args.jobid, args.rule, member_like)
+    if not logs:
+        sys.exit("No logs found.")
+    for log in logs:
+        print(f"==> {log['archive']}:{log['member']} <==")
+        if not args.list:
+            content = read_cluster_log(log["archive"], log["offset"], log["size"])
+            print(content.decode(errors="replace"))
+
+
+if __name__ == "__main__":
+    main()
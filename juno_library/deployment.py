@@ -0,0 +1,192 @@
+"""Preparation of the software (containers and conda environments) used by
+the rules of a pipeline.
+
+Deploying software lazily inside the jobs means that the first job of every
+rule holds a cluster slot while the software is being downloaded and that
+concurrent jobs race on the same download. The functions in this module
+prepare everything in parallel before snakemake starts, using the same
+locations that snakemake itself uses, so snakemake finds it ready.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional, Tuple
+from uuid import uuid4
+
+from juno_library.helper_functions import file_lock
+
+PullImage = Callable[[str, Path], None]
+CreateEnv = Callable[[Any], None]
+
+
+def container_image_path(url: str, prefix: Path) -> Path:
+    """Location of a pulled image in the singularity prefix (as used by snakemake)."""
+    return prefix.joinpath(hashlib.md5(url.encode()).hexdigest() + ".simg")
+
+
+def is_remote_image(url: str) -> bool:
+    """Local images (paths or file://) are used by snakemake as they are."""
+    return "://" in url and not url.startswith("file://")
+
+
+def singularity_pull(url: str, destination: Path) -> None:
+    """Pull (and convert if needed) a container image with singularity."""
+    subprocess.run(
+        ["singularity", "pull", "--name", destination.name, url],
+        cwd=destination.parent,
+        check=True,
+        capture_output=True,
+    )
+
+
+def _fetch_image(url: str, prefix: Path, pull_image: PullImage) -> dict[str, Any]:
+    destination = container_image_path(url, prefix)
+    start = time.perf_counter()
+    status = "cached"
+    if not destination.exists():
+        # The lock prevents that pipelines running at the same time pull the
+        # same image. The image is pulled to a temporary file and moved
+        # afterwards so snakemake never sees a partially pulled image.
+        with file_lock(destination.with_name(destination.name + ".lock")):
+            if not destination.exists():
+                tmp_destination = destination.with_name(
+                    f"{destination.name}.{uuid4().hex}.tmp"
+                )
+                try:
+                    pull_image(url, tmp_destination)
+                    os.replace(tmp_destination, destination)
+                    status = "pulled"
+                except (OSError, subprocess.CalledProcessError) as e:
+                    tmp_destination.unlink(missing_ok=True)
+                    status = f"failed: {e}"
+    return {
+        "path": str(destination),
+        "status": status,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def prefetch_container_images(
+    images: Iterable[str],
+    prefix: Path,
+    max_workers: int = 4,
+    pull_image: Optional[PullImage] = None,
+) -> dict[str, Any]:
+    """Pull container images into the singularity prefix in parallel.
+
+    Images that are already present are not pulled again. A failed pull is
+    reported but not raised: snakemake will try (and report) it again.
+
+    Args:
+        images (Iterable[str]): Image URLs (e.g. docker://...).
+        prefix (Path): Singularity prefix where snakemake looks for the images.
+        max_workers (int, optional): Maximum number of images pulled at the same time. Defaults to 4.
+        pull_image (Optional[PullImage], optional): Function that pulls an image URL to a path. Defaults to singularity_pull.
+
+    Returns:
+        dict[str, Any]: Report with the time spent and the status per image.
+    """
+    pull_image = pull_image or singularity_pull
+    prefix.mkdir(parents=True, exist_ok=True)
+    remote_images = sorted({url for url in images if is_remote_image(url)})
+    start = time.perf_counter()
+
+    def fetch(url: str) -> Tuple[str, dict[str, Any]]:
+        assert pull_image is not None
+        return url, _fetch_image(url, prefix, pull_image)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        images_report = dict(executor.map(fetch, remote_images))
+    return {
+        "prefix": str(prefix),
+        "seconds": round(time.perf_counter() - start, 3),
+        "images": images_report,
+    }
+
+
+def _conda_env_is_ready(address: Path) -> bool:
+    """An environment is ready if it exists and its setup was not interrupted."""
+    interrupted = (
+        address.joinpath("env_setup_start").exists()
+        and not address.joinpath("env_setup_done").exists()
+    )
+    return address.exists() and not interrupted
+
+
+def create_conda_env(env: Any) -> None:
+    """Create a conda environment with snakemake (using the conda_frontend of its workflow)."""
+    env.create()
+
+
+def _create_env(env: Any, create_env: CreateEnv) -> dict[str, Any]:
+    address = Path(env.address)
+    start = time.perf_counter()
+    status = "cached"
+    if not _conda_env_is_ready(address):
+        address.parent.mkdir(parents=True, exist_ok=True)
+        # Other pipelines using the same prefix could be creating the same
+        # environment at the same time
+        with file_lock(address.with_name(address.name + ".lock")):
+            if not _conda_env_is_ready(address):
+                try:
+                    create_env(env)
+                    status = "created"
+                except Exception as e:
+                    status = f"failed: {e}"
+    return {
+        "hash": env.hash,
+        "path": str(address),
+        "status": status,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def precreate_conda_envs(
+    envs: Iterable[Any],
+    max_workers: int = 4,
+    create_env: Optional[CreateEnv] = None,
+) -> dict[str, Any]:
+    """Create the missing conda environments in parallel.
+
+    The environments are keyed on the hash that snakemake uses for them,
+    which depends on the content of the environment file and on the conda
+    prefix. Rules (or pipelines) using identical environment files with the
+    same prefix therefore share one environment, which is created only once.
+    A failed creation is reported but not raised: snakemake will try (and
+    report) it again.
+
+    Args:
+        envs (Iterable[Any]): snakemake Env objects (see snakefile_inspection.get_conda_envs).
+        max_workers (int, optional): Maximum number of environments created at the same time. Defaults to 4.
+        create_env (Optional[CreateEnv], optional): Function that creates an Env. Defaults to create_conda_env.
+
+    Returns:
+        dict[str, Any]: Cache report with the time spent and the status per environment file.
+    """
+    create_env = create_env or create_conda_env
+    unique_envs: dict[str, Any] = {}
+    env_files: dict[str, str] = {}
+    for env in envs:
+        unique_envs.setdefault(env.hash, env)
+        env_files[str(env.file)] = env.hash
+    start = time.perf_counter()
+
+    def create(env_hash: str) -> Tuple[str, dict[str, Any]]:
+        assert create_env is not None
+        return env_hash, _create_env(unique_envs[env_hash], create_env)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        by_hash = dict(executor.map(create, sorted(unique_envs)))
+    return {
+        "seconds": round(time.perf_counter() - start, 3),
+        "environments": {
+            env_file: by_hash[env_hash]
+            for env_file, env_hash in sorted(env_files.items())
+        },
+    }
@@ -0,0 +1,95 @@
+"""Fingerprint of everything that determines the setup of a pipeline run.
+
+If a pipeline is relaunched (e.g. after a problem in the cluster) with the
+same fingerprint as the previous launch, the samples, sample sheet and audit
+trail of the previous launch are still valid and the setup can be skipped.
+
+The input directory is fingerprinted by the names of its entries and the
+modification times of its subdirectories, which change when an entry is
+added, removed or renamed. Files are not stat'ed, so the fingerprint costs
+one metadata call per directory instead of one per file (as the scan of the
+input directory itself); a file rewritten in place under the same name is
+only seen with --force-rescan.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterator, Optional, Tuple
+
+# Depth up to which the input directory is listed. Covers the layouts of
+# the outputs of other Juno pipelines (e.g. <typing>/consensus/<sample>.fasta)
+FINGERPRINT_DEPTH = 3
+
+
+def _listing(
+    dir: str, root: str, max_depth: int
+) -> Iterator[Tuple[str, Optional[int], bool]]:
+    with os.scandir(dir) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            # The type comes from the directory itself (no stat), except
+            # for symlinks
+            is_dir = entry.is_dir()
+            mtime = None
+            if is_dir:
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except FileNotFoundError:  # removed while listing
+                    continue
+            yield os.path.relpath(entry.path, root), mtime, is_dir
+            if is_dir and max_depth > 1:
+                yield from _listing(entry.path, root, max_depth - 1)
+
+
+def directory_listing(
+    dir: str | Path, max_depth: int = FINGERPRINT_DEPTH
+) -> list[Tuple[str, Optional[int], bool]]:
+    """Names (relative to dir) and type of the entries in dir, with the modification time of the subdirectories.
+
+    Args:
+        dir (str | Path): The directory to list.
+        max_depth (int, optional): Levels of subdirectories that are listed. Defaults to FINGERPRINT_DEPTH.
+
+    Returns:
+        list[Tuple[str, Optional[int], bool]]: (name, mtime in ns or None for files, is_dir) per entry, sorted by name.
+    """
+    return list(_listing(str(dir), str(dir), max_depth))
+
+
+def launch_fingerprint(
+    input_dir: Path,
+    argv: list[str],
+    user_parameters: dict[str, Any],
+    exclusion_file: Optional[Path] = None,
+    max_depth: int = FINGERPRINT_DEPTH,
+    **extra: Any,
+) -> str:
+    """Hash (sha256) of the input directory listing, the arguments, the user parameters and the exclusion file.
+
+    Args:
+        input_dir (Path): The input directory of the run.
+        argv (list[str]): The command line arguments of the run.
+        user_parameters (dict[str, Any]): The user parameters of the run.
+        exclusion_file (Optional[Path], optional): The exclusion file of the run, if any. Defaults to None.
+        max_depth (int, optional): Levels of subdirectories of input_dir that are listed. Defaults to FINGERPRINT_DEPTH.
+        **extra: Other settings that determine the samples of the run (e.g. input_type).
+
+    Returns:
+        str: The fingerprint.
+    """
+    exclusion = None
+    if exclusion_file is not None:
+        exclusion = hashlib.sha256(Path(exclusion_file).read_bytes()).hexdigest()
+    content = {
+        "listing": directory_listing(input_dir, max_depth),
+        "argv": argv,
+        "user_parameters": user_parameters,
+        "exclusion_file": exclusion,
+        **extra,
+    }
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
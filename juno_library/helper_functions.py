@@ -1,11 +1,24 @@
 from __future__ import annotations
 import argparse
+import fcntl
+import fnmatch
+import mmap
+import os
 import subprocess
 import pathlib
-from typing import Sequence, Optional, Any
+import re
+import socket
+import stat
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, Sequence, Optional, Any, Tuple, TypeVar
 import inspect
 import snakemake
 import ast
+import yaml
 
 # Helper functions for text manipulation
 
@@ -35,8 +48,12 @@ def error_formatter(message: str) -> str:
 def validate_is_nonempty_file(
     file_path: str | pathlib.Path, min_file_size: int = 0
 ) -> bool:
-    file_path = pathlib.Path(file_path)
-    return file_path.is_file() and file_path.stat().st_size >= min_file_size
+    # One stat call (instead of is_file() followed by stat())
+    try:
+        file_stat = os.stat(file_path)
+    except (OSError, ValueError):
+        return False
+    return stat.S_ISREG(file_stat.st_mode) and file_stat.st_size >= min_file_size
 
 
 def is_gz_file(filepath: str | pathlib.Path) -> bool:
@@ -44,6 +61,73 @@ def is_gz_file(filepath: str | pathlib.Path) -> bool:
         return file_.read(2) == b"\x1f\x8b"
 
 
+# Size of the slices of a mapped file that are searched at once
+MMAP_CHUNK_SIZE = 1024**2
+
+
+def count_lines(file_path: str | pathlib.Path, max_lines: Optional[int] = None) -> int:
+    """
+    Count the lines of an (uncompressed) file, the last one also if it
+    does not end with a newline. The file is memory mapped and newlines are
+    counted per chunk, without creating an object per line. Counting stops
+    once max_lines is reached (the result is then at least max_lines).
+    """
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lines = 0
+            for start in range(0, size, MMAP_CHUNK_SIZE):
+                lines += mm[start : start + MMAP_CHUNK_SIZE].count(b"\n")
+                if max_lines is not None and lines >= max_lines:
+                    return lines
+            return lines + (mm[size - 1 : size] != b"\n")
+
+
+def _next_fasta_header(mm: mmap.mmap, start: int) -> int:
+    """Start of the first header line after position start (-1 if none)."""
+    newline = mm.find(b"\n>", start)
+    return -1 if newline == -1 else newline + 1
+
+
+def fasta_stats(file_path: str | pathlib.Path) -> dict[str, int]:
+    """
+    Number of sequences and their total length in an (uncompressed) FASTA
+    file. The file is memory mapped: only the header lines are located,
+    the length follows from the file size minus the headers and the line
+    endings.
+    """
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return {"sequences": 0, "total_length": 0}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Carriage returns are only counted in files that have them
+            has_cr = mm.find(b"\r") != -1
+            line_endings = 0
+            for start in range(0, size, MMAP_CHUNK_SIZE):
+                chunk = mm[start : start + MMAP_CHUNK_SIZE]
+                line_endings += chunk.count(b"\n")
+                if has_cr:
+                    line_endings += chunk.count(b"\r")
+            sequences, header_bytes = 0, 0
+            header = 0 if mm[:1] == b">" else _next_fasta_header(mm, 0)
+            while header != -1:
+                end = mm.find(b"\n", header)
+                end = size if end == -1 else end + 1
+                header_line = mm[header:end]
+                sequences += 1
+                # The line endings of the header are already in header_bytes
+                header_bytes += end - header
+                line_endings -= header_line.count(b"\n") + header_line.count(b"\r")
+                header = _next_fasta_header(mm, end - 1)
+            return {
+                "sequences": sequences,
+                "total_length": size - header_bytes - line_endings,
+            }
+
+
 def validate_file_has_min_lines(
     file_path: str | pathlib.Path, min_num_lines: int = -1
 ) -> bool:
@@ -53,6 +137,11 @@ def validate_file_has_min_lines(
     """
     if not validate_is_nonempty_file(file_path, min_file_size=1):
         return False
+    elif min_num_lines <= 1:
+        # A non-empty file has at least one line
+        return True
+    elif not is_gz_file(file_path):
+        return count_lines(file_path, max_lines=min_num_lines) >= min_num_lines
     else:
         with open(file_path, "rb") as f:
             line = 0
@@ -65,6 +154,292 @@ def validate_file_has_min_lines(
         return file_right_num_lines
 
 
+# A BAM file is a series of BGZF blocks (gzip members with a BC extra field
+# holding the size of the block) that ends with a fixed, empty EOF block. The
+# uncompressed data starts with the BAM magic.
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+BAM_MAGIC = b"BAM\x01"
+BAM_INDEX_EXTENSIONS = (".bai", ".csi")
+
+
+def validate_bam(file_path: str | pathlib.Path) -> bool:
+    """
+    Test if a file is a complete BAM file: it starts with a BGZF block
+    that decompresses to the BAM magic and ends with the BGZF EOF block
+    (which is missing if the file was truncated). Only the first block
+    (at most 64 kB) and the last 28 bytes are read, whatever the size of
+    the file. Returns True/False
+    """
+    try:
+        with open(file_path, "rb") as f:
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != BGZF_MAGIC:
+                return False
+            extra_length = int.from_bytes(header[10:12], "little")
+            extra = f.read(extra_length)
+            block_size = None
+            i = 0
+            while i + 4 <= len(extra):
+                subfield_length = int.from_bytes(extra[i + 2 : i + 4], "little")
+                if extra[i : i + 2] == b"BC" and subfield_length == 2:
+                    block_size = int.from_bytes(extra[i + 4 : i + 6], "little") + 1
+                i += 4 + subfield_length
+            if block_size is None:
+                return False
+            compressed = f.read(block_size - 12 - extra_length - 8)
+            try:
+                start = zlib.decompressobj(-15).decompress(compressed, len(BAM_MAGIC))
+            except zlib.error:
+                return False
+            if start != BAM_MAGIC:
+                return False
+            f.seek(-len(BGZF_EOF), os.SEEK_END)
+            return f.read() == BGZF_EOF
+    except OSError:
+        return False
+
+
+def find_bam_index(file_path: str | pathlib.Path) -> Tuple[Optional[str], str]:
+    """
+    Find the index (.bai or .csi) of a BAM file: sample.bam.bai,
+    sample.bam.csi or sample.bai. An index is fresh if it is not older than
+    the BAM file. Returns the path of the fresh index (or None) and the
+    status: 'fresh', 'stale' or 'missing'.
+    """
+    file_path = str(file_path)
+    bam_mtime = os.stat(file_path).st_mtime
+    candidates = [file_path + extension for extension in BAM_INDEX_EXTENSIONS]
+    candidates.append(os.path.splitext(file_path)[0] + ".bai")
+    status = "missing"
+    for candidate in candidates:
+        try:
+            index_mtime = os.stat(candidate).st_mtime
+        except FileNotFoundError:
+            continue
+        if index_mtime >= bam_mtime:
+            return candidate, "fresh"
+        status = "stale"
+    return None, status
+
+
+def scan_dir_resolved(
+    dir: str | pathlib.Path,
+) -> Iterator[Tuple[os.DirEntry[str], str]]:
+    """
+    Iterate over the entries of a directory together with their resolved
+    (absolute, without symlinks) path. The directory is resolved only once
+    and the names of the entries are joined to it. Only entries that are
+    symlinks themselves are resolved individually, which avoids that every
+    component of the path is checked for every file (slow on NFS).
+    """
+    resolved_dir = os.path.realpath(dir)
+    with os.scandir(resolved_dir) as entries:
+        for entry in entries:
+            if entry.is_symlink():
+                yield entry, os.path.realpath(entry.path)
+            else:
+                yield entry, os.path.join(resolved_dir, entry.name)
+
+
+def _compile_patterns(patterns: Sequence[str]) -> Optional[re.Pattern[str]]:
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+def _scan_dirs(
+    dirs: Sequence[Tuple[str, str]],
+) -> list[Tuple[os.DirEntry[str], str, str]]:
+    """Entries of (resolved dir, dir relative to the root) pairs, with their resolved and relative paths."""
+    scanned = []
+    for dir, relative_dir in dirs:
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                scanned.append(
+                    (
+                        entry,
+                        (
+                            os.path.realpath(entry.path)
+                            if entry.is_symlink()
+                            else os.path.join(dir, entry.name)
+                        ),
+                        os.path.join(relative_dir, entry.name),
+                    )
+                )
+    return scanned
+
+
+def walk_dir_resolved(
+    dir: str | pathlib.Path,
+    max_depth: int,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    max_workers: int = 16,
+) -> list[Tuple[os.DirEntry[str], str]]:
+    """
+    Recursive version of scan_dir_resolved: the files (not the directories)
+    in dir and its subdirectories, up to max_depth levels below dir, with
+    their resolved path. The directories of one level are scanned at the
+    same time in a thread pool, which hides the latency of the filesystem.
+    Symlinked directories are followed, every directory is scanned once.
+
+    The fnmatch patterns are matched against the name of an entry and its
+    path relative to dir. Entries (also directories) that match an exclude
+    pattern are skipped. If include patterns are given, only the files that
+    match one of them are returned.
+    """
+    include_pattern = _compile_patterns(include)
+    exclude_pattern = _compile_patterns(exclude)
+    root = os.path.realpath(dir)
+    visited = {root}
+    level = [(root, "")]
+    files = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for depth in range(max_depth + 1):
+            subdirs = []
+            # A few batches of directories per thread, a task per directory
+            # costs more than scanning it on a fast filesystem
+            batch_size = max(1, len(level) // (4 * max_workers))
+            batches = [
+                level[i : i + batch_size] for i in range(0, len(level), batch_size)
+            ]
+            for scanned in executor.map(_scan_dirs, batches):
+                for entry, resolved, relative in scanned:
+                    if exclude_pattern is not None and (
+                        exclude_pattern.match(entry.name)
+                        or exclude_pattern.match(relative)
+                    ):
+                        continue
+                    if entry.is_dir():
+                        if depth < max_depth and resolved not in visited:
+                            visited.add(resolved)
+                            subdirs.append((resolved, relative))
+                    elif include_pattern is None or (
+                        include_pattern.match(entry.name)
+                        or include_pattern.match(relative)
+                    ):
+                        files.append((entry, resolved))
+            level = subdirs
+    return files
+
+
+@contextmanager
+def file_lock(lock_file: str | pathlib.Path) -> Iterator[None]:
+    """
+    Context manager that holds an exclusive lock on lock_file. The lock
+    (fcntl.flock) is respected by other threads and processes, also from
+    other pipeline runs, that lock the same file.
+    """
+    with open(lock_file, "a") as file_:
+        fcntl.flock(file_, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file_, fcntl.LOCK_UN)
+
+
+def write_yaml_atomic(
+    content: Any, file_path: pathlib.Path, sort_keys: bool = True
+) -> None:
+    """
+    Write content as yaml to a temporary file that is then renamed to
+    file_path, so readers (e.g. another pipeline run) never see a partially
+    written file. With sort_keys=False, dictionaries keep their order.
+    """
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_file, "w") as f:
+            yaml.dump(content, f, sort_keys=sort_keys)
+        os.replace(tmp_file, file_path)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+# Helper functions for splitting work and resources
+
+T = TypeVar("T")
+
+
+def split_budget(total: int, weights: Sequence[float]) -> list[int]:
+    """Split an integer budget proportionally to weights.
+
+    Uses the largest remainder method so the parts always add up to the
+    total. Every part gets at least 1 if the total allows it.
+
+    Args:
+        total (int): The budget to split.
+        weights (Sequence[float]): One (positive) weight per part.
+
+    Returns:
+        list[int]: The budget assigned to every part.
+    """
+    if not weights:
+        return []
+    assert all(w > 0 for w in weights), "All weights should be positive."
+    n_parts = len(weights)
+    if total <= n_parts:
+        return [1 if i < total else 0 for i in range(n_parts)]
+    # Every part gets 1 beforehand, the rest is divided proportionally
+    rest = total - n_parts
+    sum_weights = sum(weights)
+    exact = [rest * w / sum_weights for w in weights]
+    parts = [int(x) for x in exact]
+    leftover = rest - sum(parts)
+    by_remainder = sorted(
+        range(n_parts), key=lambda i: exact[i] - parts[i], reverse=True
+    )
+    for i in by_remainder[:leftover]:
+        parts[i] += 1
+    return [part + 1 for part in parts]
+
+
+def split_sample_dict(sample_dict: dict[str, T], n_shards: int) -> list[dict[str, T]]:
+    """
+    Split a sample_dict in (at most) n_shards dictionaries of similar size.
+    Samples are sorted by name so the same samples end up in the same shard
+    every time.
+    """
+    samples = sorted(sample_dict)
+    n_shards = max(1, min(n_shards, len(samples)))
+    sizes = split_budget(len(samples), [1] * n_shards)
+    shards = []
+    start = 0
+    for size in sizes:
+        shards.append(
+            {sample: sample_dict[sample] for sample in samples[start : start + size]}
+        )
+        start += size
+    return shards
+
+
+# Helper functions for running external commands
+
+# Wall time (in seconds) of every call to an external command (git, conda,
+# reference indexers) made by the library, per command. Reported by
+# --profile, which clears it at the start of every profiled run.
+subprocess_timings: defaultdict[str, list[float]] = defaultdict(list)
+
+
+@contextmanager
+def timed_subprocess(command: str) -> Iterator[None]:
+    """
+    Context manager that adds the wall time of the block to
+    subprocess_timings[command].
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        subprocess_timings[command].append(time.perf_counter() - start)
+
+
+def get_hostname() -> str:
+    """Function to get the name of the host"""
+    return socket.gethostname()
+
+
 # Helper functions for handling git repositories
 
 
@@ -102,10 +477,11 @@ def get_repo_url(gitrepo_dir: str | pathlib.Path) -> str:
     it as a git repo
     """
     try:
-        url_bytes = subprocess.check_output(
-            ["git", "config", "--get", "remote.origin.url"],
-            cwd=f"{str(gitrepo_dir)}",
-        ).strip()
+        with timed_subprocess("git"):
+            url_bytes = subprocess.check_output(
+                ["git", "config", "--get", "remote.origin.url"],
+                cwd=f"{str(gitrepo_dir)}",
+            ).strip()
         url = url_bytes.decode()
     except:
         url = "Not available. This might be because this folder is not a repository or it was downloaded manually instead of through the command line."
@@ -117,18 +493,19 @@ def get_commit_git(gitrepo_dir: str | pathlib.Path) -> str:
     Function to get the commit number from a folder (must be a git repo)
     """
     try:
-        commit_bytes = subprocess.check_output(
-            [
-                "git",
-                "--git-dir",
-                f"{str(gitrepo_dir)}/.git",
-                "log",
-                "-n",
-                "1",
-                '--pretty=format:"%H"',
-            ],
-            timeout=30,
-        )
+        with timed_subprocess("git"):
+            commit_bytes = subprocess.check_output(
+                [
+                    "git",
+                    "--git-dir",
+                    f"{str(gitrepo_dir)}/.git",
+                    "log",
+                    "-n",
+                    "1",
+                    '--pretty=format:"%H"',
+                ],
+                timeout=30,
+            )
         commit = commit_bytes.decode()
     except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
         commit = "Not available. This might be because this folder is not a repository or it was downloaded manually instead of through the command line."
@@ -0,0 +1,141 @@
+"""Detection of the cores and memory that are available to this process.
+
+Used to size local runs so snakemake does not schedule more threads or
+memory (mem_gb resources) than the host, or the container/cgroup the
+pipeline runs in, can offer.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+PROC_SELF_CGROUP = Path("/proc/self/cgroup")
+# cgroup v1 reports 'no limit' as a very large number (close to 2^63)
+_CGROUP_V1_UNLIMITED = 2**60
+# Fraction of the memory limit that is offered to the jobs. The rest is
+# left for snakemake itself and the operating system.
+MEMORY_FRACTION_FOR_JOBS = 0.9
+
+
+@dataclass
+class HostResources:
+    """Cores and memory (in GB) available to the pipeline on this host."""
+
+    cores: int
+    mem_gb: int
+    cores_source: str
+    mem_source: str
+
+
+def _read_text(file_path: Path) -> Optional[str]:
+    try:
+        return file_path.read_text().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_paths(proc_self_cgroup: Path) -> Dict[str, str]:
+    """Map every cgroup controller (or '' for cgroup v2) to the path of this process."""
+    paths: Dict[str, str] = {}
+    content = _read_text(proc_self_cgroup) or ""
+    for line in content.splitlines():
+        _, controllers, path = line.split(":", 2)
+        for controller in controllers.split(","):
+            paths[controller] = path.lstrip("/")
+    return paths
+
+
+def _candidate_dirs(
+    cgroup_root: Path, controller_dir: str, cgroup_path: Optional[str]
+) -> list[Path]:
+    """Directories where the files of a controller could be found.
+
+    Inside containers the path in /proc/self/cgroup is often not mounted
+    and the cgroup of the container is the root of the hierarchy instead.
+    """
+    base = cgroup_root.joinpath(controller_dir) if controller_dir else cgroup_root
+    dirs = [base.joinpath(cgroup_path)] if cgroup_path else []
+    dirs.append(base)
+    return dirs
+
+
+def get_cgroup_cpu_limit(
+    cgroup_root: Path = CGROUP_ROOT, proc_self_cgroup: Path = PROC_SELF_CGROUP
+) -> Optional[float]:
+    """CPU quota of the cgroup (in number of CPUs) or None if there is no quota."""
+    paths = _cgroup_paths(proc_self_cgroup)
+    # cgroup v2
+    for dir_ in _candidate_dirs(cgroup_root, "", paths.get("")):
+        cpu_max = _read_text(dir_.joinpath("cpu.max"))
+        if cpu_max is not None:
+            quota, period = cpu_max.split()
+            return None if quota == "max" else int(quota) / int(period)
+    # cgroup v1
+    for controller_dir in ["cpu", "cpu,cpuacct"]:
+        for dir_ in _candidate_dirs(cgroup_root, controller_dir, paths.get("cpu")):
+            quota_us = _read_text(dir_.joinpath("cpu.cfs_quota_us"))
+            period_us = _read_text(dir_.joinpath("cpu.cfs_period_us"))
+            if quota_us is not None and period_us is not None:
+                return None if int(quota_us) <= 0 else int(quota_us) / int(period_us)
+    return None
+
+
+def get_cgroup_memory_limit(
+    cgroup_root: Path = CGROUP_ROOT, proc_self_cgroup: Path = PROC_SELF_CGROUP
+) -> Optional[int]:
+    """Memory limit of the cgroup in bytes or None if there is no limit."""
+    paths = _cgroup_paths(proc_self_cgroup)
+    # cgroup v2
+    for dir_ in _candidate_dirs(cgroup_root, "", paths.get("")):
+        memory_max = _read_text(dir_.joinpath("memory.max"))
+        if memory_max is not None:
+            return None if memory_max == "max" else int(memory_max)
+    # cgroup v1
+    for dir_ in _candidate_dirs(cgroup_root, "memory", paths.get("memory")):
+        limit = _read_text(dir_.joinpath("memory.limit_in_bytes"))
+        if limit is not None:
+            return None if int(limit) >= _CGROUP_V1_UNLIMITED else int(limit)
+    return None
+
+
+def get_cpu_affinity_count() -> int:
+    """Number of CPUs this process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available in all platforms (e.g. macOS)
+        return os.cpu_count() or 1
+
+
+def get_physical_memory() -> int:
+    """Total physical memory of the host in bytes."""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def detect_host_resources(
+    cgroup_root: Path = CGROUP_ROOT, proc_self_cgroup: Path = PROC_SELF_CGROUP
+) -> HostResources:
+    """Detect the cores and memory that can be used by local jobs.
+
+    The cores are the CPUs in the affinity mask of this process, limited by
+    the CPU quota of its cgroup (v1 or v2) if any. The memory is the
+    physical memory, limited by the memory limit of the cgroup if any, from
+    which only a fraction (MEMORY_FRACTION_FOR_JOBS) is offered to the jobs.
+    """
+    cores, cores_source = get_cpu_affinity_count(), "cpu_affinity"
+    cpu_limit = get_cgroup_cpu_limit(cgroup_root, proc_self_cgroup)
+    if cpu_limit is not None and math.floor(cpu_limit) < cores:
+        cores, cores_source = max(1, math.floor(cpu_limit)), "cgroup_cpu_quota"
+
+    memory, mem_source = get_physical_memory(), "physical_memory"
+    memory_limit = get_cgroup_memory_limit(cgroup_root, proc_self_cgroup)
+    if memory_limit is not None and memory_limit < memory:
+        memory, mem_source = memory_limit, "cgroup_memory_limit"
+    mem_gb = max(1, math.floor(memory * MEMORY_FRACTION_FOR_JOBS / 1024**3))
+    return HostResources(
+        cores=cores, mem_gb=mem_gb, cores_source=cores_source, mem_source=mem_source
+    )
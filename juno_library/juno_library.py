@@ -7,11 +7,19 @@ RIVM.
 All of our pipelines use Snakemake.
 """
 
+import hashlib
+import io
+import multiprocessing
+import os
 import pathlib
 import re
 import shutil
+import sqlite3
 import subprocess
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext, redirect_stderr
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
@@ -26,20 +34,115 @@ from juno_library.helper_functions import (
     error_formatter,
     SnakemakeKwargsAction,
     validate_file_has_min_lines,
+    validate_bam,
+    find_bam_index,
+    fasta_stats,
     get_commit_git,
     get_repo_url,
+    get_hostname,
+    file_lock,
+    scan_dir_resolved,
+    walk_dir_resolved,
+    timed_subprocess,
+    split_budget,
+    split_sample_dict,
+    write_yaml_atomic,
+)
+from juno_library.capacity import (
+    DEFAULT_OUTPUT_FACTOR,
+    DryRunJobs,
+    format_capacity_report,
+    free_bytes,
+    input_bytes,
+    plan_capacity,
+)
+from juno_library.cgmlst import (
+    CGMLST_FINGERPRINT_DEPTH,
+    CGMLST_KEY_PREFIX,
+    cached_allele_matrix,
+    cgmlst_tables,
+    discover_cgmlst_results,
+)
+from juno_library.cluster_logs import (
+    cluster_log_options,
+    compact_cluster_logs,
+    make_rule_log_dirs,
+)
+from juno_library.deployment import precreate_conda_envs, prefetch_container_images
+from juno_library.fingerprint import FINGERPRINT_DEPTH, launch_fingerprint
+from juno_library.host_resources import detect_host_resources
+from juno_library.latency import (
+    SubmitProbe,
+    latency_report,
+    latency_wait_from_delays,
+    lsf_submitter,
+    measure_latency,
+    submit_local,
+)
+from juno_library.pipeline_config import BatchResult, PipelineConfig, SharedCaches
+from juno_library.prioritization import (
+    PRIORITY_COLUMN,
+    SAMPLE_WILDCARD,
+    prioritize_samples,
+    priorities_from_metadata,
+    priority_targets,
+    read_priority_file,
+)
+from juno_library.profiling import PhaseProfiler
+from juno_library.retries import (
+    DEFAULT_MEM_FACTOR,
+    DEFAULT_TIME_FACTOR,
+    escalating_resources,
+    retry_report,
+)
+from juno_library.reference_cache import (
+    REFERENCE_INDEXES,
+    default_reference_cache,
+    prepare_reference,
+)
+from juno_library.run_registry import RunRegistry, configured_registry_path
+from juno_library.sample_table import SAMPLE_FILE_KEYS, SampleTable
+from juno_library.staging import STAGE_MODES, cleanup_scratch, stage_samples
+from juno_library.snakefile_inspection import (
+    get_conda_envs,
+    get_container_images,
+    get_rules_without_wildcard,
+    load_workflow,
+)
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Hashable,
+    Mapping,
+    Optional,
+    Dict,
+    Iterable,
+    Tuple,
+    TypeVar,
+    cast,
+    List,
+    Union,
 )
-from typing import Any, Optional, Dict, Tuple, cast, List, Union
 import argparse
 
+P = TypeVar("P", bound="Pipeline")
+T = TypeVar("T")
+
+
+def _run_snakemake(snakemake_kwargs: dict[str, Any]) -> bool:
+    """Run snakemake with the given arguments (used to run it in a subprocess)."""
+    successful: bool = snakemake(**snakemake_kwargs)
+    return successful
+
 
 @dataclass()
 class Pipeline:
     """Class to perform actions that need to be done before running a pipeline.
 
     This class checks that input directory exists and has the expected
-    input files, generates a dictionary (sample_dict) with sample names
-    and their corresponding files, makes a dictionary with metadata if
+    input files, generates a dictionary (sample_dict, a SampleTable) with
+    sample names and their corresponding files, makes a dictionary with metadata if
     necessary. It has been written to be adapted to different pipelines
     accepting fastq and/or fasta files as input.
     """
@@ -56,18 +159,44 @@ class Pipeline:
 
     excluded_samples: set[str] = field(default_factory=set)
     min_num_lines: int = -1
+    # Add the number of sequences and total length of every assembly to the
+    # sample sheet (as assembly_sequences and assembly_length)
+    assembly_stats: bool = False
 
-    # Setup some audit trail params
-    date_and_time: str = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
-    unique_id: UUID = uuid4()
-    hostname: str = str(subprocess.check_output(["hostname"]).strip().decode("utf-8"))
+    # Setup some audit trail params (set when the pipeline is created)
+    date_and_time: str = field(
+        default_factory=lambda: datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    )
+    unique_id: UUID = field(default_factory=uuid4)
+    hostname: str = field(default_factory=get_hostname)
 
     # These are passed to snakemake
     snakefile: str = "Snakefile"
-    sample_sheet: Path = pathlib.Path("config/sample_sheet.yaml").resolve()
+    # Rules that combine the results of all samples. In a sharded run (--shards)
+    # the shards stop before these rules, which run in a final invocation.
+    aggregation_rules: list[str] = field(default_factory=list)
+    # Indexes of the reference (see REFERENCE_INDEXES: fai, dict, bwa, minimap2)
+    # that the pipeline needs. They are prepared in the shared reference cache
+    # and their paths are added to the samples as reference_<index>.
+    reference_indexes: list[str] = field(default_factory=list)
+    # Size of the output relative to the input, used by --plan when the rules
+    # do not declare a disk_mb resource
+    capacity_output_factor: float = DEFAULT_OUTPUT_FACTOR
+    # Column of juno_metadata (see get_metadata_from_csv_file) with the
+    # priority of every sample, used if no --priority-file is given
+    priority_column: str = PRIORITY_COLUMN
+    # Growth of the memory request and the time limit of a cluster job for
+    # every time LSF killed it for that resource (see --retries)
+    retry_mem_factor: float = DEFAULT_MEM_FACTOR
+    retry_time_factor: float = DEFAULT_TIME_FACTOR
+    # The sample sheet and user_parameters file are created during the pipeline
+    # run to start snakemake with. {unique_id} in their paths is replaced by the
+    # unique_id of the run, so several runs can be started from the same
+    # directory. The files with the default (per run) paths are removed after
+    # the run, the audit trail keeps a copy.
+    sample_sheet: Path = pathlib.Path("config/sample_sheet_{unique_id}.yaml")
     user_parameters: dict[str, Any] = field(default_factory=dict)
-    # user_parameters is created during the pipeline run to start snakemake with
-    user_parameters_file: Path = pathlib.Path("config/user_parameters.yaml").resolve()
+    user_parameters_file: Path = pathlib.Path("config/user_parameters_{unique_id}.yaml")
     # snakemake_config should be specified in the pipeline repository and has default values
     snakemake_config: dict[str, Any] = field(default_factory=dict)
     snakemake_args: dict[str, Any] = field(
@@ -92,10 +221,23 @@ class Pipeline:
     argv: list[str] = field(
         default_factory=lambda: [x for x in sys.argv if not x.endswith(".py")]
     )
+    # Set by from_config: the settings are taken from this config instead of
+    # being parsed from argv
+    pipeline_config: Optional[PipelineConfig] = None
+    # Caches shared with the other pipelines of a batch (see run_batch)
+    shared_caches: Optional[SharedCaches] = None
 
     def __post_init__(
         self,
     ) -> None:
+        self._per_run_files: list[Path] = []
+        self._given_sample_dict: Optional[SampleTable] = None
+        # The limits of the pipeline itself, before a local run replaces them
+        # by those of the host (see _set_local_resources)
+        self._pipeline_limits: dict[str, Any] = {
+            "cores": self.snakemake_args["cores"],
+            "mem_gb": (self.snakemake_args.get("resources") or {}).get("mem_gb"),
+        }
         # TODO: remove this line when self.input_type is a tuple in all pipelines
         if isinstance(self.input_type, str):
             assert self.input_type in [
@@ -113,10 +255,92 @@ class Pipeline:
                 [x in ["fastq", "fasta", "vcf", "bam"] for x in self.input_type]
             ), "if input_type is a tuple, the values can only be 'fastq', 'fasta', 'vcf' or 'bam'"
 
+        self.sample_sheet = self.__per_run_path(self.sample_sheet)
+        self.user_parameters_file = self.__per_run_path(self.user_parameters_file)
         self.snakemake_config["sample_sheet"] = str(self.sample_sheet)
         self.add_argument = self.parser.add_argument
         self._add_args_to_parser()
 
+    def __per_run_path(self, path: Path) -> Path:
+        """Path with {unique_id} replaced by the unique_id of this run."""
+        if "{unique_id}" not in str(path):
+            return path
+        self._per_run_files.append(
+            pathlib.Path(
+                str(path).replace("{unique_id}", str(self.unique_id))
+            ).resolve()
+        )
+        return self._per_run_files[-1]
+
+    @classmethod
+    def from_config(
+        cls: type[P],
+        config: PipelineConfig,
+        sample_dict: Optional[Mapping[str, Mapping[str, Any]]] = None,
+        shared_caches: Optional[SharedCaches] = None,
+        **kwargs: Any,
+    ) -> P:
+        """Create a pipeline that takes its settings from config instead of argv.
+
+        Args:
+            config (PipelineConfig): The settings of the run.
+            sample_dict (Optional[Mapping[str, Mapping[str, Any]]], optional): Samples found (and validated) before, e.g. by the setup of another pipeline. If given, the input directory is not scanned. Defaults to None.
+            shared_caches (Optional[SharedCaches], optional): Caches shared with other pipelines in this process. Defaults to None.
+            **kwargs: Other arguments of the pipeline (e.g. pipeline_name).
+
+        Returns:
+            Pipeline: The pipeline (of the class this method is called on).
+        """
+        pipeline = cls(
+            argv=[], pipeline_config=config, shared_caches=shared_caches, **kwargs
+        )
+        if sample_dict is not None:
+            pipeline._given_sample_dict = SampleTable(
+                {sample: dict(record) for sample, record in sample_dict.items()}
+            )
+        return pipeline
+
+    @classmethod
+    def run_batch(
+        cls,
+        configs: Iterable[PipelineConfig],
+        shared_caches: Optional[SharedCaches] = None,
+        **kwargs: Any,
+    ) -> list[BatchResult]:
+        """Run the pipeline for every config, one after the other, in this process.
+
+        The runs share their caches: input files that were already validated
+        are not read again, an input directory that was already scanned (with
+        the same settings and unchanged) is not scanned again and the
+        metadata of the audit trail is collected once. A failing run does
+        not stop the batch.
+
+        Args:
+            configs (Iterable[PipelineConfig]): The settings of every run.
+            shared_caches (Optional[SharedCaches], optional): Caches to start from (e.g. of a previous batch). Defaults to new caches.
+            **kwargs: Other arguments of the pipelines (e.g. pipeline_name).
+
+        Returns:
+            list[BatchResult]: The outcome of every run, in the order of configs.
+        """
+        shared_caches = shared_caches if shared_caches is not None else SharedCaches()
+        results = []
+        for config in configs:
+            start = time.perf_counter()
+            try:
+                cls.from_config(config, shared_caches=shared_caches, **kwargs).run()
+                results.append(BatchResult(config, True, time.perf_counter() - start))
+            except Exception as e:
+                print(
+                    error_formatter(
+                        f"The run with input {config.input_dir} failed: {e}"
+                    )
+                )
+                results.append(
+                    BatchResult(config, False, time.perf_counter() - start, repr(e))
+                )
+        return results
+
     def setup(self) -> None:
         """Parse arguments, create and validate sample_dict.
 
@@ -125,37 +349,68 @@ class Pipeline:
         """
         self._parse_args()
 
-        self.__set_exluded_samples()
-        self.snakemake_args["singularity_args"] = (
-            f"--bind {self.input_dir}:{self.input_dir} --bind {self.output_dir}:{self.output_dir}"
-            if self.snakemake_args["use_singularity"]
-            else ""
-        )
+        with self._profiled("setup"):
+            self.reference_report: list[dict[str, Any]] = []
+            self.__set_exluded_samples()
+            bind_dirs = [self.input_dir, self.output_dir]
+            if self.scratch_dir is not None:
+                bind_dirs.append(self.scratch_dir)
+            if self.reference_indexes:
+                bind_dirs.append(self.reference_cache)
+            self.snakemake_args["singularity_args"] = (
+                " ".join(f"--bind {dir_}:{dir_}" for dir_ in bind_dirs)
+                if self.snakemake_args["use_singularity"]
+                else ""
+            )
 
-        try:
-            print(
-                message_formatter(
-                    "Making a list of samples to be processed in this pipeline run..."
+            if self._given_sample_dict is not None:
+                self.__use_given_sample_dict()
+            elif self.__reuse_previous_setup() or self.__reuse_shared_sample_dict():
+                # Only the samples are reused, the kind of input directory
+                # (and with it the input_type) is determined again
+                self.__inspect_input_dir()
+            else:
+                try:
+                    print(
+                        message_formatter(
+                            "Making a list of samples to be processed in this pipeline run..."
+                        )
+                    )
+                    self.__build_sample_dict()
+                except FileNotFoundError as e:
+                    assert (
+                        self.input_dir.is_dir()
+                    ), f"The provided input directory ({str(self.input_dir)}) does not exist. Please provide an existing directory"
+                    raise e
+
+                print(
+                    message_formatter(
+                        "Validating that all expected input files per sample are present in the input directory..."
+                    )
                 )
-            )
-            self.__build_sample_dict()
-        except FileNotFoundError as e:
+                self.__validate_sample_dict()
+                if (
+                    self.shared_caches is not None
+                    and self.launch_fingerprint is not None
+                ):
+                    self.shared_caches.sample_tables[
+                        (self.pipeline_name, self.launch_fingerprint)
+                    ] = SampleTable(
+                        {
+                            name: dict(record)
+                            for name, record in self.sample_dict.items()
+                        }
+                    )
+
+            # Validate input files
             assert (
                 self.input_dir.is_dir()
             ), f"The provided input directory ({str(self.input_dir)}) does not exist. Please provide an existing directory"
-            raise e
-
-        print(
-            message_formatter(
-                "Validating that all expected input files per sample are present in the input directory..."
-            )
-        )
-        self.__validate_sample_dict()
 
-        # Validate input files
-        assert (
-            self.input_dir.is_dir()
-        ), f"The provided input directory ({str(self.input_dir)}) does not exist. Please provide an existing directory"
+            if self.reference_indexes and not self.unlock:
+                self._prepare_references()
+            if self.cgmlst_matrix and not self.dryrun and not self.unlock:
+                self.__prepare_cgmlst_matrices()
 
     def run(self) -> None:
         """Setup and run pipeline using snakemake.
@@ -168,65 +423,684 @@ class Pipeline:
         it.
         """
         self.setup()
-        self.sample_sheet.parent.mkdir(exist_ok=True, parents=True)
-        with open(self.sample_sheet, "w") as f:
-            yaml.dump(self.sample_dict, f)
+        self._prioritize_samples()
+        if self.plan:
+            self.plan_capacity()
+            return
+        with self._profiled("run"):
+            print(message_formatter(f"Running {self.pipeline_name} pipeline."))
+            if self.fast_relaunch and self.__previous_user_parameters_match():
+                # The sample sheet and user parameters of the previous launch
+                # (in the audit trail) are used, they are identical
+                print(
+                    message_formatter(
+                        "Nothing changed since the previous launch. Reusing its sample sheet and audit trail."
+                    )
+                )
+                self.snakemake_config["sample_sheet"] = str(
+                    self.path_to_audit.joinpath("sample_sheet.yaml")
+                )
+                self.user_parameters_file = self.path_to_audit.joinpath(
+                    "user_parameters.yaml"
+                )
+            else:
+                # Prioritized samples keep their order in the sample sheet
+                write_yaml_atomic(
+                    self.sample_dict,
+                    self.sample_sheet,
+                    sort_keys=not self.urgent_samples,
+                )
+                write_yaml_atomic(self.user_parameters, self.user_parameters_file)
+
+                # Generate pipeline audit trail only if not dryrun (or unlock)
+                # store the exclusion file in the audit_trail as well. Launches
+                # with the same output directory write it one at a time.
+                if not self.dryrun or self.unlock:
+                    self.output_dir.mkdir(parents=True, exist_ok=True)
+                    with file_lock(self.output_dir.joinpath(".audit_trail.lock")):
+                        self.audit_trail_files = self._generate_audit_trail()
+                        self.__write_launch_fingerprint()
+                    if self.reference_report:
+                        with open(
+                            self.path_to_audit.joinpath("log_reference_cache.yaml"), "w"
+                        ) as f:
+                            yaml.dump(
+                                self.reference_report, f, default_flow_style=False
+                            )
+                if (
+                    self.snakemake_args["use_singularity"]
+                    and self.prefetch_jobs > 0
+                    and not (self.dryrun or self.unlock)
+                ):
+                    self._prefetch_containers()
+                if (
+                    self.snakemake_args["use_conda"]
+                    and self.prefetch_jobs > 0
+                    and not (self.dryrun or self.unlock)
+                ):
+                    self._precreate_conda_envs()
+            if self.scratch_dir is not None and not (self.dryrun or self.unlock):
+                self._stage_inputs()
+
+            if self.local:
+                print(message_formatter("Jobs will run locally"))
+                cluster = None
+            else:
+                print(message_formatter("Jobs will be sent to the cluster"))
+                cluster_log_dir = pathlib.Path(str(self.output_dir)).joinpath(
+                    "log", "cluster"
+                )
+                # One log directory per rule, LSF does not create them
+                workflow = self._load_workflow()
+                make_rule_log_dirs(
+                    cluster_log_dir, [rule.name for rule in workflow.rules]
+                )
+                time_limit = str(self.time_limit)
+                if self.snakemake_args["restart_times"] > 0:
+                    self._escalate_retried_jobs(cluster_log_dir, workflow)
+                    time_limit = "{resources.time_limit}"
+                cluster = (
+                    'bsub -q %s \
+                        -n {threads} \
+                        %s \
+                        -R "span[hosts=1]" \
+                        -R "rusage[mem={resources.mem_gb}G]" \
+                        -M {resources.mem_gb}G \
+                        -W %s '
+                    % (
+                        str(self.queue),
+                        cluster_log_options(cluster_log_dir),
+                        time_limit,
+                    )
+                )
+                self.snakemake_args["cluster"] = cluster
+
+            self.snakemake_args["jobname"] = self.pipeline_name + "_{name}.jobid{jobid}"
+            if self.latency_probe and not (self.dryrun or self.unlock):
+                self._probe_latency()
+            if 0 < len(self.urgent_samples) < len(self.sample_dict) and not (
+                self.dryrun or self.unlock
+            ):
+                self._set_priority_targets()
+
+            run_status = "failed"
+            if self.run_registry is not None and not (self.dryrun or self.unlock):
+                self._register_run("running")
+            try:
+                if self.shards > 1 and not (self.dryrun or self.unlock):
+                    pipeline_run_successful = self._run_sharded()
+                else:
+                    pipeline_run_successful = snakemake(
+                        self.snakefile,
+                        workdir=str(self.workdir),
+                        config=self.snakemake_config,
+                        configfiles=[self.user_parameters_file],
+                        unlock=self.unlock,
+                        dryrun=self.dryrun,
+                        **self.snakemake_args,
+                    )
+                if self.retry_resources and not (self.dryrun or self.unlock):
+                    self._write_retry_report()
+
+                assert pipeline_run_successful, error_formatter(
+                    f"An error occured while running the snakemake part of the {self.pipeline_name} pipeline. Check the logs."
+                )
+                if not (self.dryrun or self.unlock):
+                    _snakemake_report_run_succesful = self._make_snakemake_report()
+                    if not self.local and self.compact_logs:
+                        self._compact_cluster_logs()
+                run_status = "succeeded"
+            finally:
+                if self.run_registry is not None and not (self.dryrun or self.unlock):
+                    self._register_run(run_status)
+                for per_run_file in self._per_run_files:
+                    per_run_file.unlink(missing_ok=True)
+                if (
+                    self.scratch_dir is not None
+                    and self.staged_sample_dict is not None
+                    and not self.keep_scratch
+                ):
+                    print(message_formatter(f"Removing {self.scratch_dir}..."))
+                    cleanup_scratch(self.scratch_dir)
+            print(message_formatter(f"Finished running {self.pipeline_name} pipeline!"))
+
+    def plan_capacity(self) -> dict[str, Any]:
+        """Estimate the resources of the run without running (or submitting) it.
+
+        The jobs come from a dry run of snakemake with the sample sheet of
+        this run. Their threads and resources, the size of the input files
+        and the free space in the output directory are combined by
+        plan_capacity (see juno_library.capacity). The report is printed and
+        stored in self.capacity_report.
+
+        Returns:
+            dict[str, Any]: The capacity report.
+        """
+        print(message_formatter("Planning the resources of the run (dry run)..."))
+        dry_run_jobs = DryRunJobs()
+        write_yaml_atomic(self.sample_dict, self.sample_sheet)
+        write_yaml_atomic(self.user_parameters, self.user_parameters_file)
+        try:
+            successful = snakemake(
+                self.snakefile,
+                workdir=str(self.workdir),
+                config=self.snakemake_config,
+                configfiles=[self.user_parameters_file],
+                **dict(
+                    self.snakemake_args,
+                    dryrun=True,
+                    # A quiet dry run stops before the jobs are reported
+                    quiet=False,
+                    printshellcmds=False,
+                    log_handler=[dry_run_jobs],
+                ),
+            )
+        finally:
+            for per_run_file in self._per_run_files:
+                per_run_file.unlink(missing_ok=True)
+        assert successful, error_formatter(
+            f"The dry run of the {self.pipeline_name} pipeline failed. Check the logs."
+        )
+        self.capacity_report: dict[str, Any] = plan_capacity(
+            dry_run_jobs.jobs,
+            total_input_bytes=input_bytes(self.sample_dict, SAMPLE_FILE_KEYS),
+            free_output_bytes=free_bytes(self.output_dir),
+            time_limit=self.time_limit,
+            max_concurrent_jobs=self.snakemake_args["cores" if self.local else "nodes"],
+            cores=self.snakemake_args["cores"] if self.local else None,
+            mem_gb=(
+                (self.snakemake_args.get("resources") or {}).get("mem_gb")
+                if self.local
+                else None
+            ),
+            output_factor=self.capacity_output_factor,
+        )
+        self.capacity_report["queue"] = None if self.local else self.queue
+        print(message_formatter(format_capacity_report(self.capacity_report)))
+        if not self.capacity_report["fits"]:
+            print(error_formatter("The run does not fit the available resources."))
+        return self.capacity_report
+
+    def _set_priority_targets(self) -> None:
+        """Give the jobs of the urgent samples the highest priority in snakemake.
+
+        The jobs of the urgent samples are found with a dry run (its output
+        is not shown) and their final output files are passed to snakemake
+        as prioritytargets (with the greedy scheduler of snakemake, unless
+        another one is given). If the dry run fails, the run continues without
+        priorities (the run itself reports the problem). The urgent samples
+        and the number of targets are stored in the audit trail.
+        """
+        print(
+            message_formatter(
+                f"Prioritizing the jobs of {len(self.urgent_samples)} urgent sample(s)..."
+            )
+        )
+        dry_run_jobs = DryRunJobs()
+        with redirect_stderr(io.StringIO()):
+            successful = snakemake(
+                self.snakefile,
+                workdir=str(self.workdir),
+                config=self.snakemake_config,
+                configfiles=[self.user_parameters_file],
+                **dict(
+                    self.snakemake_args,
+                    dryrun=True,
+                    quiet=False,
+                    printshellcmds=False,
+                    log_handler=[dry_run_jobs],
+                ),
+            )
+        if not successful:
+            print(
+                error_formatter(
+                    "The dry run to find the jobs of the urgent samples failed. The samples are not prioritized."
+                )
+            )
+            return
+        self.priority_targets = priority_targets(dry_run_jobs.jobs, self.urgent_samples)
+        targets = [
+            target
+            for sample in self.urgent_samples
+            for target in self.priority_targets.get(sample, [])
+        ]
+        if targets:
+            self.snakemake_args["prioritytargets"] = targets + list(
+                self.snakemake_args.get("prioritytargets") or []
+            )
+            # The ILP scheduler multiplies the (maximal) priority of these
+            # jobs with other terms, which the solver cannot handle, and then
+            # starts the jobs in any order. The greedy one compares priorities.
+            self.snakemake_args.setdefault("scheduler", "greedy")
+        self.path_to_audit.mkdir(parents=True, exist_ok=True)
+        with open(self.path_to_audit.joinpath("log_prioritization.yaml"), "w") as f:
+            yaml.dump(
+                {
+                    "urgent_samples": {
+                        sample: self.sample_dict[sample]["priority"]
+                        for sample in self.urgent_samples
+                    },
+                    "priority_targets": len(targets),
+                    # Finished before, or without rules with a sample wildcard
+                    "urgent_samples_without_jobs": [
+                        sample
+                        for sample in self.urgent_samples
+                        if sample not in self.priority_targets
+                    ],
+                },
+                f,
+                default_flow_style=False,
+                sort_keys=False,
+            )
+
+    def _register_run(self, status: str) -> None:
+        """Record the run (or its new status) in the local run registry.
 
-        self.user_parameters_file.parent.mkdir(exist_ok=True, parents=True)
-        with open(self.user_parameters_file, "w") as f:
-            yaml.dump(self.user_parameters, f)
-        print(message_formatter(f"Running {self.pipeline_name} pipeline."))
+        The registry is a convenience to find previous runs, so a problem
+        with it (e.g. a locked or read-only database) only gives a warning.
+        """
+        assert self.run_registry is not None
+        try:
+            registry = RunRegistry(self.run_registry)
+            if status == "running":
+                registry.register_run(
+                    str(self.unique_id),
+                    self.pipeline_name,
+                    self.pipeline_version,
+                    self.input_dir,
+                    self.output_dir,
+                    samples=self.sample_dict.keys(),
+                    hostname=self.hostname,
+                )
+            else:
+                registry.record_status(str(self.unique_id), status)
+        except (sqlite3.Error, OSError) as e:
+            print(
+                error_formatter(
+                    f"Could not record the run in the run registry {self.run_registry}: {e}"
+                )
+            )
 
-        # Generate pipeline audit trail only if not dryrun (or unlock)
-        # store the exclusion file in the audit_trail as well
-        if not self.dryrun or self.unlock:
-            self.audit_trail_files = self._generate_audit_trail()
+    def _probe_latency(self) -> None:
+        """Set latency_wait from the filesystem latency measured with a probe job.
 
+        The probe job is submitted to the queue of the pipeline (or run
+        locally with --local) and writes to the output directory. The
+        measurement is stored in the audit trail. If no probe file is seen
+        the default latency_wait is kept.
+        """
+        probe_dir = self.output_dir.joinpath(f".latency_probe_{uuid4().hex}")
+        submit: SubmitProbe
         if self.local:
-            print(message_formatter("Jobs will run locally"))
-            cluster = None
+            submit, submit_name = submit_local, "local"
         else:
-            print(message_formatter("Jobs will be sent to the cluster"))
-            cluster_log_dir = pathlib.Path(str(self.output_dir)).joinpath(
-                "log", "cluster"
-            )
-            cluster_log_dir.mkdir(parents=True, exist_ok=True)
-            cluster = (
-                'bsub -q %s \
-                    -n {threads} \
-                    -o %s/{name}_{wildcards}_{jobid}.out \
-                    -e %s/{name}_{wildcards}_{jobid}.err \
-                    -R "span[hosts=1]" \
-                    -R "rusage[mem={resources.mem_gb}G]" \
-                    -M {resources.mem_gb}G \
-                    -W %s '
-                % (
-                    str(self.queue),
-                    str(cluster_log_dir),
-                    str(cluster_log_dir),
-                    str(self.time_limit),
-                )
+            submit, submit_name = lsf_submitter(self.queue), "lsf"
+        print(message_formatter("Measuring the latency of the output filesystem..."))
+        n_probes = 10
+        try:
+            delays = measure_latency(probe_dir, submit, n_probes=n_probes)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(error_formatter(f"The latency probe failed: {e}"))
+            delays = []
+        finally:
+            shutil.rmtree(probe_dir, ignore_errors=True)
+        latency_wait = latency_wait_from_delays(
+            delays, default=self.snakemake_args["latency_wait"]
+        )
+        self.snakemake_args["latency_wait"] = latency_wait
+        print(
+            message_formatter(
+                f"Observed {len(delays)} of {n_probes} probe files, using latency_wait={latency_wait}."
             )
-            self.snakemake_args["cluster"] = cluster
+        )
+        self.path_to_audit.mkdir(parents=True, exist_ok=True)
+        with open(self.path_to_audit.joinpath("log_latency.yaml"), "w") as f:
+            yaml.dump(
+                latency_report(delays, n_probes, latency_wait, submit_name),
+                f,
+                default_flow_style=False,
+            )
+
+    def _prepare_references(self) -> None:
+        """Point the samples to the cached copy of their reference and its indexes.
+
+        Every distinct reference is hashed once and its indexes are built (or
+        reused) in the shared reference cache. The cached reference replaces
+        the reference of the samples, the indexes are added as
+        reference_<index>. In a dry run the indexes are not built, so
+        samples whose reference is not in the cache yet keep their own
+        reference (without indexes). The report is stored in the audit trail
+        when the run starts.
+        """
+        unknown = set(self.reference_indexes) - set(REFERENCE_INDEXES)
+        assert not unknown, error_formatter(
+            f"Unknown reference index(es): {sorted(unknown)}. Choose from {sorted(REFERENCE_INDEXES)}."
+        )
+        indexes = {name: REFERENCE_INDEXES[name] for name in self.reference_indexes}
+        references = {
+            str(record["reference"])
+            for record in self.sample_dict.values()
+            if "reference" in record
+        }
+        print(
+            message_formatter(
+                f"Preparing {len(references)} reference(s) in {self.reference_cache}..."
+            )
+        )
+        prepared = {
+            reference: prepare_reference(
+                reference, self.reference_cache, indexes, build=not self.dryrun
+            )
+            for reference in sorted(references)
+        }
+        for record in self.sample_dict.values():
+            if "reference" not in record:
+                continue
+            reference = prepared[str(record["reference"])]
+            if not reference["cached"]:
+                continue
+            record["reference"] = reference["reference"]
+            for name, index_path in reference["indexes"].items():
+                record[f"reference_{name}"] = index_path
+        self.reference_report = list(prepared.values())
+
+    def _stage_inputs(self) -> None:
+        """Stage the input files to the scratch directory.
+
+        The files are copied (or hard linked) in parallel and the jobs use
+        a sample sheet of this run, stored in the scratch directory, that
+        points to the staged files. The sample sheet in the audit trail
+        keeps the original paths and the staging report is stored next to
+        it. The scratch directory is removed after the run unless
+        --keep-scratch is used.
+        """
+        assert self.scratch_dir is not None
+        print(
+            message_formatter(
+                f"Staging the input files to {self.scratch_dir} ({self.stage_mode})..."
+            )
+        )
+        staged_sample_dict, report = stage_samples(
+            self.sample_dict,
+            self.scratch_dir.joinpath("inputs"),
+            mode=self.stage_mode,
+            max_workers=self.stage_jobs,
+            # The cached reference stays next to its indexes
+            keys=[
+                key
+                for key in SAMPLE_FILE_KEYS
+                if not (key == "reference" and self.reference_indexes)
+            ],
+        )
+        self.staged_sample_dict: Optional[SampleTable] = staged_sample_dict
+        staged_sample_sheet = self.scratch_dir.joinpath("sample_sheet.yaml")
+        with open(staged_sample_sheet, "w") as f:
+            yaml.dump(staged_sample_dict, f, sort_keys=not self.urgent_samples)
+        self.snakemake_config["sample_sheet"] = str(staged_sample_sheet)
+        print(
+            message_formatter(
+                f"Staged {report['bytes'] / 1024**3:.2f} GB in {report['seconds']} seconds."
+            )
+        )
+        self.path_to_audit.mkdir(parents=True, exist_ok=True)
+        with open(self.path_to_audit.joinpath("log_staging.yaml"), "w") as f:
+            yaml.dump(report, f, default_flow_style=False)
+
+    def _profiled(self, phase: str) -> ContextManager[None]:
+        """Profile a phase of the pipeline if --profile was given."""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(phase)
+
+    def _run_sharded(self) -> bool:
+        """Run the pipeline as several concurrent snakemake invocations.
+
+        The samples are split in self.shards shards. Every shard gets its own
+        sample sheet and working directory (and therefore its own .snakemake
+        metadata directory) under output_dir/.shards, so every invocation
+        only builds the DAG of its own samples. The shards stop before the
+        self.aggregation_rules, which are run afterwards by a final
+        invocation with the complete sample sheet. There are no more shards
+        than cores or nodes. By then the per-sample
+        outputs exist, so the final invocation only uses the rules without a
+        sample wildcard and does not build the jobs of every sample again.
+        The cores and nodes are split between the shards.
+
+        Note that the output files of the pipeline should be placed in the
+        output_dir with absolute paths (as done in the Juno pipelines) and not
+        relative to the working directory, because that one differs per shard.
+        Per-sample rules (with a sample wildcard) that use the results of an
+        aggregation rule cannot be run in shards.
 
-        self.snakemake_args["jobname"] = self.pipeline_name + "_{name}.jobid{jobid}"
+        Returns:
+            bool: Whether all the invocations were successful.
+        """
+        # Every shard needs at least one core and node
+        n_shards = min(
+            self.shards, self.snakemake_args["cores"], self.snakemake_args["nodes"]
+        )
+        if n_shards < self.shards:
+            print(
+                message_formatter(
+                    f"Only {n_shards} shard(s) fit in {self.snakemake_args['cores']} cores and {self.snakemake_args['nodes']} nodes."
+                )
+            )
+        shards = split_sample_dict(
+            self.staged_sample_dict or self.sample_dict, n_shards
+        )
+        cores = split_budget(self.snakemake_args["cores"], [1] * len(shards))
+        nodes = split_budget(self.snakemake_args["nodes"], [1] * len(shards))
+        print(
+            message_formatter(
+                f"Running {len(self.sample_dict)} samples in {len(shards)} shards..."
+            )
+        )
+        shard_kwargs = []
+        for i, shard in enumerate(shards):
+            shard_dir = self.output_dir.joinpath(".shards", f"shard_{i}")
+            shard_dir.mkdir(parents=True, exist_ok=True)
+            shard_sample_sheet = shard_dir.joinpath("sample_sheet.yaml")
+            with open(shard_sample_sheet, "w") as f:
+                yaml.dump(shard, f)
+            shard_kwargs.append(
+                dict(
+                    self.snakemake_args,
+                    snakefile=os.path.abspath(self.snakefile),
+                    workdir=str(shard_dir),
+                    config=dict(
+                        self.snakemake_config, sample_sheet=str(shard_sample_sheet)
+                    ),
+                    configfiles=[self.user_parameters_file],
+                    omit_from=self.aggregation_rules,
+                    cores=cores[i],
+                    nodes=nodes[i],
+                )
+            )
+            if self.priority_targets:
+                # Only the targets of its own samples, the others would be
+                # added to the targets of the shard
+                shard_kwargs[-1]["prioritytargets"] = [
+                    target
+                    for sample in shard
+                    for target in self.priority_targets.get(sample, [])
+                ]
+        # Every shard runs in its own process because snakemake is not
+        # thread-safe (it changes the working directory, among others)
+        with ProcessPoolExecutor(
+            max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            shards_successful = list(executor.map(_run_snakemake, shard_kwargs))
+        failed_shards = [i for i, ok in enumerate(shards_successful) if not ok]
+        if failed_shards:
+            print(
+                error_formatter(
+                    f"Shard(s) {', '.join(map(str, failed_shards))} failed. The final aggregation is skipped."
+                )
+            )
+            return False
 
-        pipeline_run_successful: bool = snakemake(
+        print(message_formatter("Running the final aggregation of all the shards..."))
+        aggregation_args = dict(self.snakemake_args)
+        aggregation_args.setdefault(
+            "allowed_rules",
+            get_rules_without_wildcard(self._load_workflow(), SAMPLE_WILDCARD),
+        )
+        aggregation_successful: bool = snakemake(
             self.snakefile,
             workdir=str(self.workdir),
             config=self.snakemake_config,
             configfiles=[self.user_parameters_file],
-            unlock=self.unlock,
-            dryrun=self.dryrun,
-            **self.snakemake_args,
+            **aggregation_args,
+        )
+        return aggregation_successful
+
+    def _load_workflow(self) -> Any:
+        """Parse the Snakefile of the pipeline (without building the DAG)."""
+        return load_workflow(
+            self.snakefile,
+            config=self.snakemake_config,
+            configfiles=[self.user_parameters_file],
+            workdir=self.workdir,
         )
 
-        assert pipeline_run_successful, error_formatter(
-            f"An error occured while running the snakemake part of the {self.pipeline_name} pipeline. Check the logs."
+    def _escalate_retried_jobs(self, cluster_log_dir: Path, workflow: Any) -> None:
+        """Resubmit jobs that LSF killed with more memory or time (see juno_library.retries).
+
+        The mem_gb (if it is a number) and time_limit resources of every
+        rule are replaced by resources that grow with the kills of the job
+        in its cluster logs, up to --max-mem-gb and --max-time-limit.
+        Resources overwritten with --snakemake-args are kept. The status of
+        the jobs is asked to LSF, as killed jobs do not report it.
+        """
+        self.retry_resources = escalating_resources(
+            {rule.name: rule.resources for rule in workflow.rules},
+            cluster_log_dir,
+            time_limit=self.time_limit,
+            max_mem_gb=self.max_mem_gb,
+            max_time_limit=self.max_time_limit,
+            mem_factor=self.retry_mem_factor,
+            time_factor=self.retry_time_factor,
+        )
+        overwrite_resources: dict[str, dict[str, Any]] = {
+            rule: dict(resources) for rule, resources in self.retry_resources.items()
+        }
+        for rule, resources in (
+            self.snakemake_args.get("overwrite_resources") or {}
+        ).items():
+            overwrite_resources.setdefault(rule, {}).update(resources)
+        self.snakemake_args["overwrite_resources"] = overwrite_resources
+        self.snakemake_args.setdefault(
+            "cluster_status", f"{sys.executable} -m juno_library.retries"
+        )
+
+    def _write_retry_report(self) -> None:
+        """Store the jobs that LSF killed (and the requests of their last attempt) in the audit trail."""
+        report = dict(
+            retry_report(self.retry_resources),
+            restart_times=self.snakemake_args["restart_times"],
+            max_mem_gb=self.max_mem_gb,
+            max_time_limit=self.max_time_limit,
+        )
+        if report["killed_jobs"]:
+            print(
+                message_formatter(
+                    f"{report['killed_jobs']} job(s) were killed by LSF ({report['mem_gb_kills']} times for memory, {report['time_limit_kills']} times for the time limit)."
+                )
+            )
+        self.path_to_audit.mkdir(parents=True, exist_ok=True)
+        with open(self.path_to_audit.joinpath("log_retries.yaml"), "w") as f:
+            yaml.dump(report, f, default_flow_style=False)
+
+    def _compact_cluster_logs(self) -> None:
+        """Pack the cluster logs of the run in an indexed archive.
+
+        The archive (log/cluster_<unique_id>.tar) is added to the index
+        log/cluster_logs.sqlite, shared by all the runs in the output
+        directory. The logs of a job can be printed with
+        python -m juno_library.cluster_logs <index> --jobid <jobid>.
+        """
+        log_dir = Path(str(self.output_dir)).joinpath("log")
+        report = compact_cluster_logs(
+            log_dir.joinpath("cluster"),
+            log_dir.joinpath(f"cluster_{self.unique_id}.tar"),
+            log_dir.joinpath("cluster_logs.sqlite"),
+        )
+        print(
+            message_formatter(
+                f"Compacted {report['files']} cluster log(s) in {report['seconds']} seconds."
+            )
+        )
+
+    def _prefetch_containers(self) -> None:
+        """Pull the container images of all the rules before snakemake starts.
+
+        The images are stored in the singularity prefix (or the default
+        location of snakemake in the working directory) so snakemake finds
+        them ready instead of pulling them inside the first job of every
+        rule. A report with the time spent is stored in the audit trail.
+        """
+        images = get_container_images(self._load_workflow())
+        if self.snakemake_args["singularity_prefix"]:
+            prefix = Path(self.snakemake_args["singularity_prefix"]).expanduser()
+        else:
+            prefix = self.workdir.joinpath(".snakemake", "singularity")
+        print(
+            message_formatter(
+                f"Prefetching {len(images)} container image(s) into {prefix}..."
+            )
+        )
+        report = prefetch_container_images(
+            images, prefix.resolve(), max_workers=self.prefetch_jobs
+        )
+        print(
+            message_formatter(
+                f"Container images ready after {report['seconds']} seconds."
+            )
+        )
+        self.path_to_audit.mkdir(parents=True, exist_ok=True)
+        with open(self.path_to_audit.joinpath("log_container_prefetch.yaml"), "w") as f:
+            yaml.dump(report, f, default_flow_style=False)
+
+    def _precreate_conda_envs(self) -> None:
+        """Create the conda environments of all the rules before snakemake starts.
+
+        Snakemake would create them one by one when the DAG is built. Here the
+        missing ones are created in parallel with the chosen conda_frontend,
+        in the conda prefix and with the same (content based) names that
+        snakemake uses, so pipelines sharing a prefix share identical
+        environments. A cache report is stored in the audit trail.
+        """
+        if self.snakemake_args["conda_prefix"]:
+            prefix = Path(self.snakemake_args["conda_prefix"]).expanduser()
+        else:
+            prefix = self.workdir.joinpath(".snakemake", "conda")
+        prefix = prefix.resolve()
+        workflow = load_workflow(
+            self.snakefile,
+            config=self.snakemake_config,
+            configfiles=[self.user_parameters_file],
+            workdir=self.workdir,
+            use_conda=True,
+            conda_prefix=str(prefix),
+            conda_frontend=self.snakemake_args["conda_frontend"],
+        )
+        envs = get_conda_envs(workflow, env_dir=prefix)
+        print(
+            message_formatter(
+                f"Preparing {len(envs)} conda environment(s) in {prefix}..."
+            )
+        )
+        report = precreate_conda_envs(envs, max_workers=self.prefetch_jobs)
+        report["prefix"] = str(prefix)
+        report["conda_frontend"] = self.snakemake_args["conda_frontend"]
+        print(
+            message_formatter(
+                f"Conda environments ready after {report['seconds']} seconds."
+            )
         )
-        if not (self.dryrun or self.unlock):
-            _snakemake_report_run_succesful = self._make_snakemake_report()
-        print(message_formatter(f"Finished running {self.pipeline_name} pipeline!"))
+        self.path_to_audit.mkdir(parents=True, exist_ok=True)
+        with open(self.path_to_audit.joinpath("log_conda_envs.yaml"), "w") as f:
+            yaml.dump(report, f, default_flow_style=False)
 
     def _add_args_to_parser(self) -> None:
         """Add arguments to self.parser."""
@@ -284,6 +1158,27 @@ class Pipeline:
             default=60,
             help="Time limit per job in minutes (passed as -W argument to bsub). Jobs will be killed if not finished in this time.",
         )
+        self.add_argument(
+            "--retries",
+            type=int,
+            metavar="INT",
+            default=0,
+            help="Resubmit a failed cluster job up to INT times. Jobs killed by LSF for exceeding their memory (TERM_MEMLIMIT) or time limit (TERM_RUNLIMIT) are resubmitted with twice the memory or time per kill, up to --max-mem-gb and --max-time-limit.",
+        )
+        self.add_argument(
+            "--max-mem-gb",
+            type=int,
+            metavar="INT",
+            default=256,
+            help="Largest memory request (GB) of a job resubmitted after a memory kill (see --retries).",
+        )
+        self.add_argument(
+            "--max-time-limit",
+            type=int,
+            metavar="INT",
+            default=1440,
+            help="Largest time limit (minutes) of a job resubmitted after a time limit kill (see --retries).",
+        )
         self.add_argument(
             "-u",
             "--unlock",
@@ -303,12 +1198,136 @@ class Pipeline:
             default="bio",
             help="Name of the queue that the job will be submitted to if working on a cluster.",
         )
+        self.add_argument(
+            "--plan",
+            action="store_true",
+            help="Do not run the pipeline but estimate the CPU-hours, memory, output size and wall time it needs (from a dry run and the size of the input files) and compare them with the free space in the output directory and the queue settings (--time-limit).",
+        )
         self.add_argument(
             "--no-containers",
             action="store_false",
             dest="use_singularity",
             help="Use conda environments instead of containers.",
         )
+        self.add_argument(
+            "--shards",
+            type=int,
+            metavar="INT",
+            default=1,
+            help="Split the samples in this number of shards that are run by concurrent snakemake invocations, followed by a final aggregation. Useful for runs with thousands of samples, where building the DAG of jobs becomes a bottleneck. Only for pipelines with aggregation_rules.",
+        )
+        self.add_argument(
+            "--prefetch-jobs",
+            type=int,
+            metavar="INT",
+            default=0,
+            help="Prepare the container images (or conda environments if --no-containers is used) of all the rules before the pipeline starts, INT at the same time. Skipped for dry runs. By default (0) snakemake prepares them itself.",
+        )
+        self.add_argument(
+            "--latency-probe",
+            action="store_true",
+            help="Measure how long files written by a (probe) job take to become visible on this node and set latency_wait (passed to snakemake) from it instead of using a fixed value. The measurement is stored in the audit trail.",
+        )
+        self.add_argument(
+            "--force-rescan",
+            action="store_true",
+            help="Scan and validate the input directory even if nothing changed since the previous launch (by default the samples of the previous launch are reused).",
+        )
+        self.add_argument(
+            "--scratch-dir",
+            type=Path,
+            metavar="DIR",
+            default=None,
+            help="Stage the input files to a directory in this scratch location (e.g. a node-local or fast filesystem) before the jobs run, so they do not read from shared storage. The directory is removed after the run.",
+        )
+        self.add_argument(
+            "--stage-mode",
+            choices=STAGE_MODES,
+            default="copy",
+            help="How the input files are staged with --scratch-dir. Copies are verified with a checksum. Hard links fall back to copies across filesystems.",
+        )
+        self.add_argument(
+            "--stage-jobs",
+            type=int,
+            metavar="INT",
+            default=8,
+            help="Number of input files staged at the same time with --scratch-dir.",
+        )
+        self.add_argument(
+            "--keep-scratch",
+            action="store_true",
+            help="Do not remove the staged input files after the run (a relaunch reuses them).",
+        )
+        self.add_argument(
+            "--no-log-compaction",
+            dest="compact_logs",
+            action="store_false",
+            help="Keep the cluster logs as separate files instead of packing them in an indexed archive after the run.",
+        )
+        self.add_argument(
+            "--recursive",
+            type=int,
+            nargs="?",
+            const=3,
+            default=0,
+            metavar="DEPTH",
+            help="Also look for input files in subdirectories of the input directory, up to DEPTH levels deep (3 if no DEPTH is given). Samples found in more than one subdirectory give an error.",
+        )
+        self.add_argument(
+            "--include-pattern",
+            action="append",
+            default=[],
+            metavar="PATTERN",
+            help="Only use input files whose name or path (relative to the input directory) matches this pattern (e.g. 'run_*/*.fastq.gz'). Can be given more than once.",
+        )
+        self.add_argument(
+            "--exclude-pattern",
+            action="append",
+            default=[],
+            metavar="PATTERN",
+            help="Skip input files and subdirectories whose name or path (relative to the input directory) matches this pattern (e.g. 'Undetermined*'). Can be given more than once.",
+        )
+        self.add_argument(
+            "--cgmlst-matrix",
+            action="store_true",
+            help="With juno-cgmlst output as input, also build (or reuse) an allele matrix per scheme in <output_dir>/cgmlst_matrices.",
+        )
+        self.add_argument(
+            "--priority-file",
+            type=Path,
+            metavar="FILE",
+            default=None,
+            help="CSV or TSV file with the columns sample and priority (a whole number, 0 if not given). The jobs of samples with a priority above 0 run first. Defaults to the priority column of the metadata of the pipeline, if any.",
+        )
+        self.add_argument(
+            "--reference-cache",
+            type=Path,
+            metavar="DIR",
+            default=None,
+            help="Shared cache for the reference and its indexes. Defaults to JUNO_REFERENCE_CACHE or ~/.juno/reference_cache.",
+        )
+        self.add_argument(
+            "--run-registry",
+            type=Path,
+            metavar="FILE",
+            default=None,
+            help="Local registry (SQLite) to record the run in. Defaults to JUNO_RUN_REGISTRY. Without either the run is not recorded.",
+        )
+        self.add_argument(
+            "--no-run-registry",
+            action="store_true",
+            help="Do not record the run in the local run registry, even if JUNO_RUN_REGISTRY is set.",
+        )
+        self.add_argument(
+            "--profile",
+            action="store_true",
+            help="Profile the setup and run phases of the pipeline with cProfile. The profiles and a summary of the slowest functions and external commands are stored in audit_trail/profile.",
+        )
+        self.add_argument(
+            "--profile-memory",
+            action="store_true",
+            help="Together with --profile, also trace the memory allocations with tracemalloc (slows down the pipeline).",
+        )
         self.add_argument(
             "--snakemake-args",
             nargs="*",
@@ -326,21 +1345,80 @@ class Pipeline:
         class, be sure to call this original function with
         super()._parse_args().
         """
-        ### Parse args and set relevant properties
-        args = self.parser.parse_args(self.argv)
+        ### Parse args (or take them from the config) and set relevant properties
+        args = (
+            self.pipeline_config.to_namespace(self.parser)
+            if self.pipeline_config is not None
+            else self.parser.parse_args(self.argv)
+        )
 
         self.snakemake_args.update(args.snakemake_args)
         self.local: bool = args.local
+        if self.local:
+            self._set_local_resources(args.snakemake_args)
         self.unlock: bool = args.unlock
         self.dryrun: bool = args.dryrun
         self.time_limit: int = args.time_limit
+        if args.retries:
+            self.snakemake_args["restart_times"] = args.retries
+        self.max_mem_gb: int = args.max_mem_gb
+        self.max_time_limit: int = args.max_time_limit
+        self.retry_resources = {}
         self.queue: str = args.queue
+        self.plan: bool = args.plan
+        self.prefetch_jobs: int = args.prefetch_jobs
+        self.shards: int = args.shards
+        assert self.shards <= 1 or self.aggregation_rules, error_formatter(
+            f"{self.pipeline_name} cannot run in shards: it has no aggregation_rules (the rules that combine the results of all samples). Without them every shard would run the whole workflow."
+        )
+        self.force_rescan: bool = args.force_rescan
+        # A latency_wait given explicitly with --snakemake-args is kept
+        self.latency_probe: bool = (
+            args.latency_probe and "latency_wait" not in args.snakemake_args
+        )
 
         self.workdir: Path = args.workdir.resolve()
         self.input_dir: Path = args.input.resolve()
         self.output_dir: Path = args.output.resolve()
         self.path_to_audit = self.output_dir.joinpath("audit_trail").resolve()
         self.snakemake_report = self.path_to_audit.joinpath("snakemake_report.html")
+        # The scratch directory of a run depends on its output directory,
+        # so a relaunch (with --keep-scratch) finds the files it staged before
+        self.scratch_dir: Optional[Path] = (
+            args.scratch_dir.joinpath(
+                f"{self.pipeline_name}_{hashlib.md5(str(self.output_dir).encode()).hexdigest()[:12]}"
+            ).resolve()
+            if args.scratch_dir
+            else None
+        )
+        self.stage_mode: str = args.stage_mode
+        self.stage_jobs: int = args.stage_jobs
+        self.keep_scratch: bool = args.keep_scratch
+        self.compact_logs: bool = args.compact_logs
+        self.recursive_depth: int = args.recursive
+        self.cgmlst_matrix: bool = args.cgmlst_matrix
+        self.priority_file: Optional[Path] = (
+            args.priority_file.resolve() if args.priority_file else None
+        )
+        self.include_patterns: list[str] = args.include_pattern
+        self.exclude_patterns: list[str] = args.exclude_pattern
+        self.reference_cache: Path = (
+            args.reference_cache or default_reference_cache()
+        ).resolve()
+        self.run_registry: Optional[Path] = (
+            None
+            if args.no_run_registry
+            else (args.run_registry or configured_registry_path())
+        )
+        self.staged_sample_dict = None
+        self.profiler: Optional[PhaseProfiler] = (
+            PhaseProfiler(
+                self.path_to_audit.joinpath("profile"),
+                trace_memory=args.profile_memory,
+            )
+            if args.profile
+            else None
+        )
         self.snakemake_config["input_dir"] = str(self.input_dir)
         self.snakemake_config["output_dir"] = str(self.output_dir)
         self.snakemake_args["use_singularity"] = args.use_singularity
@@ -358,6 +1436,54 @@ class Pipeline:
 
         return args
 
+    def _set_local_resources(self, explicit_snakemake_args: dict[str, Any]) -> None:
+        """Limit the cores and memory (mem_gb) of a local run to what the host offers.
+
+        The cores are capped to the cores available to this process and a
+        global mem_gb resource is set so snakemake does not start more jobs
+        than fit in memory. Values passed explicitly through
+        --snakemake-args are kept as they are. The chosen values are stored
+        in self.local_resources for the audit trail.
+
+        Args:
+            explicit_snakemake_args (dict[str, Any]): The arguments passed with --snakemake-args.
+        """
+        host = detect_host_resources()
+        # The limits of the pipeline, not the ones derived in a previous run
+        pipeline_cores = self._pipeline_limits["cores"]
+        pipeline_mem_gb = self._pipeline_limits["mem_gb"]
+        if "cores" in explicit_snakemake_args:
+            cores_source = "user"
+        elif pipeline_cores is None or pipeline_cores > host.cores:
+            self.snakemake_args["cores"] = host.cores
+            cores_source = host.cores_source
+        else:
+            self.snakemake_args["cores"] = pipeline_cores
+            cores_source = "pipeline"
+
+        resources = dict(self.snakemake_args.get("resources") or {})
+        if "mem_gb" in (explicit_snakemake_args.get("resources") or {}):
+            mem_source = "user"
+        elif pipeline_mem_gb is not None:
+            resources["mem_gb"] = pipeline_mem_gb
+            mem_source = "pipeline"
+        else:
+            resources["mem_gb"] = host.mem_gb
+            mem_source = host.mem_source
+        self.snakemake_args["resources"] = resources
+
+        self.local_resources: dict[str, Any] = {
+            "cores": self.snakemake_args["cores"],
+            "cores_source": cores_source,
+            "mem_gb": resources["mem_gb"],
+            "mem_gb_source": mem_source,
+        }
+        print(
+            message_formatter(
+                f"Local run limited to {self.local_resources['cores']} cores ({cores_source}) and {self.local_resources['mem_gb']} GB of memory ({mem_source})."
+            )
+        )
+
     def __check_input_dir(self, expected_files_dirs: List[str]) -> bool:
         """
         Check whether the input directory contains the expected files and/or directories.
@@ -405,13 +1531,13 @@ class Pipeline:
         if isinstance(self.input_type, str):
             self.input_type = tuple(conversion_dict[self.input_type])
 
-    def __build_sample_dict(self) -> None:
-        """Look for samples in input_dir and set self.sample_dict accordingly.
+    def __inspect_input_dir(self) -> None:
+        """Check whether the input_dir is the output of a Juno pipeline.
 
-        It also checks whether the input_dir is an output dir if
-        juno_assembly and sets self.input_dir_is_juno_assembly_output.
+        Sets self.input_dir_is_juno_assembly_output (and the flags of the
+        other Juno pipelines). If it is none of them, self.input_type is
+        converted to a tuple.
         """
-        self.sample_dict: dict[str, dict[str, str]] = {}
         self.input_dir_is_juno_assembly_output = self.__check_input_dir(
             ["clean_fastq", "de_novo_assembly_filtered"]
         )
@@ -424,6 +1550,22 @@ class Pipeline:
         self.input_dir_is_juno_cgmlst_output = self.__check_input_dir(
             ["cgmlst/*", "audit_trail"]
         )
+        if not (
+            self.input_dir_is_juno_assembly_output
+            or self.input_dir_is_juno_mapping_output
+            or self.input_dir_is_juno_variant_typing_output
+            or self.input_dir_is_juno_cgmlst_output
+        ):
+            self.__parse_input_type()  # TODO: remove this line when self.input_type is a list in all pipelines
+
+    def __build_sample_dict(self) -> None:
+        """Look for samples in input_dir and set self.sample_dict accordingly.
+
+        It also checks whether the input_dir is an output dir if
+        juno_assembly and sets self.input_dir_is_juno_assembly_output.
+        """
+        self.sample_dict: SampleTable = SampleTable()
+        self.__inspect_input_dir()
         if self.input_dir_is_juno_assembly_output:
             self.__enlist_fastq_samples(self.input_dir.joinpath("clean_fastq"))
             self.__enlist_samples_custom_extension(
@@ -451,14 +1593,8 @@ class Pipeline:
                 consensus_paths[0], extension=".fasta", key="assembly"
             )
         elif self.input_dir_is_juno_cgmlst_output:
-            raise NotImplementedError(
-                "Using juno-cgmlst output is not yet implemented."
-            )
-            # TODO: juno-cgmlst should output a TSV file with the cgmlst results per sample, which should be enlisted here. Can be multiple schemes per sample.
-            # Could be in the format: {sample: {cgmlst_scheme1: cgmlst_file1, cgmlst_scheme2: cgmlst_file2}}
-            # self.__enlist_samples_custom_extension(self.input_dir.joinpath("cgmlst"), extension=".tsv", key="cgmlst")
+            self.__enlist_cgmlst_results(self.input_dir.joinpath("cgmlst"))
         else:
-            self.__parse_input_type()  # TODO: remove this line when self.input_type is a list in all pipelines
             if "fastq" in self.input_type:
                 self.__enlist_fastq_samples(self.input_dir)
             if "fasta" in self.input_type:
@@ -475,6 +1611,61 @@ class Pipeline:
                     self.input_dir, extension=".bam", key="bam"
                 )
 
+    def __enlist_cgmlst_results(self, dir: Path) -> None:
+        """Function to enlist the allele-call tables of juno-cgmlst (one per
+        scheme and sample). Adds or updates self.sample_dict with the form:
+
+        {sample: {cgmlst_scheme1: table1, cgmlst_scheme2: table2}}
+        """
+        self.cgmlst_schemes = discover_cgmlst_results(
+            dir,
+            validate=self._has_min_lines,
+        )
+        for scheme, tables in self.cgmlst_schemes.items():
+            for sample_name, table in tables.items():
+                if sample_name in self.excluded_samples:
+                    continue
+                sample = self.sample_dict.setdefault(sample_name, {})
+                sample[f"{CGMLST_KEY_PREFIX}{scheme}"] = table
+
+    def __prepare_cgmlst_matrices(self) -> None:
+        """Build (or reuse) the allele matrix of every cgMLST scheme (--cgmlst-matrix).
+
+        The schemes are taken from the sample_dict, so the matrices are also
+        prepared (and rebuilt if the tables changed) when the samples of a
+        previous launch are reused. Every matrix is stored in
+        <output_dir>/cgmlst_matrices/<scheme> and its path is passed to
+        snakemake as config["cgmlst_matrices"][scheme].
+        """
+        schemes = cgmlst_tables(self.sample_dict)
+        if not schemes:
+            return
+        print(message_formatter("Preparing the cgMLST allele matrices..."))
+        self.snakemake_config["cgmlst_matrices"] = {
+            scheme: str(
+                cached_allele_matrix(
+                    self.output_dir.joinpath("cgmlst_matrices", scheme), tables
+                )
+            )
+            for scheme, tables in schemes.items()
+        }
+
+    def __scan_input_dir(self, dir: Path) -> Iterable[Tuple[os.DirEntry[str], str]]:
+        """The entries of dir with their resolved path.
+
+        With --recursive the subdirectories (up to the chosen depth) are
+        scanned as well and with --include-pattern/--exclude-pattern the
+        files are filtered.
+        """
+        if not (self.recursive_depth or self.include_patterns or self.exclude_patterns):
+            return scan_dir_resolved(dir)
+        return walk_dir_resolved(
+            dir,
+            max_depth=self.recursive_depth,
+            include=self.include_patterns,
+            exclude=self.exclude_patterns,
+        )
+
     def __enlist_fastq_samples(self, dir: Path) -> None:
         """Function to enlist the fastq files found in the input directory.
         File with too little lines are silently ignored. Adds or updates
@@ -492,10 +1683,9 @@ class Pipeline:
         )
         observed_combinations: Dict[Tuple[str, str], str] = {}
         errors = []
-        for file_ in dir.iterdir():
-            filepath_ = str(file_.resolve())
-            if validate_file_has_min_lines(file_, self.min_num_lines):
-                if match := pattern.fullmatch(file_.name):
+        for file_, filepath_ in self.__scan_input_dir(dir):
+            if match := pattern.fullmatch(file_.name):
+                if self._has_min_lines(filepath_):
                     sample_name = match.group(1)
                     read_group = match.group(2)
                     if sample_name in self.excluded_samples:
@@ -519,10 +1709,11 @@ class Pipeline:
             raise KeyError(errors)
 
     def __enlist_reference(self, dir: Path) -> None:
-        ref_path = dir.joinpath("reference", "reference.fasta")
+        # Resolved once for all the samples
+        ref_path = str(dir.joinpath("reference", "reference.fasta").resolve())
         for sample in self.sample_dict:
             if "reference" not in self.sample_dict[sample]:
-                self.sample_dict[sample]["reference"] = str(ref_path.resolve())
+                self.sample_dict[sample]["reference"] = ref_path
 
     def __enlist_samples_custom_extension(
         self, dir: Path, extension: str, key: str
@@ -531,16 +1722,58 @@ class Pipeline:
         Adds or updates self.sample_dict with the form:
 
         {sample: {key: file.extension}}
+
+        BAM files are validated by their BGZF structure instead of their
+        number of lines and their index, if present and not older than the
+        BAM file, is added as bam_index. If self.assembly_stats, the number
+        of sequences and total length of assemblies are added as well.
         """
         pattern = re.compile(f"(.*?){extension}")
-        for file_ in dir.iterdir():
-            if validate_file_has_min_lines(file_, self.min_num_lines):
-                if match := pattern.fullmatch(file_.name):
+        is_bam = key == "bam"
+        add_stats = key == "assembly" and self.assembly_stats
+        stale_indexes = []
+        observed_files: Dict[str, str] = {}
+        errors = []
+        for file_, filepath_ in self.__scan_input_dir(dir):
+            if match := pattern.fullmatch(file_.name):
+                if (
+                    self._is_valid_bam(filepath_)
+                    if is_bam
+                    else self._has_min_lines(filepath_)
+                ):
                     sample_name = match.group(1)
                     if sample_name in self.excluded_samples:
                         continue
+                    # Only possible with --recursive: the same sample in several subdirectories
+                    if sample_name in observed_files:
+                        errors.append(
+                            KeyError(
+                                f"Multiple {extension} files ({observed_files[sample_name]} and {filepath_}) matching the same sample ({sample_name}). This pipeline expects only one {extension} file per sample."
+                            )
+                        )
+                    observed_files[sample_name] = filepath_
                     sample = self.sample_dict.setdefault(sample_name, {})
-                    sample[key] = str(file_.resolve())
+                    sample[key] = filepath_
+                    if add_stats:
+                        stats = fasta_stats(filepath_)
+                        sample["assembly_sequences"] = stats["sequences"]
+                        sample["assembly_length"] = stats["total_length"]
+                    if is_bam:
+                        index, index_status = find_bam_index(filepath_)
+                        if index is not None:
+                            sample["bam_index"] = index
+                        elif index_status == "stale":
+                            stale_indexes.append(file_.name)
+        if len(errors) == 1:
+            raise errors[0]
+        elif len(errors) > 1:
+            raise KeyError(errors)
+        if stale_indexes:
+            print(
+                error_formatter(
+                    f"The index of {len(stale_indexes)} BAM file(s) is older than the BAM file and is not used: {', '.join(sorted(stale_indexes))}"
+                )
+            )
 
     def __set_exluded_samples(self) -> None:
         """Read self.exclusion file and set self.excluded_sameples.
@@ -575,7 +1808,22 @@ class Pipeline:
                 )
             )
         errors = []
-        if "fastq" in self.input_type:
+        if self.input_dir_is_juno_cgmlst_output:
+            # The input_type does not apply, every sample should have the
+            # allele calls of every scheme
+            for sample in self.sample_dict:
+                missing = [
+                    scheme
+                    for scheme in self.cgmlst_schemes
+                    if f"{CGMLST_KEY_PREFIX}{scheme}" not in self.sample_dict[sample]
+                ]
+                if missing:
+                    errors.append(
+                        KeyError(
+                            f"The cgMLST results of scheme(s) {', '.join(missing)} are missing for sample {sample}. This pipeline expects the results of every scheme per sample."
+                        )
+                    )
+        elif "fastq" in self.input_type:
             for sample in self.sample_dict:
                 R1_present = "R1" in self.sample_dict[sample].keys()
                 R2_present = "R2" in self.sample_dict[sample].keys()
@@ -585,7 +1833,7 @@ class Pipeline:
                             f"One of the paired fastq files (R1 or R2) are missing for sample {sample}. This pipeline ONLY ACCEPTS PAIRED READS. If you are sure you have complete paired-end reads, make sure to NOT USE _1 and _2 within your file names unless it is to differentiate paired fastq files or any unsupported character (Supported: letters, numbers, underscores)."
                         )
                     )
-        if "fasta" in self.input_type:
+        if "fasta" in self.input_type and not self.input_dir_is_juno_cgmlst_output:
             for sample in self.sample_dict:
                 assembly_present = self.sample_dict[sample].keys()
                 if "assembly" not in assembly_present:
@@ -594,7 +1842,7 @@ class Pipeline:
                             f"The assembly is missing for sample {sample}. This pipeline expects an assembly per sample."
                         )
                     )
-        if "vcf" in self.input_type:
+        if "vcf" in self.input_type and not self.input_dir_is_juno_cgmlst_output:
             for sample in self.sample_dict:
                 vcf_present = self.sample_dict[sample].keys()
                 if "vcf" not in vcf_present:
@@ -603,7 +1851,7 @@ class Pipeline:
                             f"The VCF file is missing for sample {sample}. This pipeline expects a VCF per sample."
                         )
                     )
-        if "bam" in self.input_type:
+        if "bam" in self.input_type and not self.input_dir_is_juno_cgmlst_output:
             for sample in self.sample_dict:
                 bam_present = self.sample_dict[sample].keys()
                 if "bam" not in bam_present:
@@ -619,6 +1867,156 @@ class Pipeline:
         else:
             raise KeyError(errors)
 
+    def __reuse_previous_setup(self) -> bool:
+        """Reuse the samples of the previous launch if nothing changed since then.
+
+        The fingerprint of this launch (see fingerprint.launch_fingerprint)
+        is compared with the one stored in the audit trail by the previous
+        launch. If they match, the sample_dict is read from the sample sheet
+        in the audit trail instead of scanning and validating the input
+        directory again. Use --force-rescan to always scan it.
+
+        Returns:
+            bool: Whether the samples of the previous launch are reused.
+        """
+        self.fast_relaunch = False
+        self.launch_fingerprint: Optional[str] = None
+        if not self.input_dir.is_dir():
+            return False
+        self.launch_fingerprint = launch_fingerprint(
+            self.input_dir,
+            argv=(
+                self.pipeline_config.input_args()
+                if self.pipeline_config is not None
+                else [arg for arg in self.argv if arg != "--force-rescan"]
+            ),
+            user_parameters=self.user_parameters,
+            exclusion_file=self.exclusion_file,
+            # Deep enough to see the files found by --recursive and the
+            # allele-call tables of juno-cgmlst
+            max_depth=max(
+                FINGERPRINT_DEPTH,
+                self.recursive_depth + 1,
+                (
+                    CGMLST_FINGERPRINT_DEPTH
+                    if self.input_dir.joinpath("cgmlst").is_dir()
+                    else 0
+                ),
+            ),
+            input_type=self.input_type,
+            min_num_lines=self.min_num_lines,
+            pipeline_version=self.pipeline_version,
+        )
+        fingerprint_file = self.path_to_audit.joinpath("launch_fingerprint.yaml")
+        previous_sample_sheet = self.path_to_audit.joinpath("sample_sheet.yaml")
+        if (
+            self.force_rescan
+            or not fingerprint_file.exists()
+            or not previous_sample_sheet.exists()
+        ):
+            return False
+        with open(fingerprint_file) as f:
+            previous_fingerprint = yaml.safe_load(f) or {}
+        if previous_fingerprint.get("fingerprint") != self.launch_fingerprint:
+            return False
+        with open(previous_sample_sheet) as f:
+            self.sample_dict = SampleTable(yaml.safe_load(f))
+        print(
+            message_formatter(
+                f"The input is the same as in the previous launch ({previous_fingerprint['timestamp']}). Reusing its list of samples."
+            )
+        )
+        self.fast_relaunch = True
+        return True
+
+    def __use_given_sample_dict(self) -> None:
+        """Use the samples given to from_config instead of scanning the input directory.
+
+        There is no launch fingerprint for these samples, so a later launch
+        does not reuse them (see __reuse_previous_setup).
+        """
+        assert self._given_sample_dict is not None
+        self.fast_relaunch = False
+        self.launch_fingerprint = None
+        self.sample_dict = SampleTable(
+            {
+                name: dict(record)
+                for name, record in self._given_sample_dict.items()
+                if name not in self.excluded_samples
+            }
+        )
+
+    def __reuse_shared_sample_dict(self) -> bool:
+        """Reuse the samples that another pipeline of the batch found with the same fingerprint.
+
+        Returns:
+            bool: Whether the samples are reused.
+        """
+        if self.shared_caches is None or self.launch_fingerprint is None:
+            return False
+        sample_dict = self.shared_caches.sample_tables.get(
+            (self.pipeline_name, self.launch_fingerprint)
+        )
+        if sample_dict is None:
+            return False
+        self.sample_dict = SampleTable(
+            {name: dict(record) for name, record in sample_dict.items()}
+        )
+        print(
+            message_formatter(
+                "The input was already scanned by another run of this batch. Reusing its list of samples."
+            )
+        )
+        return True
+
+    def _has_min_lines(self, file_path: str) -> bool:
+        """validate_file_has_min_lines, cached in the shared caches if there are any."""
+        if self.shared_caches is None:
+            return validate_file_has_min_lines(file_path, self.min_num_lines)
+        return self.shared_caches.validated(
+            ("min_lines", self.min_num_lines),
+            file_path,
+            lambda path: validate_file_has_min_lines(path, self.min_num_lines),
+        )
+
+    def _is_valid_bam(self, file_path: str) -> bool:
+        """validate_bam, cached in the shared caches if there are any."""
+        if self.shared_caches is None:
+            return validate_bam(file_path)
+        return self.shared_caches.validated("bam", file_path, validate_bam)
+
+    def _audit_metadata(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """Metadata for the audit trail, collected once per batch if there are shared caches."""
+        if self.shared_caches is None:
+            return compute()
+        return self.shared_caches.metadata(key, compute)
+
+    def __previous_user_parameters_match(self) -> bool:
+        """Whether the user parameters are the same as in the audit trail.
+
+        Pipelines can set (part of) the user_parameters after setup, so they
+        are checked again before the audit trail of the previous launch is
+        reused.
+        """
+        previous_user_parameters = self.path_to_audit.joinpath("user_parameters.yaml")
+        if not previous_user_parameters.exists():
+            return False
+        with open(previous_user_parameters) as f:
+            return bool(yaml.safe_load(f) == self.user_parameters)
+
+    def __write_launch_fingerprint(self) -> None:
+        """Store the fingerprint of this launch in the audit trail (see __reuse_previous_setup)."""
+        with open(self.path_to_audit.joinpath("launch_fingerprint.yaml"), "w") as f:
+            yaml.dump(
+                {
+                    "fingerprint": self.launch_fingerprint,
+                    "timestamp": self.date_and_time,
+                    "run_id": str(self.unique_id),
+                },
+                f,
+                default_flow_style=False,
+            )
+
     def get_metadata_from_csv_file(
         self,
         filepath: Optional[Path] = None,
@@ -652,6 +2050,38 @@ class Pipeline:
                 Dict[str, Any], sample_metadata.to_dict(orient="index")
             )
 
+    def _prioritize_samples(self) -> None:
+        """Order the samples by priority and find the urgent ones (see juno_library.prioritization).
+
+        The priorities are read from the --priority-file or, without one,
+        from the priority_column of juno_metadata. Without either, the
+        samples keep the priority key they have (e.g. set by the pipeline).
+        """
+        if self.priority_file is not None:
+            priorities = read_priority_file(self.priority_file)
+        else:
+            priorities = priorities_from_metadata(
+                self.juno_metadata, self.priority_column
+            )
+        previous_order = [
+            (sample, record.get("priority"))
+            for sample, record in self.sample_dict.items()
+        ]
+        if priorities:
+            self.sample_dict = prioritize_samples(self.sample_dict, priorities)
+        if previous_order != [
+            (sample, record.get("priority"))
+            for sample, record in self.sample_dict.items()
+        ]:
+            # The sample sheet of the previous launch has other priorities
+            self.fast_relaunch = False
+        self.urgent_samples: list[str] = [
+            sample
+            for sample, record in self.sample_dict.items()
+            if (record.get("priority") or 0) > 0
+        ]
+        self.priority_targets = {}
+
     def __write_git_audit_file(self, git_file: Path) -> None:
         """Function to get URL and commit from pipeline repo.
 
@@ -659,7 +2089,10 @@ class Pipeline:
             git_file (Path): The file that the info is written to.
         """
 
-        git_audit = {"repo": get_repo_url("."), "commit": get_commit_git(".")}
+        git_audit = self._audit_metadata(
+            ("git", os.getcwd()),
+            lambda: {"repo": get_repo_url("."), "commit": get_commit_git(".")},
+        )
         with open(git_file, "w") as file:
             yaml.dump(git_audit, file, default_flow_style=False)
 
@@ -672,12 +2105,23 @@ class Pipeline:
             "hostname": self.hostname,
             "run_id": self.unique_id,
         }
+        if self.local:
+            pipeline_info["local_resources"] = self.local_resources
         with open(pipeline_file, "w") as file:
             yaml.dump(pipeline_info, file, default_flow_style=False)
 
     def __write_conda_audit_file(self, conda_file: Path) -> None:
         """Get list of environments in current conda environment."""
-        conda_audit = subprocess.check_output(["conda", "list"]).strip().decode("utf-8")
+
+        def conda_list() -> str:
+            with timed_subprocess("conda"):
+                return (
+                    subprocess.check_output(["conda", "list"]).strip().decode("utf-8")
+                )
+
+        conda_audit = self._audit_metadata(
+            ("conda", os.environ.get("CONDA_PREFIX")), conda_list
+        )
         with open(conda_file, "w") as file:
             file.writelines("Master environment list:\n\n")
             file.write(str(conda_audit))
@@ -737,10 +2181,8 @@ class Pipeline:
         by the run_snakemake function
         """
         print(message_formatter(f"Generating snakemake report for audit trail..."))
-        # The copy of the sample sheet that was generated for audit trail is
-        # used instead of the original sample sheet. This is to avoid that if
-        # a new run is started while there is one running, the correct sample
-        # sheet for this new run is used.
+        # The sample sheet and user parameters of this run have their own
+        # (per run) paths, so a run started meanwhile does not overwrite them.
         snakemake_report_successful: bool = snakemake(
             self.snakefile,
             workdir=self.workdir,
@@ -0,0 +1,186 @@
+"""Measurement of the filesystem latency between the cluster nodes and the
+node that runs snakemake.
+
+Snakemake waits up to latency_wait seconds for the output files of a job
+to become visible after the job finished. The right value depends on the
+(attribute) caching of the shared filesystem. The latency probe submits a
+small job that writes probe files, each with the time it was written, to
+the output directory. The files are polled from this node and the delay
+until every file is visible is used to choose latency_wait. The delays are
+computed with the clocks of two nodes, which are assumed to be in sync
+(e.g. with NTP) to well below a second. The probe is only advice: if the
+files are not all seen within a short timeout (e.g. because the job is
+still queued) the probe job is cancelled and the pipeline starts with what
+was observed so far.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
+
+# Script run by the probe job: writes the probe files one by one. Every
+# file is written under a temporary name and renamed, so it is complete
+# once it is visible.
+PROBE_WRITER = """
+import os, sys, time
+probe_dir, n_probes, interval = sys.argv[1], int(sys.argv[2]), float(sys.argv[3])
+for i in range(n_probes):
+    tmp_file = os.path.join(probe_dir, f".probe_{i}.tmp")
+    with open(tmp_file, "w") as f:
+        f.write(repr(time.time()))
+    os.rename(tmp_file, os.path.join(probe_dir, f"probe_{i}"))
+    time.sleep(interval)
+"""
+
+# Job ids in the output of bsub: "Job <1234> is submitted to queue <bio>."
+_LSF_JOB_ID = re.compile(r"Job <(\d+)>")
+
+# A submit function runs the probe writer and returns a function that
+# cancels it (or None if it cannot be cancelled)
+CancelProbe = Callable[[], None]
+SubmitProbe = Callable[[list[str], Path], Optional[CancelProbe]]
+
+
+def probe_writer_command(probe_dir: Path, n_probes: int, interval: float) -> list[str]:
+    """Command that writes the probe files (run on a cluster node)."""
+    return [
+        sys.executable,
+        "-c",
+        PROBE_WRITER,
+        str(probe_dir),
+        str(n_probes),
+        str(interval),
+    ]
+
+
+def submit_local(command: list[str], probe_dir: Path) -> CancelProbe:
+    """Local stand-in for a cluster submission: runs the probe writer in the background."""
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process.kill
+
+
+def lsf_submitter(queue: str) -> SubmitProbe:
+    """Function that submits the probe writer as a job to an LSF queue."""
+
+    def submit(command: list[str], probe_dir: Path) -> Optional[CancelProbe]:
+        submission = subprocess.run(
+            [
+                "bsub",
+                "-q",
+                queue,
+                "-J",
+                "latency_probe",
+                "-o",
+                str(probe_dir.joinpath("probe.out")),
+                "-e",
+                str(probe_dir.joinpath("probe.err")),
+                "-W",
+                "10",
+                *command,
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        match = _LSF_JOB_ID.search(submission.stdout)
+        if match is None:
+            return None
+        job_id = match.group(1)
+
+        def cancel() -> None:
+            # The job may have finished in the meantime, so errors are ignored
+            try:
+                subprocess.run(["bkill", job_id], capture_output=True, timeout=60)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+
+        return cancel
+
+    return submit
+
+
+def measure_latency(
+    probe_dir: Path,
+    submit: SubmitProbe = submit_local,
+    n_probes: int = 10,
+    interval: float = 1.0,
+    poll_interval: float = 0.1,
+    timeout: float = 60,
+) -> list[float]:
+    """Submit the probe writer and measure when its files become visible here.
+
+    Args:
+        probe_dir (Path): Directory (on the filesystem to measure) for the probe files.
+        submit (SubmitProbe, optional): Function that runs the probe writer command. Defaults to submit_local.
+        n_probes (int, optional): Number of probe files. Defaults to 10.
+        interval (float, optional): Seconds between the probe files. Defaults to 1.0.
+        poll_interval (float, optional): Seconds between polls of the probe files. Defaults to 0.1.
+        timeout (float, optional): Maximum seconds to wait for all the files, including the time the job waits in the queue. The probe job is cancelled after it. Defaults to 60.
+
+    Returns:
+        list[float]: Delay in seconds of every probe file that became visible before the timeout.
+    """
+    probe_dir.mkdir(parents=True, exist_ok=True)
+    cancel = submit(probe_writer_command(probe_dir, n_probes, interval), probe_dir)
+    delays = []
+    pending = set(range(n_probes))
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for i in sorted(pending):
+            probe_file = probe_dir.joinpath(f"probe_{i}")
+            if os.path.exists(probe_file):
+                seen = time.time()
+                written = float(probe_file.read_text())
+                delays.append(max(0.0, seen - written))
+                pending.remove(i)
+        time.sleep(poll_interval)
+    if pending and cancel is not None:
+        cancel()
+    return delays
+
+
+def latency_wait_from_delays(
+    delays: Sequence[float],
+    safety_factor: float = 3.0,
+    minimum: int = 5,
+    maximum: int = 300,
+    default: int = 60,
+) -> int:
+    """Choose latency_wait (in seconds) from the observed delays.
+
+    The largest observed delay is multiplied by safety_factor, because the
+    few probes of one launch can miss the occasional slow file, and the
+    result is kept between minimum and maximum. Without observations (e.g.
+    the probe job did not start in time) the default is returned.
+    """
+    if not delays:
+        return default
+    return min(maximum, max(minimum, math.ceil(max(delays) * safety_factor)))
+
+
+def latency_report(
+    delays: Sequence[float], n_probes: int, latency_wait: int, submit: str
+) -> dict[str, Any]:
+    """Summary of a latency probe for the audit trail."""
+    report: dict[str, Any] = {
+        "submit": submit,
+        "probes": n_probes,
+        "observed": len(delays),
+        "latency_wait": latency_wait,
+    }
+    if delays:
+        report["median_delay"] = round(statistics.median(delays), 3)
+        report["max_delay"] = round(max(delays), 3)
+        report["delays"] = [round(delay, 3) for delay in delays]
+    return report
@@ -0,0 +1,258 @@
+"""Run several Juno pipelines concurrently while sharing one resource budget.
+
+Every Pipeline assumes by default that it can use the whole cluster
+(cores=300, nodes=300). The PipelineOrchestrator takes a queue of input
+directories, runs a limited number of pipelines at the same time and splits
+a global budget of cores and nodes between them, either evenly (fair-share)
+or proportionally to the priority of each run.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from juno_library.helper_functions import (
+    error_formatter,
+    message_formatter,
+    split_budget,
+)
+from juno_library.juno_library import Pipeline
+
+PipelineFactory = Callable[..., Pipeline]
+
+
+@dataclass(frozen=True)
+class ResourceBudget:
+    """Resources that can be handed to one or more snakemake invocations.
+
+    cores is passed as the snakemake 'cores' argument and nodes as the
+    'nodes' argument, which is the maximum number of jobs submitted to the
+    cluster at the same time (the --jobs option of the snakemake CLI).
+    """
+
+    cores: int
+    nodes: int
+
+    def __add__(self, other: ResourceBudget) -> ResourceBudget:
+        return ResourceBudget(self.cores + other.cores, self.nodes + other.nodes)
+
+    def __sub__(self, other: ResourceBudget) -> ResourceBudget:
+        return ResourceBudget(self.cores - other.cores, self.nodes - other.nodes)
+
+
+@dataclass
+class RunRequest:
+    """One pipeline run in the queue of the orchestrator."""
+
+    input_dir: Path
+    output_dir: Path
+    argv: list[str] = field(default_factory=list)
+    priority: float = 1.0
+
+    def to_argv(self) -> list[str]:
+        """Command line arguments for the Pipeline parser."""
+        return ["-i", str(self.input_dir), "-o", str(self.output_dir), *self.argv]
+
+
+@dataclass
+class RunResult:
+    """Outcome of a pipeline run started by the orchestrator."""
+
+    request: RunRequest
+    budget: ResourceBudget
+    successful: bool
+    elapsed_seconds: float
+    error: Optional[str] = None
+
+
+def _run_pipeline(
+    pipeline_factory: PipelineFactory, request: RunRequest, budget: ResourceBudget
+) -> None:
+    """Build and run one pipeline with the given budget.
+
+    This function is executed by the scheduler (possibly in another
+    process). Arguments given explicitly with --snakemake-args in the
+    request still take precedence over the budget.
+    """
+    pipeline = pipeline_factory(argv=request.to_argv())
+    pipeline.snakemake_args["cores"] = budget.cores
+    pipeline.snakemake_args["nodes"] = budget.nodes
+    pipeline.run()
+
+
+class LocalScheduler(ThreadPoolExecutor):
+    """Stand-in scheduler that runs the pipelines in threads of this process.
+
+    Snakemake itself is not thread-safe so this scheduler is meant for
+    testing the orchestration (e.g. with pipelines whose run method is
+    replaced) and not for production runs.
+    """
+
+
+@dataclass
+class PipelineOrchestrator:
+    """Run a queue of pipeline runs sharing a global resource budget.
+
+    Args:
+        pipeline_factory: Callable that returns a Pipeline when called with
+            argv=[...]. It is called in the scheduler, so for the default
+            (process based) scheduler it needs to be picklable, for instance
+            a Pipeline subclass or a functools.partial of Pipeline.
+        budget: Total cores and nodes for all the runs together.
+        max_parallel: Maximum number of pipelines running at the same time.
+        weighting: Either 'fair' (every run gets the same share and runs
+            are started in queue order) or 'priority' (the share of a run is
+            proportional to its priority and the queue is sorted by it).
+        scheduler: Executor used to run the pipelines. Defaults to a
+            process pool with max_parallel workers.
+    """
+
+    pipeline_factory: PipelineFactory
+    budget: ResourceBudget = ResourceBudget(cores=300, nodes=300)
+    max_parallel: int = 4
+    weighting: str = "fair"
+    scheduler: Optional[Executor] = None
+    queue: Deque[RunRequest] = field(default_factory=deque)
+
+    def __post_init__(self) -> None:
+        assert self.weighting in [
+            "fair",
+            "priority",
+        ], "The weighting can only be 'fair' or 'priority'"
+        assert self.max_parallel >= 1, "max_parallel should be at least 1"
+        assert self.max_parallel <= min(
+            self.budget.cores, self.budget.nodes
+        ), "max_parallel cannot be larger than the number of cores or nodes in the budget"
+
+    def add(
+        self,
+        input_dir: Path,
+        output_dir: Path,
+        argv: Optional[list[str]] = None,
+        priority: float = 1.0,
+    ) -> None:
+        """Add a run to the queue.
+
+        Raises:
+            ValueError: If the priority is not larger than 0.
+        """
+        if not priority > 0:
+            raise ValueError(
+                f"The priority of a run should be larger than 0, not {priority}."
+            )
+        self.queue.append(
+            RunRequest(
+                input_dir=Path(input_dir),
+                output_dir=Path(output_dir),
+                argv=argv or [],
+                priority=priority,
+            )
+        )
+
+    def _weight(self, request: RunRequest) -> float:
+        return request.priority if self.weighting == "priority" else 1.0
+
+    def _allocate(
+        self,
+        launching: List[RunRequest],
+        running: Sequence[Tuple[RunRequest, ResourceBudget]],
+    ) -> list[ResourceBudget]:
+        """Give every run that is about to start its share of the budget.
+
+        The share of a run is computed over all the runs that will be active
+        (running and launching) but it is capped by the resources that are
+        currently free, so the global budget is never exceeded.
+        """
+        in_use = ResourceBudget(0, 0)
+        for _, budget in running:
+            in_use = in_use + budget
+        free = self.budget - in_use
+        new_weights = [self._weight(request) for request in launching]
+        all_weights = sum(new_weights) + sum(
+            self._weight(request) for request, _ in running
+        )
+        share = sum(new_weights) / all_weights
+
+        def new_parts(total: int, available: int) -> list[int]:
+            target = max(len(launching), round(total * share))
+            return split_budget(min(target, available), new_weights)
+
+        cores = new_parts(self.budget.cores, free.cores)
+        nodes = new_parts(self.budget.nodes, free.nodes)
+        return [ResourceBudget(c, n) for c, n in zip(cores, nodes)]
+
+    def _default_scheduler(self) -> Executor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_parallel,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def run(self) -> list[RunResult]:
+        """Run all the queued pipelines.
+
+        Returns:
+            list[RunResult]: One result per run, in order of completion.
+        """
+        pending = deque(self.queue)
+        self.queue.clear()
+        if self.weighting == "priority":
+            pending = deque(sorted(pending, key=lambda r: r.priority, reverse=True))
+
+        scheduler = self.scheduler or self._default_scheduler()
+        running: Dict[Future[None], Tuple[RunRequest, ResourceBudget, float]] = {}
+        results: list[RunResult] = []
+        try:
+            while pending or running:
+                n_free_slots = self.max_parallel - len(running)
+                launching = [
+                    pending.popleft() for _ in range(min(n_free_slots, len(pending)))
+                ]
+                if launching:
+                    budgets = self._allocate(
+                        launching, [(req, bud) for req, bud, _ in running.values()]
+                    )
+                    for request, budget in zip(launching, budgets):
+                        print(
+                            message_formatter(
+                                f"Starting pipeline for {request.input_dir} with {budget.cores} cores and {budget.nodes} nodes."
+                            )
+                        )
+                        future = scheduler.submit(
+                            _run_pipeline, self.pipeline_factory, request, budget
+                        )
+                        running[future] = (request, budget, time.perf_counter())
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    request, budget, start = running.pop(future)
+                    exception = future.exception()
+                    result = RunResult(
+                        request=request,
+                        budget=budget,
+                        successful=exception is None,
+                        elapsed_seconds=time.perf_counter() - start,
+                        error=None if exception is None else repr(exception),
+                    )
+                    if not result.successful:
+                        print(
+                            error_formatter(
+                                f"The pipeline for {request.input_dir} failed: {result.error}"
+                            )
+                        )
+                    results.append(result)
+        finally:
+            if self.scheduler is None:
+                scheduler.shutdown()
+        return results
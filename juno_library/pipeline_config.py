@@ -0,0 +1,199 @@
+"""Typed configuration of a pipeline run, for running pipelines from Python.
+
+A Pipeline normally takes its settings from the command line (argv). To run
+many pipelines from Python (e.g. from a workflow manager), a PipelineConfig
+can be given instead with Pipeline.from_config: the settings are taken from
+the config as they are, without building and parsing an argv list. The
+pipelines of a batch (Pipeline.run_batch) share a SharedCaches object, so
+input files are validated once and the sample tables found for an input
+directory and the audit trail metadata (git and conda) are reused by the
+other runs of the batch.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional, Tuple, TypeVar
+
+from juno_library.sample_table import SampleTable
+
+T = TypeVar("T")
+
+# Fields of PipelineConfig whose parser option has another name (dest)
+_DESTS = {
+    "input_dir": "input",
+    "output_dir": "output",
+    "include_patterns": "include_pattern",
+    "exclude_patterns": "exclude_pattern",
+}
+# Fields that do not change which samples are found in the input directory
+_RUN_ONLY_FIELDS = {
+    "output_dir",
+    "workdir",
+    "prefix",
+    "local",
+    "time_limit",
+    "retries",
+    "max_mem_gb",
+    "max_time_limit",
+    "unlock",
+    "dryrun",
+    "queue",
+    "plan",
+    "use_singularity",
+    "shards",
+    "prefetch_jobs",
+    "latency_probe",
+    "force_rescan",
+    "scratch_dir",
+    "stage_mode",
+    "stage_jobs",
+    "keep_scratch",
+    "compact_logs",
+    "priority_file",
+    "reference_cache",
+    "run_registry",
+    "no_run_registry",
+    "profile",
+    "profile_memory",
+    "snakemake_args",
+}
+
+
+@dataclass
+class PipelineConfig:
+    """Settings of a pipeline run (the options of the Pipeline parser).
+
+    The fields have the defaults of the command line options. Options that
+    a pipeline adds to the parser itself can be given in extra, by the name
+    under which the parser stores them (their dest).
+    """
+
+    input_dir: Path
+    output_dir: Path = Path("output")
+    workdir: Path = Path(".")
+    exclusion_file: Optional[Path] = None
+    prefix: Optional[str] = None
+    local: bool = False
+    time_limit: int = 60
+    retries: int = 0
+    max_mem_gb: int = 256
+    max_time_limit: int = 1440
+    unlock: bool = False
+    dryrun: bool = False
+    queue: str = "bio"
+    plan: bool = False
+    use_singularity: bool = True
+    shards: int = 1
+    prefetch_jobs: int = 0
+    latency_probe: bool = False
+    force_rescan: bool = False
+    scratch_dir: Optional[Path] = None
+    stage_mode: str = "copy"
+    stage_jobs: int = 8
+    keep_scratch: bool = False
+    compact_logs: bool = True
+    recursive: int = 0
+    include_patterns: list[str] = field(default_factory=list)
+    exclude_patterns: list[str] = field(default_factory=list)
+    cgmlst_matrix: bool = False
+    priority_file: Optional[Path] = None
+    reference_cache: Optional[Path] = None
+    run_registry: Optional[Path] = None
+    no_run_registry: bool = False
+    profile: bool = False
+    profile_memory: bool = False
+    snakemake_args: dict[str, Any] = field(default_factory=dict)
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        for name in ("input_dir", "output_dir", "workdir"):
+            setattr(self, name, Path(getattr(self, name)))
+        for name in (
+            "exclusion_file",
+            "scratch_dir",
+            "priority_file",
+            "reference_cache",
+            "run_registry",
+        ):
+            if getattr(self, name) is not None:
+                setattr(self, name, Path(getattr(self, name)))
+
+    def to_namespace(self, parser: argparse.ArgumentParser) -> argparse.Namespace:
+        """The arguments as parse_args would return them for the equivalent argv.
+
+        Options of the parser that are not in the config keep their default.
+
+        Raises:
+            ValueError: If extra contains an option that the parser does not have.
+        """
+        defaults = {
+            action.dest: action.default
+            for action in parser._actions
+            if action.dest != argparse.SUPPRESS and action.default != argparse.SUPPRESS
+        }
+        unknown = set(self.extra) - set(defaults)
+        if unknown:
+            raise ValueError(f"Unknown pipeline option(s) in extra: {sorted(unknown)}")
+        values = {
+            _DESTS.get(f.name, f.name): getattr(self, f.name)
+            for f in fields(self)
+            if f.name != "extra"
+        }
+        return argparse.Namespace(**dict(defaults, **values, **self.extra))
+
+    def input_args(self) -> list[str]:
+        """The settings that determine the samples found in the input directory.
+
+        Used (instead of argv) in the launch fingerprint of the run.
+        """
+        return [
+            f"{f.name}={getattr(self, f.name)}"
+            for f in fields(self)
+            if f.name not in _RUN_ONLY_FIELDS
+        ]
+
+
+class SharedCaches:
+    """Caches shared by the pipelines that run in one process.
+
+    Attributes:
+        validations: Result of every check of an input file, by check, path, size and modification time (so a changed file is checked again).
+        sample_tables: Validated sample tables, by pipeline and launch fingerprint.
+        audit_metadata: Metadata for the audit trail that does not change between runs (git, conda).
+    """
+
+    def __init__(self) -> None:
+        self.validations: dict[Tuple[Hashable, str, int, int], bool] = {}
+        self.sample_tables: dict[Tuple[str, str], SampleTable] = {}
+        self.audit_metadata: dict[Hashable, Any] = {}
+
+    def validated(
+        self, check_name: Hashable, path: str, check: Callable[[str], bool]
+    ) -> bool:
+        """Result of check(path), computed once per version of the file."""
+        stat = os.stat(path)
+        key = (check_name, path, stat.st_size, stat.st_mtime_ns)
+        if key not in self.validations:
+            self.validations[key] = check(path)
+        return self.validations[key]
+
+    def metadata(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """Audit trail metadata, computed once."""
+        if key not in self.audit_metadata:
+            self.audit_metadata[key] = compute()
+        value: T = self.audit_metadata[key]
+        return value
+
+
+@dataclass
+class BatchResult:
+    """Outcome of one run of Pipeline.run_batch."""
+
+    config: PipelineConfig
+    successful: bool
+    elapsed_seconds: float
+    error: Optional[str] = None
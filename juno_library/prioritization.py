@@ -0,0 +1,134 @@
+"""Prioritization of samples, so urgent samples (e.g. of an outbreak) finish first.
+
+Every sample can get a priority, from a column of the metadata of the run
+(see Pipeline.get_metadata_from_csv_file) or from a priority file (a csv or
+tsv file with the columns sample and priority). Samples without a priority
+get 0. The priorities are used in two ways:
+
+- The sample sheet lists the samples from the highest to the lowest
+  priority and every sample gets a priority key, so Snakefiles that loop
+  over the samples (and the DAG built from them) see the urgent samples
+  first.
+- The samples with a priority above 0 are urgent. The final outputs of
+  their jobs are passed to snakemake as prioritytargets, which gives these
+  jobs and all the jobs they depend on the highest priority. When there are
+  more jobs than cores (or cluster slots), snakemake starts these first.
+
+Snakemake has no priority levels per job besides the highest one, so the
+order among the urgent samples (and among the other samples) only follows
+from the order of the sample sheet.
+"""
+
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import Any, Iterable, Mapping, Optional
+
+from pandas import read_csv
+
+from juno_library.sample_table import SampleTable
+
+PRIORITY_COLUMN = "priority"
+# Wildcard that holds the sample name in the per-sample rules of a Snakefile
+SAMPLE_WILDCARD = "sample"
+
+
+def _as_priority(sample: str, value: Any) -> int:
+    """The priority of a sample as an integer (missing values are 0)."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 0
+    try:
+        priority = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"The priority of sample {sample} should be a number, not {value!r}."
+        ) from None
+    if not priority.is_integer():
+        raise ValueError(
+            f"The priority of sample {sample} should be a whole number, not {value!r}."
+        )
+    return int(priority)
+
+
+def read_priority_file(priority_file: Path) -> dict[str, int]:
+    """Priorities from a csv or tsv file with (at least) the columns sample and priority.
+
+    Raises:
+        ValueError: If a column is missing or a priority is not a whole number.
+    """
+    table = read_csv(priority_file, sep=None, engine="python", dtype={"sample": str})
+    missing = {"sample", PRIORITY_COLUMN} - set(table.columns)
+    if missing:
+        raise ValueError(
+            f"The priority file {priority_file} has no column(s) {', '.join(sorted(missing))}."
+        )
+    return {
+        sample: _as_priority(sample, priority)
+        for sample, priority in zip(table["sample"], table[PRIORITY_COLUMN])
+    }
+
+
+def priorities_from_metadata(
+    metadata: Optional[Mapping[str, Mapping[str, Any]]],
+    column: str = PRIORITY_COLUMN,
+) -> dict[str, int]:
+    """Priorities from a column of the metadata per sample (empty if there is no such column)."""
+    if not metadata:
+        return {}
+    return {
+        sample: _as_priority(sample, values[column])
+        for sample, values in metadata.items()
+        if column in values
+    }
+
+
+def prioritize_samples(
+    sample_dict: Mapping[str, Mapping[str, Any]], priorities: Mapping[str, int]
+) -> SampleTable:
+    """The samples ordered from the highest to the lowest priority, with their priority.
+
+    Samples with the same priority keep their order. Priorities of samples
+    that are not in the sample_dict are ignored.
+    """
+    ordered = sorted(sample_dict, key=lambda sample: -priorities.get(sample, 0))
+    return SampleTable(
+        {
+            sample: dict(sample_dict[sample], priority=priorities.get(sample, 0))
+            for sample in ordered
+        }
+    )
+
+
+def priority_targets(
+    jobs: Iterable[Mapping[str, Any]], samples: Iterable[str]
+) -> dict[str, list[str]]:
+    """The final output files of the jobs of every sample, to use as prioritytargets.
+
+    The jobs (collected by capacity.DryRunJobs) belong to a sample through
+    their sample wildcard. Only the outputs that no other job of the same
+    sample uses as input are returned: giving those the highest priority
+    also gives it to the jobs they depend on. Outputs that snakemake reports
+    with an annotation (e.g. pipes) or that are not known yet (outputs of
+    checkpoints) are left out.
+
+    Returns:
+        dict[str, list[str]]: The output files per sample (samples without jobs are left out).
+    """
+    wanted = set(samples)
+    outputs: dict[str, list[str]] = {}
+    inputs: dict[str, set[str]] = {}
+    for job in jobs:
+        sample = (job.get("wildcards") or {}).get(SAMPLE_WILDCARD)
+        if sample not in wanted:
+            continue
+        outputs.setdefault(sample, []).extend(
+            output
+            for output in job["output"]
+            if not (output.endswith(")") or output == "<TBD>")
+        )
+        inputs.setdefault(sample, set()).update(job.get("input") or [])
+    return {
+        sample: [output for output in sample_outputs if output not in inputs[sample]]
+        for sample, sample_outputs in outputs.items()
+    }
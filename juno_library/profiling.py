@@ -0,0 +1,91 @@
+"""Profiling of the phases of a pipeline launch (used by --profile).
+
+Every phase (setup and run) is profiled with cProfile and, if requested,
+its memory allocations are traced with tracemalloc. For every phase the raw
+profile (<phase>.prof, readable with pstats or snakeviz) and a summary with
+the top functions (<phase>_summary.txt) are written to the profile
+directory, together with the wall time of the external commands run by the
+library (subprocess_timings.yaml).
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import yaml
+
+from juno_library.helper_functions import subprocess_timings
+
+
+class PhaseProfiler:
+    """Profile phases of a pipeline launch and write the results to a directory.
+
+    Args:
+        output_dir (Path): Directory to write the profiles to (created when needed).
+        trace_memory (bool, optional): Also trace memory allocations with tracemalloc. Defaults to False.
+        top_n (int, optional): Number of functions (and allocation sites) in the summaries. Defaults to 30.
+
+    A profiler is created for every run, so the timings of the external
+    commands are cleared when it is created: earlier runs in the same
+    process (or in the parent of a forked process) are not reported.
+    """
+
+    def __init__(
+        self, output_dir: Path, trace_memory: bool = False, top_n: int = 30
+    ) -> None:
+        self.output_dir = output_dir
+        self.trace_memory = trace_memory
+        self.top_n = top_n
+        subprocess_timings.clear()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Profile the block as the phase called name."""
+        profiler = cProfile.Profile()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            snapshot = None
+            if self.trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(self.output_dir.joinpath(f"{name}.prof"))
+            with open(self.output_dir.joinpath(f"{name}_summary.txt"), "w") as f:
+                f.write(f"Phase {name} took {seconds:.3f} seconds.\n\n")
+                f.write(self._top_functions(profiler))
+                if snapshot is not None:
+                    f.write(f"\nPeak traced memory: {peak / 1024**2:.1f} MB.\n\n")
+                    for statistic in snapshot.statistics("lineno")[: self.top_n]:
+                        f.write(f"{statistic}\n")
+            self.write_subprocess_timings()
+
+    def _top_functions(self, profiler: cProfile.Profile) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+        return stream.getvalue()
+
+    def write_subprocess_timings(self) -> None:
+        """Write the wall time of the external commands run since the start."""
+        timings = {
+            command: {"calls": len(seconds), "total_seconds": round(sum(seconds), 3)}
+            for command, seconds in sorted(subprocess_timings.items())
+        }
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.output_dir.joinpath("subprocess_timings.yaml"), "w") as f:
+            yaml.dump(timings, f, default_flow_style=False)
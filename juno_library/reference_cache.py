@@ -0,0 +1,152 @@
+"""Shared, content-addressed cache of references and their indexes.
+
+Every sample of a run usually points to the same reference, and every
+pipeline that needs an index of it (fai, dict, bwa, minimap2) builds its own
+copy. prepare_reference hashes the reference once and keeps a copy of it,
+with the requested indexes next to it, in a directory of the cache named
+after the hash (sha256) of its content:
+
+    <cache_dir>/<sha256>/reference.fasta
+    <cache_dir>/<sha256>/reference.fasta.fai
+    ...
+
+Runs (also of other pipelines) with a reference with the same content reuse
+the indexes that are already there. An entry is built under a lock, so runs
+that start at the same time build every index once. An index is only used
+once its marker file (written after the index command succeeded) exists.
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Mapping, NamedTuple
+
+from juno_library.helper_functions import file_lock, timed_subprocess
+from juno_library.staging import copy_file_verified, sha256_of_file
+
+
+class ReferenceIndex(NamedTuple):
+    """How to build an index of a reference.
+
+    {reference} in the fields is replaced by the path of the cached
+    reference and {stem} by that path without its extension.
+
+    Attributes:
+        command: The command that builds the index.
+        outputs: The files written by the command.
+        path: The path that is recorded in the sample entries (e.g. the index prefix for bwa).
+    """
+
+    command: list[str]
+    outputs: list[str]
+    path: str
+
+
+REFERENCE_INDEXES: dict[str, ReferenceIndex] = {
+    "fai": ReferenceIndex(
+        ["samtools", "faidx", "{reference}"], ["{reference}.fai"], "{reference}.fai"
+    ),
+    "dict": ReferenceIndex(
+        ["samtools", "dict", "-o", "{stem}.dict", "{reference}"],
+        ["{stem}.dict"],
+        "{stem}.dict",
+    ),
+    "bwa": ReferenceIndex(
+        ["bwa", "index", "{reference}"],
+        [f"{{reference}}.{ext}" for ext in ("amb", "ann", "bwt", "pac", "sa")],
+        "{reference}",
+    ),
+    "minimap2": ReferenceIndex(
+        ["minimap2", "-d", "{reference}.mmi", "{reference}"],
+        ["{reference}.mmi"],
+        "{reference}.mmi",
+    ),
+}
+
+
+def default_reference_cache() -> Path:
+    """The cache of the user (JUNO_REFERENCE_CACHE or ~/.juno/reference_cache)."""
+    return Path(
+        os.environ.get("JUNO_REFERENCE_CACHE", "~/.juno/reference_cache")
+    ).expanduser()
+
+
+def _fill(template: str, reference: Path) -> str:
+    return template.format(reference=reference, stem=reference.with_suffix(""))
+
+
+def prepare_reference(
+    reference: str | Path,
+    cache_dir: Path,
+    indexes: Mapping[str, ReferenceIndex],
+    build: bool = True,
+) -> dict[str, Any]:
+    """Find (or build) the cached copy of a reference and its indexes.
+
+    Args:
+        reference (str | Path): The reference (e.g. a fasta file).
+        cache_dir (Path): The directory of the cache (created if needed).
+        indexes (Mapping[str, ReferenceIndex]): The indexes that are needed, by name.
+        build (bool, optional): Copy the reference and build the missing indexes. If False (e.g. for a dry run) only the paths are returned. Defaults to True.
+
+    Raises:
+        subprocess.CalledProcessError | FileNotFoundError: If an index cannot be built.
+
+    Returns:
+        dict[str, Any]: The hash and cached path of the reference, the path of every index, whether they are all in the cache (cached) and a report per index.
+    """
+    start = time.perf_counter()
+    source = Path(reference)
+    checksum = sha256_of_file(source)
+    entry_dir = cache_dir.joinpath(checksum)
+    cached_reference = entry_dir.joinpath(source.name)
+    result: dict[str, Any] = {
+        "source": str(source),
+        "sha256": checksum,
+        "reference": str(cached_reference),
+        "indexes": {
+            name: _fill(index.path, cached_reference) for name, index in indexes.items()
+        },
+        "report": {},
+    }
+    if not build:
+        result["cached"] = cached_reference.exists() and all(
+            entry_dir.joinpath(f".{cached_reference.name}.{name}.done").exists()
+            for name in indexes
+        )
+        return result
+
+    entry_dir.mkdir(parents=True, exist_ok=True)
+    with file_lock(cache_dir.joinpath(f"{checksum}.lock")):
+        if not cached_reference.exists():
+            copy_file_verified(source, cached_reference)
+        for name, index in indexes.items():
+            index_start = time.perf_counter()
+            marker = entry_dir.joinpath(f".{cached_reference.name}.{name}.done")
+            if marker.exists():
+                status = "cached"
+            else:
+                command = [_fill(part, cached_reference) for part in index.command]
+                with timed_subprocess(command[0]):
+                    subprocess.run(command, check=True, capture_output=True)
+                missing = [
+                    output
+                    for output in (_fill(o, cached_reference) for o in index.outputs)
+                    if not os.path.exists(output)
+                ]
+                if missing:
+                    raise FileNotFoundError(
+                        f"The {name} index of {source} was not created: {missing}"
+                    )
+                marker.touch()
+                status = "built"
+            result["report"][name] = {
+                "status": status,
+                "seconds": round(time.perf_counter() - index_start, 3),
+            }
+    result["cached"] = True
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
@@ -0,0 +1,299 @@
+"""Retries of cluster jobs with more memory or time after LSF killed them.
+
+LSF kills a job that uses more memory than it requested (TERM_MEMLIMIT) or
+runs longer than its run time limit (TERM_RUNLIMIT) and writes the reason
+in the job report at the end of the .out log of the job. Resubmitting such
+a job with the same request fails the same way. With retries enabled
+(restart_times of snakemake), the mem_gb and time_limit resources of every
+rule are replaced (overwrite_resources) by an EscalatingResource: the first
+attempt of a job requests what the rule declares (or the time limit of the
+queue), every following attempt multiplies the request by a factor for
+every time the job was killed for that resource, up to a cap. Jobs that
+failed for another reason are resubmitted with the same request.
+
+Only the part of the logs written during this run counts: the size of
+every log at the start of the run is taken as its offset (LSF appends to
+existing logs). Rules whose mem_gb or time_limit is a function (e.g. of
+the attempt) keep their own.
+
+A killed job does not get the chance to report its failure to snakemake,
+so with retries the status of the jobs is asked to LSF with:
+
+    python -m juno_library.retries '<output of bsub>'
+
+LSF forgets finished jobs after a while (CLEAN_PERIOD), so the status of a
+job that bjobs does not know is taken from its history (bhist).
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import re
+import subprocess
+from pathlib import Path
+from typing import Any, Mapping, Optional
+
+# Reasons in the LSF job report, by the resource that ran out
+TERMINATION_REASONS = {"mem_gb": "TERM_MEMLIMIT", "time_limit": "TERM_RUNLIMIT"}
+DEFAULT_MEM_FACTOR = 2.0
+DEFAULT_TIME_FACTOR = 2.0
+# Job ids in the output of bsub: "Job <1234> is submitted to queue <bio>."
+_LSF_JOB_ID = re.compile(r"Job <(\d+)>")
+_LOG_NAME = re.compile(r"_(\d+)\.(out|err)$")
+
+LogOffsets = dict[str, int]
+
+
+def log_offsets(rule_log_dir: Path) -> LogOffsets:
+    """Size of every log of a rule, the offset from which the logs of this run start."""
+    if not rule_log_dir.is_dir():
+        return {}
+    return {log.name: log.stat().st_size for log in rule_log_dir.iterdir()}
+
+
+def log_wildcards(wildcards: Any) -> str:
+    """The wildcards of a job as they appear in the names of its cluster logs (e.g. sample=s1)."""
+    from snakemake.utils import QuotedFormatter, SequenceFormatter
+
+    formatter = SequenceFormatter(separator=" ")
+    formatter.element_formatter = QuotedFormatter()
+    formatted: str = formatter.format("{}", wildcards)
+    return formatted
+
+
+def count_kills(text: str) -> dict[str, int]:
+    """Number of times a job report says the job was killed, per resource."""
+    return {
+        resource: len(re.findall(rf"^{reason}\b", text, flags=re.MULTILINE))
+        for resource, reason in TERMINATION_REASONS.items()
+    }
+
+
+def job_kills(
+    rule_log_dir: Path, rule: str, wildcards: str, offsets: LogOffsets
+) -> dict[str, int]:
+    """Kills per resource of the jobs of a rule with these wildcards, during this run.
+
+    The logs are named <rule>_<wildcards>_<jobid>.<out|err> (see
+    cluster_logs.cluster_log_options and log_wildcards).
+    """
+    kills = dict.fromkeys(TERMINATION_REASONS, 0)
+    if not rule_log_dir.is_dir():
+        return kills
+    prefix = f"{rule}_{wildcards}"
+    for log in rule_log_dir.iterdir():
+        match = _LOG_NAME.search(log.name)
+        if match is None or log.name[: match.start()] != prefix:
+            continue
+        with open(log, "rb") as f:
+            f.seek(offsets.get(log.name, 0))
+            text = f.read().decode(errors="replace")
+        for resource, n in count_kills(text).items():
+            kills[resource] += n
+    return kills
+
+
+def escalate(base: float, factor: float, kills: int, cap: float) -> int:
+    """The request after kills kills: base x factor^kills, at most cap (but at least base)."""
+    return int(math.ceil(max(base, min(cap, base * factor**kills))))
+
+
+class EscalatingResource:
+    """Resource of a rule that grows with the kills of the job for that resource.
+
+    Snakemake evaluates it for every attempt of a job (with the wildcards
+    and the attempt number). It only holds plain values, so it can be sent
+    to the processes of a sharded run.
+
+    The job scripts get the overwritten resources as text (--set-resources)
+    next to the evaluated resources of the job (--resources), which limit
+    the resources of the rule. So in the job script the resource is the cap,
+    limited to the request of the attempt.
+    """
+
+    def __init__(
+        self,
+        resource: str,
+        base: float,
+        factor: float,
+        cap: float,
+        rule: str,
+        rule_log_dir: Path,
+        offsets: LogOffsets,
+    ) -> None:
+        self.resource = resource
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.rule = rule
+        self.rule_log_dir = rule_log_dir
+        self.offsets = offsets
+
+    def __str__(self) -> str:
+        return str(int(math.ceil(max(self.base, self.cap))))
+
+    def __call__(self, wildcards: Any, attempt: int) -> int:
+        if attempt <= 1:
+            return escalate(self.base, self.factor, 0, self.cap)
+        kills = job_kills(
+            self.rule_log_dir, self.rule, log_wildcards(wildcards), self.offsets
+        )
+        return escalate(self.base, self.factor, kills[self.resource], self.cap)
+
+
+def escalating_resources(
+    rule_resources: Mapping[str, Mapping[str, Any]],
+    cluster_log_dir: Path,
+    time_limit: int,
+    max_mem_gb: float,
+    max_time_limit: int,
+    mem_factor: float = DEFAULT_MEM_FACTOR,
+    time_factor: float = DEFAULT_TIME_FACTOR,
+) -> dict[str, dict[str, EscalatingResource]]:
+    """The resources of every rule for overwrite_resources.
+
+    Args:
+        rule_resources (Mapping[str, Mapping[str, Any]]): The resources that every rule declares.
+        cluster_log_dir (Path): Directory with the logs of the cluster jobs (one subdirectory per rule).
+        time_limit (int): Time limit (minutes) of the first attempt of the jobs of rules that do not declare one.
+        max_mem_gb (float): Largest memory request of a retried job.
+        max_time_limit (int): Largest time limit (minutes) of a retried job.
+        mem_factor (float, optional): Growth of the memory request per memory kill. Defaults to DEFAULT_MEM_FACTOR.
+        time_factor (float, optional): Growth of the time limit per run time kill. Defaults to DEFAULT_TIME_FACTOR.
+
+    Returns:
+        dict[str, dict[str, EscalatingResource]]: The mem_gb and time_limit per rule, for the rules that declare them as a number (or that do not declare a time_limit). Rules without any are left out.
+    """
+    resources: dict[str, dict[str, EscalatingResource]] = {}
+    for rule, declared in rule_resources.items():
+        rule_log_dir = cluster_log_dir.joinpath(rule)
+        offsets = log_offsets(rule_log_dir)
+        settings = {
+            "mem_gb": (declared.get("mem_gb"), mem_factor, max_mem_gb),
+            "time_limit": (
+                declared.get("time_limit", time_limit),
+                time_factor,
+                max_time_limit,
+            ),
+        }
+        escalating = {
+            resource: EscalatingResource(
+                resource, base, factor, cap, rule, rule_log_dir, offsets
+            )
+            for resource, (base, factor, cap) in settings.items()
+            # Resources that are a function (e.g. of the attempt) are kept
+            if isinstance(base, (int, float)) and not isinstance(base, bool)
+        }
+        if escalating:
+            resources[rule] = escalating
+    return resources
+
+
+def retry_report(
+    resources: Mapping[str, Mapping[str, EscalatingResource]],
+) -> dict[str, Any]:
+    """Kills and final requests of the jobs that were killed during this run.
+
+    Args:
+        resources (Mapping[str, Mapping[str, EscalatingResource]]): The resources given to snakemake (see escalating_resources).
+
+    Returns:
+        dict[str, Any]: Totals per rule and the killed jobs with their kills and final requests.
+    """
+    rules: dict[str, dict[str, int]] = {}
+    jobs: list[dict[str, Any]] = []
+    for rule, rule_resources in sorted(resources.items()):
+        any_resource = next(iter(rule_resources.values()))
+        rule_log_dir, offsets = any_resource.rule_log_dir, any_resource.offsets
+        if not rule_log_dir.is_dir():
+            continue
+        job_logs: dict[str, None] = {}
+        for log in sorted(rule_log_dir.iterdir()):
+            match = _LOG_NAME.search(log.name)
+            if match is not None and log.name.startswith(f"{rule}_"):
+                job_logs[log.name[len(rule) + 1 : match.start()]] = None
+        for wildcards in job_logs:
+            kills = job_kills(rule_log_dir, rule, wildcards, offsets)
+            if not any(kills.values()):
+                continue
+            job: dict[str, Any] = {"rule": rule, "wildcards": wildcards}
+            for resource, n in kills.items():
+                job[f"{resource}_kills"] = n
+                if resource in rule_resources:
+                    escalating = rule_resources[resource]
+                    job[resource] = escalate(
+                        escalating.base, escalating.factor, n, escalating.cap
+                    )
+            jobs.append(job)
+            totals = rules.setdefault(rule, {"killed_jobs": 0})
+            totals["killed_jobs"] += 1
+            for resource, n in kills.items():
+                totals[f"{resource}_kills"] = totals.get(f"{resource}_kills", 0) + n
+    return {
+        "killed_jobs": len(jobs),
+        "mem_gb_kills": sum(job["mem_gb_kills"] for job in jobs),
+        "time_limit_kills": sum(job["time_limit_kills"] for job in jobs),
+        "rules": rules,
+        "jobs": jobs,
+    }
+
+
+def _lsf_history_status(job_id: str) -> str:
+    """Status of a job that bjobs does not know (anymore), from its history."""
+    try:
+        history = subprocess.run(
+            ["bhist", "-l", job_id], capture_output=True, text=True, timeout=60
+        ).stdout
+    except subprocess.TimeoutExpired:
+        return "running"
+    except OSError:
+        return "failed"
+    # Without a history that says it finished well the job is lost
+    return "success" if "Done successfully" in history else "failed"
+
+
+def lsf_job_status(submit_output: str) -> str:
+    """Status of an LSF job for snakemake (success, failed or running).
+
+    Args:
+        submit_output (str): The output of bsub, which snakemake passes as the job id.
+    """
+    match = _LSF_JOB_ID.search(submit_output)
+    if match is None:
+        return "failed"
+    job_id = match.group(1)
+    try:
+        bjobs = subprocess.run(
+            ["bjobs", "-noheader", "-o", "stat", job_id],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    except subprocess.TimeoutExpired:
+        # LSF did not answer, ask again later
+        return "running"
+    except OSError:
+        # Without bjobs the job would be polled forever
+        return "failed"
+    status = bjobs.stdout.strip()
+    if status == "DONE":
+        return "success"
+    if status in ("EXIT", "ZOMBI"):
+        return "failed"
+    if bjobs.returncode != 0 or not status or "is not found" in bjobs.stderr:
+        return _lsf_history_status(job_id)
+    return "running"
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Print the status of an LSF job for snakemake (success, failed or running)."
+    )
+    parser.add_argument("submit_output", help="The output of bsub for the job.")
+    args = parser.parse_args(argv)
+    print(lsf_job_status(args.submit_output))
+
+
+if __name__ == "__main__":
+    main()
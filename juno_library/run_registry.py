@@ -0,0 +1,263 @@
+"""Local registry of the pipeline runs.
+
+Every run already writes log_pipeline.yaml (with its run_id) in its own
+output directory, but finding the runs of a sample that way means walking
+every output directory. Pipeline.run can also record its runs in an
+SQLite database on the local disk with indexed lookup by sample, date and
+pipeline. Runs are only recorded when a registry is chosen, with
+--run-registry or the JUNO_RUN_REGISTRY environment variable, so nothing
+is written to the home directory (which can be shared or read-only on the
+login nodes of a cluster) by default. The lookups below use
+~/.juno/run_registry.sqlite if JUNO_RUN_REGISTRY is not set.
+
+The registry is append-only: runs and samples are inserted once and every
+change of the status of a run is a new row, so the history of a run is
+kept. The current status of a run is its latest status. Runs can be found
+with:
+
+    python -m juno_library.run_registry --sample sample1
+"""
+
+from __future__ import annotations
+
+import argparse
+import getpass
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+RUN_STATUSES = ("running", "succeeded", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    pipeline_name TEXT NOT NULL,
+    pipeline_version TEXT NOT NULL,
+    input_dir TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    hostname TEXT,
+    user TEXT,
+    started_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS run_samples (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    sample TEXT NOT NULL,
+    PRIMARY KEY (run_id, sample)
+);
+CREATE TABLE IF NOT EXISTS run_status (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    status TEXT NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_pipeline ON runs (pipeline_name, started_at);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS run_samples_sample ON run_samples (sample);
+CREATE INDEX IF NOT EXISTS run_status_run_id ON run_status (run_id, recorded_at);
+"""
+
+_APPEND_ONLY_TRIGGERS = "".join(
+    f"""
+CREATE TRIGGER IF NOT EXISTS {table}_no_{action} BEFORE {action.upper()} ON {table}
+BEGIN SELECT RAISE(ABORT, 'the run registry is append-only'); END;
+"""
+    for table in ("runs", "run_samples", "run_status")
+    for action in ("update", "delete")
+)
+
+
+def default_registry_path() -> Path:
+    """The registry of the user (JUNO_RUN_REGISTRY or ~/.juno/run_registry.sqlite)."""
+    return Path(
+        os.environ.get("JUNO_RUN_REGISTRY", "~/.juno/run_registry.sqlite")
+    ).expanduser()
+
+
+def configured_registry_path() -> Optional[Path]:
+    """The registry set in JUNO_RUN_REGISTRY, None if the variable is not set."""
+    path = os.environ.get("JUNO_RUN_REGISTRY")
+    return Path(path).expanduser() if path else None
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class RunRegistry:
+    """Append-only SQLite registry of pipeline runs.
+
+    Args:
+        path (Optional[Path], optional): The database (created if needed). Defaults to default_registry_path().
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path if path is not None else default_registry_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA + _APPEND_ONLY_TRIGGERS)
+        connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def register_run(
+        self,
+        run_id: str,
+        pipeline_name: str,
+        pipeline_version: str,
+        input_dir: str | Path,
+        output_dir: str | Path,
+        samples: Iterable[str],
+        hostname: Optional[str] = None,
+        status: str = "running",
+    ) -> None:
+        """Add a run, its samples and its first status to the registry.
+
+        A run that is already registered (e.g. relaunched with the same
+        run_id) keeps its original entry and only gets the new status.
+        """
+        assert status in RUN_STATUSES, f"The status can only be one of {RUN_STATUSES}"
+        started_at = _now()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    pipeline_name,
+                    pipeline_version,
+                    str(input_dir),
+                    str(output_dir),
+                    hostname,
+                    getpass.getuser(),
+                    started_at,
+                ),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO run_samples VALUES (?, ?)",
+                [(run_id, sample) for sample in samples],
+            )
+            connection.execute(
+                "INSERT INTO run_status VALUES (?, ?, ?)", (run_id, status, started_at)
+            )
+        connection.close()
+
+    def record_status(self, run_id: str, status: str) -> None:
+        """Append a new status of a registered run."""
+        assert status in RUN_STATUSES, f"The status can only be one of {RUN_STATUSES}"
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO run_status VALUES (?, ?, ?)", (run_id, status, _now())
+            )
+        connection.close()
+
+    def find_runs(
+        self,
+        sample: Optional[str] = None,
+        pipeline_name: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> list[dict[str, Any]]:
+        """Find runs, most recent first, with their current status.
+
+        Args:
+            sample (Optional[str], optional): Only runs that included this sample. Defaults to None.
+            pipeline_name (Optional[str], optional): Only runs of this pipeline. Defaults to None.
+            since (Optional[str], optional): Only runs started on or after this date (YYYY-MM-DD). Defaults to None.
+            until (Optional[str], optional): Only runs started before the end of this date (YYYY-MM-DD). Defaults to None.
+
+        Returns:
+            list[dict[str, Any]]: One dictionary per run with the columns of the runs table and its status.
+        """
+        conditions, parameters = [], []
+        if sample is not None:
+            conditions.append(
+                "runs.run_id IN (SELECT run_id FROM run_samples WHERE sample = ?)"
+            )
+            parameters.append(sample)
+        if pipeline_name is not None:
+            conditions.append("runs.pipeline_name = ?")
+            parameters.append(pipeline_name)
+        if since is not None:
+            conditions.append("runs.started_at >= ?")
+            parameters.append(since)
+        if until is not None:
+            # Dates sort before the times on that date, so compare with the next character
+            conditions.append("runs.started_at < ?")
+            parameters.append(f"{until}~")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                f"""
+                SELECT runs.*, (
+                    SELECT status FROM run_status
+                    WHERE run_status.run_id = runs.run_id
+                    ORDER BY recorded_at DESC, rowid DESC LIMIT 1
+                ) AS status
+                FROM runs {where}
+                ORDER BY runs.started_at DESC
+                """,
+                parameters,
+            ).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+    def run_samples(self, run_id: str) -> list[str]:
+        """The samples of a run."""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT sample FROM run_samples WHERE run_id = ? ORDER BY sample",
+                (run_id,),
+            ).fetchall()
+        finally:
+            connection.close()
+        return [row["sample"] for row in rows]
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Find previous pipeline runs in the local run registry."
+    )
+    parser.add_argument(
+        "--registry",
+        type=Path,
+        default=None,
+        help="Path to the registry. Defaults to JUNO_RUN_REGISTRY or ~/.juno/run_registry.sqlite.",
+    )
+    parser.add_argument("--sample", help="Only runs that included this sample.")
+    parser.add_argument("--pipeline", help="Only runs of this pipeline.")
+    parser.add_argument(
+        "--since", metavar="YYYY-MM-DD", help="Only runs since this date."
+    )
+    parser.add_argument(
+        "--until", metavar="YYYY-MM-DD", help="Only runs until this date."
+    )
+    parser.add_argument(
+        "--samples", action="store_true", help="Also print the samples of every run."
+    )
+    args = parser.parse_args(argv)
+    registry = RunRegistry(args.registry)
+    runs = registry.find_runs(args.sample, args.pipeline, args.since, args.until)
+    columns = [
+        "run_id",
+        "started_at",
+        "pipeline_name",
+        "pipeline_version",
+        "status",
+        "output_dir",
+    ]
+    print("\t".join(columns))
+    for run in runs:
+        print("\t".join(str(run[column]) for column in columns))
+        if args.samples:
+            print("\t" + ",".join(registry.run_samples(run["run_id"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""In-memory representation of the samples of a pipeline run.
+
+The sample_dict of a Pipeline maps every sample to the absolute paths of its
+input files. A SampleTable is a dict of SampleRecords and a SampleRecord is a
+dict from keys to paths without an instance dictionary of its own, so both
+take the same memory as, and can be used (and dumped to json or yaml)
+exactly as, the dictionaries they replace.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterable, Mapping, Optional, Tuple
+
+import yaml
+
+SAMPLE_FILE_KEYS: Tuple[str, ...] = (
+    "R1",
+    "R2",
+    "assembly",
+    "vcf",
+    "bam",
+    "reference",
+    "bam_index",
+)
+
+
+class SampleRecord(dict):  # type: ignore[type-arg]
+    """Input files (and other properties) of one sample.
+
+    The keys in SAMPLE_FILE_KEYS hold the paths of the input files. Any other
+    key (e.g. metadata added by a pipeline) is stored as is.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, files: Optional[Mapping[str, Any]] = None) -> None:
+        super().__init__(files or {})
+
+    def to_dict(self) -> dict[str, Any]:
+        """Plain dictionary with the same content."""
+        return dict(self)
+
+
+class SampleTable(dict):  # type: ignore[type-arg]
+    """Dictionary of sample names to SampleRecords.
+
+    Values that are set as dictionaries are converted to SampleRecords, so
+    code written for the sample_dict (e.g. sample_dict.setdefault(name, {})
+    followed by sample[key] = path) keeps working.
+    """
+
+    def __init__(
+        self,
+        samples: (
+            Mapping[str, Mapping[str, Any]] | Iterable[Tuple[str, Mapping[str, Any]]]
+        ) = (),
+    ) -> None:
+        super().__init__()
+        self.update(samples)
+
+    @staticmethod
+    def _to_record(files: Mapping[str, Any]) -> SampleRecord:
+        return files if isinstance(files, SampleRecord) else SampleRecord(files)
+
+    def __setitem__(self, sample: str, files: Mapping[str, Any]) -> None:
+        super().__setitem__(sample, self._to_record(files))
+
+    def setdefault(
+        self, sample: str, default: Optional[Mapping[str, Any]] = None
+    ) -> SampleRecord:
+        if sample not in self:
+            self[sample] = default or {}
+        record: SampleRecord = self[sample]
+        return record
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for sample, files in dict(*args, **kwargs).items():
+            self[sample] = files
+
+    def to_dict(self) -> dict[str, dict[str, Any]]:
+        """Plain dictionary of dictionaries with the same content."""
+        return {sample: record.to_dict() for sample, record in self.items()}
+
+
+def _represent_sample_record(
+    dumper: yaml.representer.SafeRepresenter, record: SampleRecord
+) -> Any:
+    return dumper.represent_dict(record.to_dict())
+
+
+def _represent_sample_table(
+    dumper: yaml.representer.SafeRepresenter, table: SampleTable
+) -> Any:
+    return dumper.represent_dict(dict(table))
+
+
+for _dumper in (yaml.Dumper, yaml.SafeDumper, getattr(yaml, "CDumper", yaml.Dumper)):
+    yaml.add_representer(SampleRecord, _represent_sample_record, Dumper=_dumper)
+    yaml.add_representer(SampleTable, _represent_sample_table, Dumper=_dumper)
@@ -0,0 +1,377 @@
+"""Warm pipeline server: run pipelines without paying the startup per launch.
+
+Every launch of a pipeline starts an interpreter and imports snakemake,
+pandas and yaml before any work is done. The server is a long-lived process
+that has imported the library (and the pipeline) once and runs the
+pipeline for requests that arrive on a local UNIX socket:
+
+    python -m juno_library.server serve --pipeline my_pipeline:MyPipeline &
+    python -m juno_library.server run -- -i input_dir -o output_dir
+
+The client sends the command line arguments of the Pipeline parser, its
+working directory and its environment, and passes its stdin, stdout and
+stderr along with them (SCM_RIGHTS). Every run is executed in a process
+forked from the server, so runs are isolated from each other and from the
+server (working directory, environment, snakemake state) and print to the
+terminal of the client. The exit status of the run is sent back and is the
+exit status of the client. Requests are read as they arrive, without
+blocking the server, so a client that connects but stalls only holds its own
+connection (until REQUEST_TIMEOUT).
+
+The client only imports the standard library, it does not import the
+pipeline or snakemake.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+import traceback
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Mapping, Optional, Sequence
+
+if TYPE_CHECKING:
+    from juno_library.orchestrator import PipelineFactory
+
+# Largest request (arguments, working directory and environment) in bytes
+MAX_REQUEST_SIZE = 1024**2
+# Seconds a client has to send its request once it is connected
+REQUEST_TIMEOUT = 10
+# Modules of snakemake that are only imported once a workflow runs
+_PRELOAD_MODULES = [
+    "snakemake.dag",
+    "snakemake.persistence",
+    "snakemake.scheduler",
+    "snakemake.workflow",
+    "snakemake.executors",
+    "snakemake.report",
+]
+
+
+def default_socket_path() -> Path:
+    """The socket of the user (JUNO_PIPELINE_SERVER or ~/.juno/pipeline_server.sock)."""
+    return Path(
+        os.environ.get("JUNO_PIPELINE_SERVER", "~/.juno/pipeline_server.sock")
+    ).expanduser()
+
+
+def load_pipeline_factory(spec: str) -> PipelineFactory:
+    """Import a pipeline factory given as 'module:attribute' (e.g. a Pipeline subclass)."""
+    module_name, _, attribute = spec.partition(":")
+    assert attribute, f"The pipeline should be given as module:attribute, not {spec}"
+    factory: PipelineFactory = getattr(importlib.import_module(module_name), attribute)
+    return factory
+
+
+def _exit_status(wait_status: int) -> int:
+    """Exit status of a run as a shell would report it (128 + signal if killed)."""
+    exit_code = os.waitstatus_to_exitcode(wait_status)
+    return exit_code if exit_code >= 0 else 128 - exit_code
+
+
+def _execute_run(pipeline_factory: PipelineFactory, request: Mapping[str, Any]) -> int:
+    """Run the pipeline for one request (in the forked process of the run)."""
+    try:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        pipeline_factory(argv=list(request["argv"])).run()
+        return 0
+    except SystemExit as e:
+        # e.g. argparse errors and --help
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        return 1
+
+
+@dataclass
+class _PendingRequest:
+    """A request that is being received, or waits for a free run."""
+
+    connection: socket.socket
+    deadline: float = field(default_factory=lambda: time.monotonic() + REQUEST_TIMEOUT)
+    data: bytes = b""
+    fds: list[int] = field(default_factory=list)
+    request: Optional[dict[str, Any]] = None
+
+    def close(self) -> None:
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+        self.connection.close()
+
+
+class PipelineServer:
+    """Long-lived process that runs a pipeline for requests on a UNIX socket.
+
+    Args:
+        pipeline_factory (PipelineFactory): Callable that returns a Pipeline when called with argv=[...] (e.g. a Pipeline subclass or a functools.partial of Pipeline).
+        socket_path (Optional[Path], optional): The socket to listen on. Defaults to default_socket_path().
+        max_runs (int, optional): Maximum number of runs at the same time. Further requests wait. Defaults to 4.
+    """
+
+    def __init__(
+        self,
+        pipeline_factory: PipelineFactory,
+        socket_path: Optional[Path] = None,
+        max_runs: int = 4,
+    ) -> None:
+        assert max_runs >= 1, "max_runs should be at least 1"
+        self.pipeline_factory = pipeline_factory
+        self.socket_path = (
+            socket_path if socket_path is not None else default_socket_path()
+        )
+        self.max_runs = max_runs
+        # Runs in progress: pid of the forked process -> connection of the client
+        self.runs: dict[int, socket.socket] = {}
+        # Requests that are being received and complete requests that wait
+        # for a free run (in order of arrival)
+        self.receiving: dict[socket.socket, _PendingRequest] = {}
+        self.waiting: list[_PendingRequest] = []
+        self._stopping = False
+
+    def preload(self) -> None:
+        """Import the modules that a run needs, so the forked runs share them."""
+        import juno_library.juno_library  # noqa: F401
+
+        for module in _PRELOAD_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+
+    def shutdown(self, *_: Any) -> None:
+        """Stop accepting requests. The runs in progress are finished first."""
+        self._stopping = True
+
+    def serve_forever(self) -> None:
+        """Accept and run requests until shutdown is called (or SIGTERM/SIGINT)."""
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+        self.preload()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        # The socket appears once the server accepts connections
+        tmp_socket_path = self.socket_path.with_name(
+            f".{self.socket_path.name}.{os.getpid()}"
+        )
+        tmp_socket_path.unlink(missing_ok=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(tmp_socket_path))
+        os.chmod(tmp_socket_path, 0o600)
+        listener.listen()
+        os.replace(tmp_socket_path, self.socket_path)
+        # Everything happens in this thread: forking a process with other
+        # threads running can leave locks held in the child
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ)
+        try:
+            while not self._stopping or self.runs:
+                self._reap_runs()
+                while self.waiting and len(self.runs) < self.max_runs:
+                    self._start_run(self.waiting.pop(0), listener)
+                if self._stopping:
+                    time.sleep(0.05)
+                    continue
+                for key, _ in selector.select(timeout=0.05):
+                    if key.fileobj is listener:
+                        connection, _ = listener.accept()
+                        connection.setblocking(False)
+                        pending = _PendingRequest(connection)
+                        self.receiving[connection] = pending
+                        selector.register(connection, selectors.EVENT_READ, pending)
+                    else:
+                        self._receive_request(key.data, selector)
+                self._drop_stalled_requests(selector)
+        finally:
+            for pending in [*self.receiving.values(), *self.waiting]:
+                pending.close()
+            selector.close()
+            listener.close()
+            self.socket_path.unlink(missing_ok=True)
+
+    def _receive_request(
+        self, pending: _PendingRequest, selector: selectors.BaseSelector
+    ) -> None:
+        """Read what a client has sent; a complete request waits for a free run."""
+        connection = pending.connection
+        try:
+            data, fds, _, _ = socket.recv_fds(connection, MAX_REQUEST_SIZE, 3)
+            pending.fds.extend(fds)
+            if not data:
+                raise ValueError("the connection was closed before the end")
+            pending.data += data
+            if len(pending.data) > MAX_REQUEST_SIZE:
+                raise ValueError(f"larger than {MAX_REQUEST_SIZE} bytes")
+            if not pending.data.endswith(b"\n"):
+                return
+            pending.request = json.loads(pending.data)
+            assert (
+                len(pending.fds) == 3
+            ), "The client should pass its stdin, stdout and stderr"
+        except BlockingIOError:
+            return
+        except (OSError, ValueError, AssertionError) as e:
+            print(f"Invalid request: {e}", file=sys.stderr)
+            selector.unregister(connection)
+            del self.receiving[connection]
+            pending.close()
+            return
+        selector.unregister(connection)
+        del self.receiving[connection]
+        connection.setblocking(True)
+        self.waiting.append(pending)
+
+    def _drop_stalled_requests(self, selector: selectors.BaseSelector) -> None:
+        """Close the connections of clients that did not send their request in time."""
+        now = time.monotonic()
+        for connection, pending in list(self.receiving.items()):
+            if now > pending.deadline:
+                print(
+                    f"Invalid request: not received within {REQUEST_TIMEOUT} seconds",
+                    file=sys.stderr,
+                )
+                selector.unregister(connection)
+                del self.receiving[connection]
+                pending.close()
+
+    def _start_run(self, pending: _PendingRequest, listener: socket.socket) -> None:
+        connection, fds, request = pending.connection, pending.fds, pending.request
+        assert request is not None
+        pid = os.fork()
+        if pid == 0:
+            exit_status = 1
+            try:
+                listener.close()
+                connection.close()
+                for other_connection in self.runs.values():
+                    other_connection.close()
+                # Including the stdin, stdout and stderr of the other clients
+                for other in [*self.receiving.values(), *self.waiting]:
+                    other.close()
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                sys.stdout.flush()
+                sys.stderr.flush()
+                for target, fd in enumerate(fds):
+                    os.dup2(fd, target)
+                    os.close(fd)
+                # The streams of the server may not write to its file descriptors
+                sys.stdin = open(0, closefd=False)
+                sys.stdout = open(1, "w", buffering=1, closefd=False)
+                sys.stderr = open(2, "w", buffering=1, closefd=False)
+                exit_status = _execute_run(self.pipeline_factory, request)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_status)
+        for fd in fds:
+            os.close(fd)
+        self.runs[pid] = connection
+
+    def _reap_runs(self) -> None:
+        """Send the exit status of the finished runs to their clients."""
+        for pid in list(self.runs):
+            finished_pid, wait_status = os.waitpid(pid, os.WNOHANG)
+            if finished_pid == 0:
+                continue
+            connection = self.runs.pop(pid)
+            try:
+                response = {"exit_status": _exit_status(wait_status)}
+                connection.sendall(json.dumps(response).encode() + b"\n")
+            except OSError:
+                pass  # The client is gone
+            finally:
+                connection.close()
+
+
+def request_run(
+    argv: Sequence[str],
+    socket_path: Optional[Path] = None,
+    cwd: Optional[str] = None,
+    env: Optional[Mapping[str, str]] = None,
+    fds: Sequence[int] = (0, 1, 2),
+) -> int:
+    """Run the pipeline on a server and wait for it to finish.
+
+    Args:
+        argv (Sequence[str]): Arguments for the Pipeline parser.
+        socket_path (Optional[Path], optional): The socket of the server. Defaults to default_socket_path().
+        cwd (Optional[str], optional): Working directory of the run. Defaults to the current directory.
+        env (Optional[Mapping[str, str]], optional): Environment of the run. Defaults to the current environment.
+        fds (Sequence[int], optional): The stdin, stdout and stderr of the run. Defaults to the ones of this process.
+
+    Returns:
+        int: The exit status of the run.
+    """
+    request = {
+        "argv": list(argv),
+        "cwd": cwd if cwd is not None else os.getcwd(),
+        "env": dict(env if env is not None else os.environ),
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(
+            str(socket_path if socket_path is not None else default_socket_path())
+        )
+        socket.send_fds(connection, [json.dumps(request).encode() + b"\n"], fds)
+        response = b""
+        while not response.endswith(b"\n"):
+            chunk = connection.recv(4096)
+            if not chunk:
+                raise ConnectionError("The server closed the connection during the run")
+            response += chunk
+    exit_status: int = json.loads(response)["exit_status"]
+    return exit_status
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Run a pipeline from a warm server process."
+    )
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        default=None,
+        help="Socket of the server. Defaults to JUNO_PIPELINE_SERVER or ~/.juno/pipeline_server.sock.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Start a server.")
+    serve_parser.add_argument(
+        "--pipeline",
+        required=True,
+        metavar="MODULE:ATTRIBUTE",
+        help="Pipeline to run, e.g. my_pipeline:MyPipeline (a Pipeline subclass or a callable that returns a Pipeline when called with argv=[...]).",
+    )
+    serve_parser.add_argument(
+        "--max-runs",
+        type=int,
+        default=4,
+        metavar="INT",
+        help="Maximum number of runs at the same time.",
+    )
+    run_parser = subparsers.add_parser(
+        "run", help="Run the pipeline on a server (the arguments follow --)."
+    )
+    run_parser.add_argument("pipeline_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        PipelineServer(
+            load_pipeline_factory(args.pipeline), args.socket, args.max_runs
+        ).serve_forever()
+    else:
+        pipeline_args = args.pipeline_args
+        if pipeline_args[:1] == ["--"]:
+            pipeline_args = pipeline_args[1:]
+        sys.exit(request_run(pipeline_args, args.socket))
+
+
+if __name__ == "__main__":
+    main()
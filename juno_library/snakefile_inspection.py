@@ -0,0 +1,108 @@
+"""Helpers to inspect the rules of a Snakefile without running it.
+
+The Snakefile is parsed with the snakemake Workflow class, the same way the
+snakemake API does it, so the rules see the same config as in the real run.
+"""
+
+from __future__ import annotations
+
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional, Sequence
+
+from snakemake.deployment.conda import is_conda_env_file
+from snakemake.io import Wildcards, load_configfile
+from snakemake.utils import update_config
+from snakemake.workflow import Workflow
+
+
+@contextmanager
+def _working_directory(workdir: Optional[str | Path]) -> Iterator[None]:
+    previous_dir = os.getcwd()
+    if workdir is not None:
+        os.chdir(workdir)
+    try:
+        yield
+    finally:
+        os.chdir(previous_dir)
+
+
+def load_workflow(
+    snakefile: str | Path,
+    config: dict[str, Any],
+    configfiles: Sequence[str | Path] = (),
+    workdir: Optional[str | Path] = None,
+    **workflow_args: Any,
+) -> Any:
+    """Parse a Snakefile and return the resulting snakemake Workflow.
+
+    Args:
+        snakefile (str | Path): Path to the Snakefile.
+        config (dict[str, Any]): Config passed to snakemake (takes precedence over the configfiles).
+        configfiles (Sequence[str | Path], optional): Config files passed to snakemake. Defaults to ().
+        workdir (Optional[str | Path], optional): Working directory in which the Snakefile is parsed. Defaults to the current directory.
+        **workflow_args: Extra arguments for the snakemake Workflow (e.g. use_conda, conda_prefix).
+
+    Returns:
+        snakemake.workflow.Workflow: The parsed workflow.
+    """
+    snakefile = os.path.abspath(snakefile)
+    overwrite_config: dict[str, Any] = {}
+    for configfile in configfiles:
+        update_config(overwrite_config, load_configfile(str(configfile)))
+    update_config(overwrite_config, config)
+    with _working_directory(workdir):
+        workflow = Workflow(
+            snakefile=snakefile,
+            overwrite_config=overwrite_config,
+            overwrite_configfiles=[str(f) for f in configfiles],
+            **workflow_args,
+        )
+        workflow.include(snakefile, overwrite_default_target=True)
+    return workflow
+
+
+def get_container_images(workflow: Any) -> list[str]:
+    """Container images (URLs) used by the rules of a workflow, without duplicates."""
+    images = {
+        rule.container_img
+        for rule in workflow.rules
+        if isinstance(rule.container_img, str)
+    }
+    if isinstance(workflow.global_container_img, str):
+        images.add(workflow.global_container_img)
+    return sorted(images)
+
+
+def get_conda_envs(workflow: Any, env_dir: str | Path) -> list[Any]:
+    """Conda environments (snakemake Env objects) used by the rules of a workflow.
+
+    Only environments defined by a file are returned. Named environments and
+    environments that depend on the wildcards (callables or paths with
+    wildcards) can only be known once the DAG is built and are skipped.
+
+    Args:
+        workflow (Any): Workflow as returned by load_workflow.
+        env_dir (str | Path): The conda prefix (the environments are stored there).
+
+    Returns:
+        list[snakemake.deployment.conda.Env]: One Env per rule that uses a conda environment file.
+    """
+    envs = []
+    for rule in workflow.rules:
+        conda_env = rule.conda_env
+        if (
+            not isinstance(conda_env, str)
+            or not is_conda_env_file(conda_env)
+            or "{" in conda_env
+        ):
+            continue
+        env_spec = rule.expand_conda_env(Wildcards())
+        envs.append(env_spec.get_conda_env(workflow, env_dir=str(env_dir)))
+    return envs
+
+
+def get_rules_without_wildcard(workflow: Any, wildcard: str) -> list[str]:
+    """Names of the rules of a workflow whose outputs do not use this wildcard (e.g. sample)."""
+    return [rule.name for rule in workflow.rules if wildcard not in rule.wildcard_names]
@@ -0,0 +1,181 @@
+"""Staging of the input files of a run to a scratch directory.
+
+Without staging, all the jobs read their input from the (absolute) paths in
+the sample_dict, usually on shared storage, so hundreds of concurrent jobs
+read from the same filer. stage_samples copies (or hard links) the input
+files of all the samples to a scratch directory (e.g. a fast node-local or
+burst-buffer filesystem) in parallel and returns a sample_dict that points
+to the staged files. Copies are done in chunks and verified with a checksum.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Mapping, Sequence, Tuple
+from uuid import uuid4
+
+from juno_library.sample_table import SAMPLE_FILE_KEYS, SampleTable
+
+STAGE_MODES = ("copy", "hardlink")
+CHUNK_SIZE = 8 * 1024**2
+
+
+def sha256_of_file(file_path: Path, chunk_size: int = CHUNK_SIZE) -> str:
+    checksum = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def copy_file_verified(
+    source: Path, destination: Path, chunk_size: int = CHUNK_SIZE
+) -> str:
+    """Copy a file in chunks and verify the copy with a checksum.
+
+    The checksum (sha256) of the source is computed while copying and
+    compared with the checksum of the copy, which is read back afterwards.
+    The copy is written to a temporary file that is only moved to the
+    destination once it is verified.
+
+    Raises:
+        OSError: If the checksum of the copy does not match the source.
+
+    Returns:
+        str: The checksum of the file.
+    """
+    tmp_destination = destination.with_name(f"{destination.name}.{uuid4().hex}.tmp")
+    checksum = hashlib.sha256()
+    try:
+        with open(source, "rb") as src, open(tmp_destination, "wb") as dst:
+            while chunk := src.read(chunk_size):
+                checksum.update(chunk)
+                dst.write(chunk)
+        shutil.copystat(source, tmp_destination)
+        if sha256_of_file(tmp_destination, chunk_size) != checksum.hexdigest():
+            raise OSError(f"The copy of {source} to {destination} is corrupted.")
+        os.replace(tmp_destination, destination)
+    finally:
+        tmp_destination.unlink(missing_ok=True)
+    return checksum.hexdigest()
+
+
+def staged_path(source: str | Path, scratch_dir: Path) -> Path:
+    """Location of a staged file in the scratch directory.
+
+    Files are grouped per source directory (named after a hash of it), so
+    files with the same name in different directories do not collide and a
+    file shared by several samples (e.g. a reference) is staged once.
+    """
+    source_dir, file_name = os.path.split(os.path.abspath(source))
+    dir_hash = hashlib.md5(source_dir.encode()).hexdigest()[:12]
+    return scratch_dir.joinpath(dir_hash, file_name)
+
+
+def _is_up_to_date(source: Path, destination: Path) -> bool:
+    """Whether destination is a complete copy (from an earlier launch) of source."""
+    try:
+        source_stat, destination_stat = source.stat(), destination.stat()
+    except FileNotFoundError:
+        return False
+    return source_stat.st_size == destination_stat.st_size and int(
+        source_stat.st_mtime
+    ) == int(destination_stat.st_mtime)
+
+
+def stage_file(
+    source: Path, destination: Path, mode: str = "copy", chunk_size: int = CHUNK_SIZE
+) -> dict[str, Any]:
+    """Stage one file. Returns a report with the status, size and time spent."""
+    start = time.perf_counter()
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    checksum = None
+    if _is_up_to_date(source, destination):
+        status = "cached"
+    elif mode == "hardlink":
+        try:
+            destination.unlink(missing_ok=True)
+            os.link(source, destination)
+            status = "hardlinked"
+        except OSError:
+            # Hard links are not possible across filesystems
+            checksum = copy_file_verified(source, destination, chunk_size)
+            status = "copied"
+    else:
+        checksum = copy_file_verified(source, destination, chunk_size)
+        status = "copied"
+    report: dict[str, Any] = {
+        "destination": str(destination),
+        "status": status,
+        "bytes": destination.stat().st_size,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    if checksum is not None:
+        report["sha256"] = checksum
+    return report
+
+
+def stage_samples(
+    sample_dict: Mapping[str, Mapping[str, Any]],
+    scratch_dir: Path,
+    mode: str = "copy",
+    max_workers: int = 8,
+    chunk_size: int = CHUNK_SIZE,
+    keys: Sequence[str] = SAMPLE_FILE_KEYS,
+) -> Tuple[SampleTable, dict[str, Any]]:
+    """Stage the input files of all the samples to a scratch directory.
+
+    Only the files in keys (by default SAMPLE_FILE_KEYS: reads, assembly,
+    vcf, bam and reference) are staged, other values are kept as they are.
+
+    Args:
+        sample_dict (Mapping[str, Mapping[str, Any]]): The samples and their files.
+        scratch_dir (Path): Directory to stage the files to.
+        mode (str, optional): Either 'copy' or 'hardlink' (which falls back to copying across filesystems). Defaults to "copy".
+        max_workers (int, optional): Number of files staged at the same time. Defaults to 8.
+        chunk_size (int, optional): Size of the chunks in which files are copied. Defaults to CHUNK_SIZE.
+        keys (Sequence[str], optional): The keys of the files to stage. Defaults to SAMPLE_FILE_KEYS.
+
+    Raises:
+        OSError: If a file cannot be staged (e.g. a corrupted copy).
+
+    Returns:
+        Tuple[SampleTable, dict[str, Any]]: The sample_dict with the staged paths and a report per file.
+    """
+    assert mode in STAGE_MODES, f"The stage mode can only be one of {STAGE_MODES}"
+    staged: dict[str, Path] = {}
+    for files in sample_dict.values():
+        for key in keys:
+            if key in files:
+                staged[str(files[key])] = staged_path(files[key], scratch_dir)
+    start = time.perf_counter()
+
+    def stage(source: str) -> Tuple[str, dict[str, Any]]:
+        return source, stage_file(Path(source), staged[source], mode, chunk_size)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        files_report = dict(executor.map(stage, sorted(staged)))
+
+    staged_sample_dict = SampleTable()
+    for sample, files in sample_dict.items():
+        record = staged_sample_dict.setdefault(sample, {})
+        for key, value in files.items():
+            record[key] = str(staged[str(value)]) if key in keys else value
+    report = {
+        "scratch_dir": str(scratch_dir),
+        "mode": mode,
+        "seconds": round(time.perf_counter() - start, 3),
+        "bytes": sum(file_report["bytes"] for file_report in files_report.values()),
+        "files": files_report,
+    }
+    return staged_sample_dict, report
+
+
+def cleanup_scratch(scratch_dir: Path) -> None:
+    """Remove a scratch directory created for a run."""
+    shutil.rmtree(scratch_dir, ignore_errors=True)
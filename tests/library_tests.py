@@ -2,20 +2,104 @@ from __future__ import annotations
 import os
 
 import argparse
+import hashlib
+import json
+import multiprocessing
+import socket
+import sqlite3
 from pathlib import Path
 from sys import path
 import subprocess
+import sys
+import threading
+import time
+import zlib
 import unittest
-from typing import Any
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from typing import Any, Iterator
+from unittest import mock
+
+import yaml
+from snakemake import snakemake
 
 from juno_library import Pipeline
+from juno_library.capacity import format_capacity_report, plan_capacity
+from juno_library.cgmlst import (
+    cached_allele_matrix,
+    discover_cgmlst_results,
+    load_allele_matrix,
+    read_allele_calls,
+)
+from juno_library.cluster_logs import (
+    cluster_log_options,
+    compact_cluster_logs,
+    lookup_cluster_logs,
+    make_rule_log_dirs,
+    read_cluster_log,
+)
+from juno_library.deployment import (
+    container_image_path,
+    precreate_conda_envs,
+    prefetch_container_images,
+)
+from juno_library.fingerprint import launch_fingerprint
+from juno_library.host_resources import (
+    detect_host_resources,
+    get_cgroup_cpu_limit,
+    get_cgroup_memory_limit,
+)
+from juno_library.latency import (
+    latency_wait_from_delays,
+    measure_latency,
+    submit_local,
+)
+from juno_library.orchestrator import (
+    LocalScheduler,
+    PipelineOrchestrator,
+    ResourceBudget,
+    split_budget,
+)
+from juno_library.pipeline_config import PipelineConfig, SharedCaches
+from juno_library.prioritization import (
+    prioritize_samples,
+    priorities_from_metadata,
+    priority_targets,
+)
+from juno_library.reference_cache import ReferenceIndex, prepare_reference
+from juno_library.retries import (
+    count_kills,
+    escalate,
+    escalating_resources,
+    job_kills,
+    lsf_job_status,
+)
+from juno_library.run_registry import RunRegistry
+from juno_library.server import REQUEST_TIMEOUT, PipelineServer, request_run
+from juno_library.sample_table import SampleRecord, SampleTable
+from juno_library.staging import stage_samples
+from juno_library.snakefile_inspection import (
+    get_conda_envs,
+    get_container_images,
+    load_workflow,
+)
 from juno_library.helper_functions import (
     error_formatter,
     message_formatter,
     SnakemakeKwargsAction,
     validate_file_has_min_lines,
+    count_lines,
+    fasta_stats,
     get_commit_git,
     get_repo_url,
+    split_sample_dict,
+    subprocess_timings,
+    walk_dir_resolved,
+    write_yaml_atomic,
+    validate_bam,
+    find_bam_index,
+    BGZF_EOF,
 )
 
 main_script_path = str(Path(__file__).absolute().parent.parent)
@@ -29,6 +113,28 @@ def make_non_empty_file(
         file_.write(content)
 
 
+def bgzf_block(data: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    header = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+    block_size = len(header) + 2 + len(compressed) + 8
+    return (
+        header
+        + (block_size - 1).to_bytes(2, "little")
+        + compressed
+        + zlib.crc32(data).to_bytes(4, "little")
+        + len(data).to_bytes(4, "little")
+    )
+
+
+def make_bam_file(file_path: str | Path, eof: bool = True) -> None:
+    """Minimal BAM file: a header without references, (optionally) followed by the EOF block"""
+    text = b"@HD\tVN:1.6\tSO:coordinate\n"
+    content = b"BAM\x01" + len(text).to_bytes(4, "little") + text + bytes(4)
+    with open(file_path, "wb") as file_:
+        file_.write(bgzf_block(content) + (bgzf_block(b"") if eof else b""))
+
+
 default_args: dict[str, Any] = dict(
     pipeline_name="juno_library",
     pipeline_version="v0.0.0",
@@ -82,6 +188,34 @@ class TestFileJunoHelpers(unittest.TestCase):
         os.system(f"rm -f {empty_file}")
         os.system(f"rm -f {empty_file}.gz")
 
+    def test_count_lines(self) -> None:
+        """Testing that lines are counted as when iterating over the file"""
+        test_file = Path("count_lines.txt")
+        try:
+            for content in [b"a\nb\nc\n", b"a\nb\nc", b"\n\n", b"x", b""]:
+                test_file.write_bytes(content)
+                with open(test_file, "rb") as f:
+                    self.assertEqual(count_lines(test_file), len(list(f)))
+            test_file.write_bytes(b"line\n" * 1000)
+            self.assertTrue(validate_file_has_min_lines(test_file, min_num_lines=1000))
+            self.assertFalse(validate_file_has_min_lines(test_file, min_num_lines=1001))
+        finally:
+            test_file.unlink()
+
+    def test_fasta_stats(self) -> None:
+        fasta_file = Path("stats.fasta")
+        try:
+            fasta_file.write_bytes(b">contig_1 len=6\nACGT\nAC\n>contig_2\r\nAAA\r\n")
+            self.assertEqual(
+                fasta_stats(fasta_file), {"sequences": 2, "total_length": 9}
+            )
+            fasta_file.write_bytes(b">empty\n>contig_2\nACGT")
+            self.assertEqual(
+                fasta_stats(fasta_file), {"sequences": 2, "total_length": 4}
+            )
+        finally:
+            fasta_file.unlink()
+
 
 class TestJunoHelpers(unittest.TestCase):
     """Testing Helper Functions"""
@@ -537,9 +671,8 @@ class TestPipelineStartup(unittest.TestCase):
             **default_args,
             argv=["-i", "fake_dir_wsamples_juno_cgmlst"],
         )
-        with self.assertRaises(NotImplementedError):
-            pipeline.setup()
-            self.assertDictEqual(pipeline.sample_dict, expected_output)
+        pipeline.setup()
+        self.assertDictEqual(pipeline.sample_dict, expected_output)
 
     def test_correctdir_with_input_type_as_tuple(self) -> None:
         """Testing the pipeline startup accepts both types"""
@@ -622,9 +755,7 @@ class TestPipelineStartup(unittest.TestCase):
         input_dir.joinpath("variants").mkdir(exist_ok=True, parents=True)
         input_dir.joinpath("reference").mkdir(exist_ok=True, parents=True)
 
-        make_non_empty_file(
-            input_dir.joinpath("mapped_reads", "duprem", "sample_A.bam")
-        )
+        make_bam_file(input_dir.joinpath("mapped_reads", "duprem", "sample_A.bam"))
         make_non_empty_file(input_dir.joinpath("variants", "sample_A.vcf"))
         make_non_empty_file(input_dir.joinpath("reference", "reference.fasta"))
 
@@ -657,6 +788,27 @@ class TestPipelineStartup(unittest.TestCase):
         pipeline.setup()
         self.assertTrue(pipeline.input_dir_is_juno_variant_typing_output)
 
+    def test_assembly_stats(self) -> None:
+        """Testing that the number of sequences and length of the assemblies
+        are added to the sample sheet if requested"""
+        input_dir = Path("fake_dir_assembly_stats").resolve()
+        input_dir.mkdir(exist_ok=True, parents=True)
+        make_non_empty_file(
+            input_dir.joinpath("sample_A.fasta"), ">c1\nACGT\n>c2\nAC\n"
+        )
+        try:
+            pipeline = Pipeline(
+                **default_args,
+                argv=["-i", str(input_dir)],
+                input_type="fasta",
+                assembly_stats=True,
+            )
+            pipeline.setup()
+            self.assertEqual(pipeline.sample_dict["sample_A"]["assembly_sequences"], 2)
+            self.assertEqual(pipeline.sample_dict["sample_A"]["assembly_length"], 6)
+        finally:
+            os.system(f"rm -rf {input_dir}")
+
     def test_recognize_juno_cgmlst_output(self) -> None:
         """
         Testing that the pipeline recognizes the output of the Juno cgmlst pipeline
@@ -689,9 +841,8 @@ class TestPipelineStartup(unittest.TestCase):
             **default_args,
             argv=["-i", str(input_dir)],
         )
-        with self.assertRaises(NotImplementedError):
-            pipeline.setup()
-            self.assertTrue(pipeline.input_dir_is_juno_cgmlst_output)
+        pipeline.setup()
+        self.assertTrue(pipeline.input_dir_is_juno_cgmlst_output)
 
     def test_files_smaller_than_minlen(self) -> None:
         """Testing the pipeline startup fails if you set a min_num_lines
@@ -812,6 +963,8 @@ class TestRunSnakemake(unittest.TestCase):
             "fake_output_dir",
             "-n",  # dryrun
             "--local",
+            "--prefetch-jobs",
+            "4",
         ]
         fake_run = Pipeline(
             argv=argv,
@@ -823,7 +976,9 @@ class TestRunSnakemake(unittest.TestCase):
             user_parameters_file=Path("user_parameters.yaml"),
         )
         fake_run.snakefile = str(Path("tests/Snakefile").resolve())
-        fake_run.run()
+        with mock.patch.object(Pipeline, "_prefetch_containers") as prefetch:
+            fake_run.run()
+        prefetch.assert_not_called()
         audit_trail_path = Path("fake_output_dir", "audit_trail")
         self.assertIsInstance(fake_run.date_and_time, str)
         self.assertEqual(fake_run.workdir, Path(main_script_path))
@@ -853,6 +1008,8 @@ class TestRunSnakemake(unittest.TestCase):
         )
         pipeline.snakefile = str(Path("tests/Snakefile").resolve())
         pipeline.setup()
+        # Prefetching is opt-in
+        self.assertEqual(pipeline.prefetch_jobs, 0)
 
         pipeline.path_to_audit = Path("fake_output_dir", "audit_trail")
         pipeline._generate_audit_trail()
@@ -926,6 +1083,99 @@ class TestRunSnakemake(unittest.TestCase):
         self.assertTrue(output_dir.joinpath("fake_result.txt").exists())
         self.assertTrue(audit_trail_path.joinpath("snakemake_report.html").exists())
 
+    def test_profile(self) -> None:
+        output_dir = Path("fake_profile_output_dir")
+        pipeline = Pipeline(
+            argv=[
+                "-i",
+                "fake_input",
+                "-o",
+                str(output_dir),
+                "-n",
+                "--local",
+                "--profile",
+                "--profile-memory",
+            ],
+            input_type="fastq",
+            pipeline_name="fake_pipeline",
+            pipeline_version="0.1",
+            sample_sheet=Path("sample_sheet.yaml"),
+            user_parameters_file=Path("user_parameters.yaml"),
+        )
+        pipeline.snakefile = str(Path("tests/Snakefile").resolve())
+        # Left over from an earlier run in the same process
+        subprocess_timings["earlier_run"].append(1.0)
+        pipeline.run()
+        profile_dir = output_dir.joinpath("audit_trail", "profile")
+        try:
+            for phase in ["setup", "run"]:
+                self.assertTrue(profile_dir.joinpath(f"{phase}.prof").is_file())
+                summary = profile_dir.joinpath(f"{phase}_summary.txt").read_text()
+                self.assertIn("cumulative", summary)
+                self.assertIn("Peak traced memory", summary)
+            with open(profile_dir.joinpath("subprocess_timings.yaml")) as f:
+                timings = yaml.safe_load(f)
+            self.assertNotIn("earlier_run", timings)
+        finally:
+            os.system(f"rm -rf {output_dir}")
+
+    def test_run_registry(self) -> None:
+        output_dir = Path("fake_registry_output_dir")
+        registry_path = Path("fake_run_registry.sqlite").resolve()
+        pipeline = Pipeline(
+            argv=[
+                "-i",
+                "fake_input",
+                "-o",
+                str(output_dir),
+                "--local",
+                "--run-registry",
+                str(registry_path),
+            ],
+            input_type="fastq",
+            pipeline_name="fake_pipeline",
+            pipeline_version="0.1",
+            sample_sheet=Path("sample_sheet.yaml"),
+            user_parameters_file=Path("user_parameters.yaml"),
+        )
+        pipeline.snakefile = str(Path("tests/Snakefile").resolve())
+        try:
+            with mock.patch.object(
+                Pipeline, "_make_snakemake_report", return_value=True
+            ):
+                pipeline.run()
+            runs = RunRegistry(registry_path).find_runs(sample="sample11233")
+            self.assertEqual(len(runs), 1)
+            self.assertEqual(runs[0]["run_id"], str(pipeline.unique_id))
+            self.assertEqual(runs[0]["status"], "succeeded")
+            self.assertEqual(runs[0]["output_dir"], str(pipeline.output_dir))
+        finally:
+            os.system(f"rm -rf {output_dir} {registry_path}*")
+
+    def test_plan(self) -> None:
+        output_dir = Path("fake_plan_output_dir")
+        pipeline = Pipeline(
+            argv=["-i", "fake_input", "-o", str(output_dir), "--local", "--plan"],
+            input_type="fastq",
+            pipeline_name="fake_pipeline",
+            pipeline_version="0.1",
+        )
+        pipeline.snakefile = str(Path("tests/Snakefile").resolve())
+        with mock.patch("juno_library.juno_library.snakemake", wraps=snakemake) as run:
+            pipeline.run()
+        self.assertTrue(run.call_args.kwargs["dryrun"])
+        self.assertFalse(output_dir.exists())
+        self.assertFalse(any(f.exists() for f in pipeline._per_run_files))
+        report = pipeline.capacity_report
+        # rule all has no output and is left out
+        self.assertEqual(report["jobs"], 4)
+        self.assertEqual(report["rules"]["first_rule"]["jobs"], 3)
+        # first_rule declares a runtime of 10 minutes, second_rule uses the time limit
+        self.assertEqual(report["cpu_hours"], 1.5)
+        self.assertEqual(report["runtime_not_declared"], ["second_rule"])
+        self.assertEqual(report["max_job_mem_gb"], 4.0)
+        self.assertGreater(report["free_output_bytes"], 0)
+
     @unittest.skipIf(
         not Path("/data/BioGrid/hernanda/").exists(),
         "Skipped if not in RIVM HPC cluster",
@@ -983,5 +1233,1915 @@ class TestKwargsClass(unittest.TestCase):
         self.assertEqual(args.snakemake_args, expected_output, args.snakemake_args)
 
 
+class TestHostResources(unittest.TestCase):
+    """Testing the detection of cores and memory for local runs"""
+
+    def setUp(self) -> None:
+        self.cgroup_root = Path("fake_cgroup").resolve()
+        self.proc_self_cgroup = self.cgroup_root.joinpath("proc_self_cgroup")
+        self.cgroup_root.mkdir(exist_ok=True)
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.cgroup_root}")
+
+    def test_cgroup_v2_limits(self) -> None:
+        make_non_empty_file(self.proc_self_cgroup, "0::/pipeline.slice\n")
+        limits_dir = self.cgroup_root.joinpath("pipeline.slice")
+        limits_dir.mkdir()
+        make_non_empty_file(limits_dir.joinpath("cpu.max"), "250000 100000\n")
+        make_non_empty_file(limits_dir.joinpath("memory.max"), f"{4 * 1024**3}\n")
+        self.assertEqual(
+            get_cgroup_cpu_limit(self.cgroup_root, self.proc_self_cgroup), 2.5
+        )
+        self.assertEqual(
+            get_cgroup_memory_limit(self.cgroup_root, self.proc_self_cgroup),
+            4 * 1024**3,
+        )
+        host = detect_host_resources(self.cgroup_root, self.proc_self_cgroup)
+        self.assertLessEqual(host.cores, 2)
+        self.assertEqual(host.mem_gb, 3)
+        self.assertEqual(host.mem_source, "cgroup_memory_limit")
+
+    def test_cgroup_v1_without_limits(self) -> None:
+        make_non_empty_file(self.proc_self_cgroup, "4:memory:/\n1:cpu,cpuacct:/\n")
+        self.cgroup_root.joinpath("cpu").mkdir()
+        self.cgroup_root.joinpath("memory").mkdir()
+        make_non_empty_file(self.cgroup_root.joinpath("cpu", "cpu.cfs_quota_us"), "-1")
+        make_non_empty_file(
+            self.cgroup_root.joinpath("cpu", "cpu.cfs_period_us"), "100000"
+        )
+        make_non_empty_file(
+            self.cgroup_root.joinpath("memory", "memory.limit_in_bytes"),
+            "9223372036854771712",
+        )
+        self.assertIsNone(get_cgroup_cpu_limit(self.cgroup_root, self.proc_self_cgroup))
+        self.assertIsNone(
+            get_cgroup_memory_limit(self.cgroup_root, self.proc_self_cgroup)
+        )
+        host = detect_host_resources(self.cgroup_root, self.proc_self_cgroup)
+        self.assertEqual(host.cores_source, "cpu_affinity")
+        self.assertEqual(host.mem_source, "physical_memory")
+
+    def test_local_run_is_sized_to_host(self) -> None:
+        pipeline = Pipeline(**default_args, argv=["-i", "fake_input", "--local"])
+        pipeline._parse_args()
+        host = detect_host_resources()
+        self.assertEqual(pipeline.snakemake_args["cores"], host.cores)
+        self.assertEqual(pipeline.snakemake_args["resources"], {"mem_gb": host.mem_gb})
+        self.assertEqual(pipeline.local_resources["mem_gb"], host.mem_gb)
+        # A second run of the same pipeline takes the limits from the host again
+        pipeline._parse_args()
+        self.assertEqual(pipeline.local_resources["cores_source"], host.cores_source)
+        self.assertEqual(pipeline.local_resources["mem_gb_source"], host.mem_source)
+
+    def test_local_resources_can_be_overridden(self) -> None:
+        pipeline = Pipeline(
+            **default_args,
+            argv=[
+                "-i",
+                "fake_input",
+                "--local",
+                "--snakemake-args",
+                "cores=1000",
+                "resources={'mem_gb':2000}",
+            ],
+        )
+        pipeline._parse_args()
+        self.assertEqual(pipeline.snakemake_args["cores"], 1000)
+        self.assertEqual(pipeline.snakemake_args["resources"], {"mem_gb": 2000})
+        self.assertEqual(pipeline.local_resources["cores_source"], "user")
+        self.assertEqual(pipeline.local_resources["mem_gb_source"], "user")
+
+
+class TestContainerPrefetch(unittest.TestCase):
+    """Testing the prefetching of container images before running snakemake"""
+
+    def setUp(self) -> None:
+        self.test_dir = Path("fake_prefetch").resolve()
+        self.test_dir.mkdir(exist_ok=True)
+        # A local image file stands in for the remote registry
+        self.local_image = self.test_dir.joinpath("local_image.sif")
+        make_non_empty_file(self.local_image, "fake image")
+        self.pulled: list[str] = []
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.test_dir}")
+
+    def pull_from_local_image(self, url: str, destination: Path) -> None:
+        self.pulled.append(url)
+        time.sleep(0.05)
+        destination.write_bytes(self.local_image.read_bytes())
+
+    def test_get_container_images_from_snakefile(self) -> None:
+        snakefile = self.test_dir.joinpath("Snakefile")
+        make_non_empty_file(
+            snakefile,
+            'container: "docker://global/image:1"\n\n'
+            "rule a:\n"
+            '    output: config["output_dir"] + "/a.txt"\n'
+            '    container: "docker://rule/image:2"\n'
+            '    shell: "touch {output}"\n',
+        )
+        workflow = load_workflow(snakefile, config={"output_dir": "out"})
+        self.assertEqual(
+            get_container_images(workflow),
+            ["docker://global/image:1", "docker://rule/image:2"],
+        )
+
+    def test_prefetch_pulls_every_image_once(self) -> None:
+        prefix = self.test_dir.joinpath("prefix")
+        images = ["docker://image/a:1", "docker://image/b:1", str(self.local_image)]
+        reports: list[dict[str, Any]] = []
+
+        def prefetch() -> None:
+            reports.append(
+                prefetch_container_images(
+                    images, prefix, pull_image=self.pull_from_local_image
+                )
+            )
+
+        threads = [threading.Thread(target=prefetch) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(
+            sorted(self.pulled), ["docker://image/a:1", "docker://image/b:1"]
+        )
+        for url in ["docker://image/a:1", "docker://image/b:1"]:
+            self.assertTrue(container_image_path(url, prefix).is_file())
+            statuses = sorted(report["images"][url]["status"] for report in reports)
+            self.assertEqual(statuses, ["cached", "pulled"])
+        self.assertNotIn(str(self.local_image), reports[0]["images"])
+        self.assertEqual(list(prefix.glob("*.tmp")), [])
+
+
+class TestCondaEnvPrecreation(unittest.TestCase):
+    """Testing the creation of conda environments before running snakemake"""
+
+    def setUp(self) -> None:
+        self.test_dir = Path("fake_conda_precreation").resolve()
+        self.test_dir.joinpath("envs").mkdir(exist_ok=True, parents=True)
+        env_content = "channels:\n  - conda-forge\ndependencies:\n  - python\n"
+        make_non_empty_file(self.test_dir.joinpath("envs", "a.yaml"), env_content)
+        # Same content as a.yaml, so it should share the environment
+        make_non_empty_file(self.test_dir.joinpath("envs", "b.yaml"), env_content)
+        make_non_empty_file(
+            self.test_dir.joinpath("envs", "c.yaml"), env_content + "  - pip\n"
+        )
+        rules = ""
+        for rule, env in [("x", "a"), ("y", "a"), ("z", "b"), ("w", "c")]:
+            rules += (
+                f"rule {rule}:\n"
+                f'    output: "{rule}.txt"\n'
+                f'    conda: "envs/{env}.yaml"\n'
+                '    shell: "touch {output}"\n\n'
+            )
+        self.snakefile = self.test_dir.joinpath("Snakefile")
+        make_non_empty_file(self.snakefile, rules)
+        self.prefix = self.test_dir.joinpath("conda_prefix")
+        self.created: list[str] = []
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.test_dir}")
+
+    def fake_create_env(self, env: Any) -> None:
+        self.created.append(env.hash)
+        address = Path(env.address)
+        address.mkdir(parents=True)
+        address.joinpath("env_setup_start").touch()
+        address.joinpath("env_setup_done").touch()
+
+    def test_identical_envs_are_created_once(self) -> None:
+        workflow = load_workflow(self.snakefile, config={}, use_conda=True)
+        envs = get_conda_envs(workflow, env_dir=self.prefix)
+        self.assertEqual(len(envs), 4)
+
+        report = precreate_conda_envs(envs, create_env=self.fake_create_env)
+        self.assertEqual(len(self.created), 2)
+        environments = report["environments"]
+        self.assertEqual(
+            sorted(Path(env_file).name for env_file in environments),
+            ["a.yaml", "b.yaml", "c.yaml"],
+        )
+        a_yaml, b_yaml, c_yaml = [environments[k] for k in sorted(environments)]
+        self.assertEqual(a_yaml["hash"], b_yaml["hash"])
+        self.assertNotEqual(a_yaml["hash"], c_yaml["hash"])
+        self.assertEqual(c_yaml["status"], "created")
+
+        report = precreate_conda_envs(envs, create_env=self.fake_create_env)
+        self.assertEqual(len(self.created), 2)
+        self.assertTrue(
+            all(env["status"] == "cached" for env in report["environments"].values())
+        )
+
+
+class TestShardedRun(unittest.TestCase):
+    """Testing the sharded run mode (several snakemake invocations + aggregation)"""
+
+    def setUp(self) -> None:
+        self.test_dir = Path("fake_sharded_run").resolve()
+        self.input_dir = self.test_dir.joinpath("input")
+        self.output_dir = self.test_dir.joinpath("output")
+        self.input_dir.mkdir(parents=True, exist_ok=True)
+        for sample in ["s1", "s2", "s3", "s4", "s5"]:
+            make_non_empty_file(self.input_dir.joinpath(f"{sample}.fasta"), sample)
+        self.snakefile = self.test_dir.joinpath("Snakefile")
+        make_non_empty_file(
+            self.snakefile,
+            "import yaml\n"
+            'with open(config["sample_sheet"]) as f:\n'
+            "    SAMPLES = yaml.safe_load(f)\n"
+            'OUT = config["output_dir"]\n\n'
+            "rule all:\n"
+            '    input: OUT + "/summary.txt"\n\n'
+            "rule per_sample:\n"
+            '    input: lambda wildcards: SAMPLES[wildcards.sample]["assembly"]\n'
+            '    output: OUT + "/per_sample/{sample}.txt"\n'
+            '    shell: "cp {input} {output}"\n\n'
+            "rule summary:\n"
+            '    input: expand(OUT + "/per_sample/{sample}.txt", sample=SAMPLES)\n'
+            '    output: OUT + "/summary.txt"\n'
+            '    shell: "cat {input} > {output}"\n',
+        )
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.test_dir}")
+
+    def test_split_sample_dict(self) -> None:
+        sample_dict = {f"sample{i}": {"assembly": f"{i}.fasta"} for i in range(10)}
+        shards = split_sample_dict(sample_dict, 3)
+        self.assertEqual([len(shard) for shard in shards], [4, 3, 3])
+        merged = {k: v for shard in shards for k, v in shard.items()}
+        self.assertEqual(merged, sample_dict)
+        self.assertEqual(len(split_sample_dict(sample_dict, 20)), 10)
+
+    def test_sharded_run(self) -> None:
+        pipeline = Pipeline(
+            **default_args,
+            argv=[
+                "-i",
+                str(self.input_dir),
+                "-o",
+                str(self.output_dir),
+                "--local",
+                "--shards",
+                "2",
+                "--snakemake-args",
+                "cores=2",
+            ],
+            input_type="fasta",
+            aggregation_rules=["summary"],
+            sample_sheet=self.test_dir.joinpath("sample_sheet.yaml"),
+            user_parameters_file=self.test_dir.joinpath("user_parameters.yaml"),
+            snakefile=str(self.snakefile),
+        )
+        pipeline.run()
+        with open(self.output_dir.joinpath("summary.txt")) as f:
+            self.assertEqual(f.read(), "s1s2s3s4s5")
+        for shard in ["shard_0", "shard_1"]:
+            shard_dir = self.output_dir.joinpath(".shards", shard)
+            self.assertTrue(shard_dir.joinpath("sample_sheet.yaml").is_file())
+            self.assertTrue(shard_dir.joinpath(".snakemake").is_dir())
+
+    def test_shards_fit_in_cores(self) -> None:
+        pipeline = Pipeline(
+            **default_args,
+            argv=[
+                "-i",
+                str(self.input_dir),
+                "-o",
+                str(self.output_dir),
+                "--local",
+                "--shards",
+                "2",
+                "--snakemake-args",
+                "cores=1",
+            ],
+            input_type="fasta",
+            aggregation_rules=["summary"],
+            sample_sheet=self.test_dir.joinpath("sample_sheet.yaml"),
+            user_parameters_file=self.test_dir.joinpath("user_parameters.yaml"),
+            snakefile=str(self.snakefile),
+        )
+        pipeline.run()
+        with open(self.output_dir.joinpath("summary.txt")) as f:
+            self.assertEqual(f.read(), "s1s2s3s4s5")
+        self.assertEqual(
+            sorted(p.name for p in self.output_dir.joinpath(".shards").iterdir()),
+            ["shard_0"],
+        )
+
+    def test_shards_need_aggregation_rules(self) -> None:
+        pipeline = Pipeline(
+            **default_args,
+            argv=["-i", str(self.input_dir), "--local", "--shards", "2"],
+            input_type="fasta",
+        )
+        with self.assertRaisesRegex(AssertionError, "aggregation_rules"):
+            pipeline.setup()
+
+
+class TestInputStaging(unittest.TestCase):
+    """Testing the staging of the input files to a scratch directory"""
+
+    def setUp(self) -> None:
+        self.test_dir = Path("fake_staging").resolve()
+        self.input_dir = self.test_dir.joinpath("input")
+        self.scratch_dir = self.test_dir.joinpath("scratch")
+        self.input_dir.joinpath("reference").mkdir(parents=True, exist_ok=True)
+        for sample in ["s1", "s2"]:
+            make_non_empty_file(self.input_dir.joinpath(f"{sample}.vcf"), sample)
+        make_non_empty_file(self.input_dir.joinpath("reference", "reference.fasta"))
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.test_dir}")
+
+    def sample_dict(self) -> dict[str, dict[str, str]]:
+        reference = str(self.input_dir.joinpath("reference", "reference.fasta"))
+        return {
+            sample: {
+                "vcf": str(self.input_dir.joinpath(f"{sample}.vcf")),
+                "reference": reference,
+                "genus": "salmonella",
+            }
+            for sample in ["s1", "s2"]
+        }
+
+    def test_stage_samples(self) -> None:
+        staged, report = stage_samples(
+            self.sample_dict(), self.scratch_dir, max_workers=2, chunk_size=2
+        )
+        self.assertEqual(Path(staged["s1"]["vcf"]).read_text(), "s1")
+        self.assertTrue(staged["s1"]["vcf"].startswith(str(self.scratch_dir)))
+        self.assertEqual(staged["s1"]["reference"], staged["s2"]["reference"])
+        self.assertEqual(staged["s1"]["genus"], "salmonella")
+        self.assertEqual(len(report["files"]), 3)
+        vcf_report = report["files"][self.sample_dict()["s1"]["vcf"]]
+        self.assertEqual(vcf_report["status"], "copied")
+        self.assertEqual(vcf_report["sha256"], hashlib.sha256(b"s1").hexdigest())
+        _, report = stage_samples(self.sample_dict(), self.scratch_dir)
+        self.assertEqual(
+            {file_report["status"] for file_report in report["files"].values()},
+            {"cached"},
+        )
+
+    def test_corrupted_copy_is_not_staged(self) -> None:
+        with mock.patch(
+            "juno_library.staging.sha256_of_file", return_value="corrupted"
+        ):
+            with self.assertRaises(OSError):
+                stage_samples(self.sample_dict(), self.scratch_dir)
+        staged_files = [p for p in self.scratch_dir.rglob("*") if p.is_file()]
+        self.assertEqual(staged_files, [])
+
+    def test_pipeline_reads_from_scratch(self) -> None:
+        output_dir = self.test_dir.joinpath("output")
+        snakefile = self.test_dir.joinpath("Snakefile")
+        make_non_empty_file(
+            snakefile,
+            "import yaml\n"
+            'with open(config["sample_sheet"]) as f:\n'
+            "    SAMPLES = yaml.safe_load(f)\n"
+            'OUT = config["output_dir"]\n\n'
+            "rule all:\n"
+            '    input: expand(OUT + "/{sample}.txt", sample=SAMPLES)\n\n'
+            "rule per_sample:\n"
+            '    input: lambda wildcards: SAMPLES[wildcards.sample]["vcf"]\n'
+            '    output: OUT + "/{sample}.txt"\n'
+            '    shell: "echo {input} > {output}"\n',
+        )
+        pipeline = Pipeline(
+            **default_args,
+            argv=[
+                "-i",
+                str(self.input_dir),
+                "-o",
+                str(output_dir),
+                "--local",
+                "--scratch-dir",
+                str(self.scratch_dir),
+            ],
+            input_type="vcf",
+            sample_sheet=self.test_dir.joinpath("sample_sheet.yaml"),
+            user_parameters_file=self.test_dir.joinpath("user_parameters.yaml"),
+            snakefile=str(snakefile),
+        )
+        pipeline.run()
+        assert pipeline.scratch_dir is not None
+        self.assertIn(
+            f"--bind {pipeline.scratch_dir}:{pipeline.scratch_dir}",
+            pipeline.snakemake_args["singularity_args"],
+        )
+        used_input = output_dir.joinpath("s1.txt").read_text().strip()
+        self.assertTrue(used_input.startswith(str(pipeline.scratch_dir)))
+        self.assertFalse(pipeline.scratch_dir.exists())
+        self.assertTrue(
+            output_dir.joinpath("audit_trail", "log_staging.yaml").is_file()
+        )
+        with open(output_dir.joinpath("audit_trail", "sample_sheet.yaml")) as f:
+            self.assertEqual(yaml.safe_load(f), pipeline.sample_dict)
+
+
+class TestFastRelaunch(unittest.TestCase):
+    """Testing that a relaunch reuses the setup of the previous launch"""
+
+    def setUp(self) -> None:
+        self.test_dir = Path("fake_relaunch").resolve()
+        self.input_dir = self.test_dir.joinpath("input")
+        self.output_dir = self.test_dir.joinpath("output")
+        self.input_dir.mkdir(parents=True, exist_ok=True)
+        for sample in ["s1", "s2"]:
+            make_non_empty_file(self.input_dir.joinpath(f"{sample}.fasta"), sample)
+        self.snakefile = self.test_dir.joinpath("Snakefile")
+        make_non_empty_file(
+            self.snakefile,
+            "import yaml\n"
+            'with open(config["sample_sheet"]) as f:\n'
+            "    SAMPLES = yaml.safe_load(f)\n"
+            'OUT = config["output_dir"]\n\n'
+            "rule all:\n"
+            '    input: expand(OUT + "/{sample}.txt", sample=SAMPLES)\n\n'
+            "rule per_sample:\n"
+            '    input: lambda wildcards: SAMPLES[wildcards.sample]["assembly"]\n'
+            '    output: OUT + "/{sample}.txt"\n'
+            '    shell: "cp {input} {output}"\n',
+        )
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.test_dir}")
+
+    def launch(self, *extra_argv: str) -> Pipeline:
+        pipeline = Pipeline(
+            **default_args,
+            argv=["-i", str(self.input_dir), "-o", str(self.output_dir), "--local"]
+            + list(extra_argv),
+            input_type="fasta",
+            sample_sheet=self.test_dir.joinpath("sample_sheet.yaml"),
+            user_parameters_file=self.test_dir.joinpath("user_parameters.yaml"),
+            snakefile=str(self.snakefile),
+        )
+        pipeline.run()
+        return pipeline
+
+    def test_relaunch_reuses_setup(self) -> None:
+        first_launch = self.launch()
+        self.assertFalse(first_launch.fast_relaunch)
+        self.assertTrue(
+            self.output_dir.joinpath("audit_trail", "launch_fingerprint.yaml").is_file()
+        )
+        with mock.patch.object(Pipeline, "_generate_audit_trail") as audit_trail:
+            relaunch = self.launch()
+        self.assertTrue(relaunch.fast_relaunch)
+        audit_trail.assert_not_called()
+        self.assertEqual(relaunch.sample_dict, first_launch.sample_dict)
+        # Only the samples are reused, the rest of the setup is done again
+        self.assertEqual(relaunch.input_type, ("fasta",))
+        self.assertFalse(relaunch.input_dir_is_juno_assembly_output)
+        self.assertFalse(relaunch.input_dir_is_juno_cgmlst_output)
+        self.assertEqual(
+            relaunch.snakemake_config["sample_sheet"],
+            str(self.output_dir.joinpath("audit_trail", "sample_sheet.yaml")),
+        )
+
+    def test_changes_trigger_rescan(self) -> None:
+        self.launch()
+        self.assertFalse(self.launch("--force-rescan").fast_relaunch)
+        make_non_empty_file(self.input_dir.joinpath("s3.fasta"), "s3")
+        relaunch = self.launch()
+        self.assertFalse(relaunch.fast_relaunch)
+        self.assertIn("s3", relaunch.sample_dict)
+        self.assertTrue(self.output_dir.joinpath("s3.txt").is_file())
+
+
+class TestLatencyProbe(unittest.TestCase):
+    """Testing the measurement of the filesystem latency (with the local stand-in)"""
+
+    def setUp(self) -> None:
+        self.probe_dir = Path("fake_latency_probe").resolve()
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.probe_dir}")
+
+    def test_latency_wait_from_delays(self) -> None:
+        self.assertEqual(latency_wait_from_delays([0.1, 0.5]), 5)
+        self.assertEqual(latency_wait_from_delays([0.5, 20.2]), 61)
+        self.assertEqual(latency_wait_from_delays([90.0]), 270)
+        self.assertEqual(latency_wait_from_delays([500.0]), 300)
+        self.assertEqual(latency_wait_from_delays([], default=42), 42)
+
+    def test_local_probe(self) -> None:
+        delays = measure_latency(
+            self.probe_dir, submit_local, n_probes=3, interval=0.05, timeout=30
+        )
+        self.assertEqual(len(delays), 3)
+        self.assertLess(max(delays), 5)
+
+    def test_slow_filesystem(self) -> None:
+        def submit_delayed(command: list[str], probe_dir: Path) -> None:
+            # Files that were written 20 seconds ago by the probe job
+            # according to its clock (i.e. they took 20 seconds to appear)
+            def write_late() -> None:
+                time.sleep(0.2)
+                tmp_file = probe_dir.joinpath(".probe_0.tmp")
+                make_non_empty_file(tmp_file, str(time.time() - 20))
+                tmp_file.rename(probe_dir.joinpath("probe_0"))
+
+            threading.Thread(target=write_late).start()
+
+        delays = measure_latency(self.probe_dir, submit_delayed, n_probes=1, timeout=30)
+        self.assertEqual(len(delays), 1)
+        self.assertGreaterEqual(latency_wait_from_delays(delays), 60)
+        self.assertLessEqual(latency_wait_from_delays(delays), 63)
+
+    def test_missing_probe_files(self) -> None:
+        cancel = mock.Mock()
+        delays = measure_latency(
+            self.probe_dir, lambda command, probe_dir: cancel, n_probes=2, timeout=0.3
+        )
+        self.assertEqual(delays, [])
+        # The probe job that did not write its files in time is cancelled
+        cancel.assert_called_once_with()
+
+
+class FakeOrchestratedPipeline(Pipeline):
+    """Pipeline that only records the budget it got instead of running snakemake"""
+
+    lock = threading.Lock()
+    cores_in_use = 0
+    max_cores_in_use = 0
+    seen_budgets: list[tuple[str, int, int]] = []
+
+    def run(self) -> None:
+        self._parse_args()
+        cls = FakeOrchestratedPipeline
+        cores = self.snakemake_args["cores"]
+        with cls.lock:
+            cls.cores_in_use += cores
+            cls.max_cores_in_use = max(cls.max_cores_in_use, cls.cores_in_use)
+            cls.seen_budgets.append(
+                (self.input_dir.name, cores, self.snakemake_args["nodes"])
+            )
+        time.sleep(0.05)
+        with cls.lock:
+            cls.cores_in_use -= cores
+        if self.input_dir.name == "failing_run":
+            raise ValueError("This run fails")
+
+
+class TestPipelineOrchestrator(unittest.TestCase):
+    """Testing the orchestrator that runs multiple pipelines with a shared budget"""
+
+    def setUp(self) -> None:
+        FakeOrchestratedPipeline.cores_in_use = 0
+        FakeOrchestratedPipeline.max_cores_in_use = 0
+        FakeOrchestratedPipeline.seen_budgets = []
+
+    def test_split_budget(self) -> None:
+        self.assertEqual(split_budget(10, [1, 1]), [5, 5])
+        self.assertEqual(split_budget(10, [3, 1]), [7, 3])
+        self.assertEqual(sum(split_budget(301, [1, 1, 1])), 301)
+        self.assertEqual(split_budget(3, [100, 1, 1]), [1, 1, 1])
+
+    def test_fair_share_does_not_exceed_budget(self) -> None:
+        orchestrator = PipelineOrchestrator(
+            pipeline_factory=partial(FakeOrchestratedPipeline, **default_args),
+            budget=ResourceBudget(cores=12, nodes=6),
+            max_parallel=3,
+            scheduler=LocalScheduler(max_workers=3),
+        )
+        for i in range(7):
+            orchestrator.add(Path(f"run_{i}"), Path(f"output_{i}"))
+        results = orchestrator.run()
+        self.assertEqual(len(results), 7)
+        self.assertTrue(all(result.successful for result in results))
+        self.assertLessEqual(FakeOrchestratedPipeline.max_cores_in_use, 12)
+        first_budgets = FakeOrchestratedPipeline.seen_budgets[:3]
+        self.assertEqual([b[1:] for b in first_budgets], [(4, 2)] * 3)
+
+    def test_priority_weighting(self) -> None:
+        orchestrator = PipelineOrchestrator(
+            pipeline_factory=partial(FakeOrchestratedPipeline, **default_args),
+            budget=ResourceBudget(cores=10, nodes=10),
+            max_parallel=2,
+            weighting="priority",
+            scheduler=LocalScheduler(max_workers=2),
+        )
+        orchestrator.add(Path("bulk"), Path("output_bulk"), priority=1)
+        orchestrator.add(Path("outbreak"), Path("output_outbreak"), priority=4)
+        orchestrator.add(Path("failing_run"), Path("output_failing"), priority=0.5)
+        results = orchestrator.run()
+        budgets = {
+            name: cores for name, cores, _ in FakeOrchestratedPipeline.seen_budgets
+        }
+        self.assertGreater(budgets["outbreak"], budgets["bulk"])
+        self.assertLessEqual(FakeOrchestratedPipeline.max_cores_in_use, 10)
+        failed = [r for r in results if not r.successful]
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0].request.input_dir, Path("failing_run"))
+        for priority in [0, -1]:
+            with self.assertRaisesRegex(ValueError, "larger than 0"):
+                orchestrator.add(Path("bulk"), Path("output_bulk"), priority=priority)
+
+
+class StatCounter:
+    """Count the stat calls made through os.stat, os.lstat and os.scandir entries"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self._scandir = os.scandir
+
+    def stat(self, stat: Any) -> Any:
+        def counted(*args: Any, **kwargs: Any) -> Any:
+            self.calls += 1
+            return stat(*args, **kwargs)
+
+        return counted
+
+    def scandir(self, *args: Any) -> Any:
+        counter = self
+
+        class Entry:
+            def __init__(self, entry: os.DirEntry[str]) -> None:
+                self.entry = entry
+                self.stat = counter.stat(entry.stat)
+
+            def __getattr__(self, name: str) -> Any:
+                return getattr(self.entry, name)
+
+            def __fspath__(self) -> str:
+                return self.entry.path
+
+        class Entries:
+            def __init__(self) -> None:
+                self.entries = counter._scandir(*args)
+
+            def __enter__(self) -> Entries:
+                return self
+
+            def __exit__(self, *exc: Any) -> None:
+                self.entries.close()
+
+            def __iter__(self) -> Iterator[Entry]:
+                return (Entry(entry) for entry in self.entries)
+
+        return Entries()
+
+    @contextmanager
+    def patched(self) -> Iterator[StatCounter]:
+        with mock.patch("os.stat", self.stat(os.stat)), mock.patch(
+            "os.lstat", self.stat(os.lstat)
+        ), mock.patch("os.scandir", self.scandir):
+            yield self
+
+
+class TestDiscoverySyscalls(unittest.TestCase):
+    """Testing that enlisting the samples does not resolve every file path"""
+
+    def setUp(self) -> None:
+        self.input_dir = Path("fake_dir_discovery").resolve()
+        self.target_dir = Path("fake_dir_discovery_target").resolve()
+        self.input_dir.joinpath("reference").mkdir(parents=True, exist_ok=True)
+        self.target_dir.mkdir(exist_ok=True)
+        make_non_empty_file(self.input_dir.joinpath("reference", "reference.fasta"))
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.input_dir} {self.target_dir}")
+
+    def add_samples(self, n_samples: int) -> None:
+        for i in range(n_samples):
+            for file_name in [f"s{i}_R1.fastq", f"s{i}_R2.fastq", f"s{i}.vcf"]:
+                make_non_empty_file(self.input_dir.joinpath(file_name))
+
+    def count_stat_calls(self) -> tuple[int, Pipeline]:
+        pipeline = Pipeline(
+            **default_args,
+            argv=["-i", str(self.input_dir)],
+            input_type="fastq_and_vcf",
+        )
+        with StatCounter().patched() as stats:
+            pipeline.setup()
+        return stats.calls, pipeline
+
+    def test_stat_calls_do_not_grow_with_samples(self) -> None:
+        self.add_samples(2)
+        calls_few_samples, _ = self.count_stat_calls()
+        self.add_samples(40)
+        calls_many_samples, pipeline = self.count_stat_calls()
+        self.assertEqual(len(pipeline.sample_dict), 40)
+        # Only the validation of the files found adds a stat per file
+        self.assertEqual(calls_many_samples - calls_few_samples, 3 * 38)
+
+    def test_fingerprint_stats_only_directories(self) -> None:
+        self.add_samples(40)
+        with StatCounter().patched() as stats:
+            launch_fingerprint(self.input_dir, argv=[], user_parameters={})
+        self.assertEqual(stats.calls, 1)
+
+    def test_symlinks_are_resolved(self) -> None:
+        self.add_samples(1)
+        os.remove(self.input_dir.joinpath("s0_R1.fastq"))
+        make_non_empty_file(self.target_dir.joinpath("reads.fastq"))
+        self.input_dir.joinpath("s0_R1.fastq").symlink_to(
+            self.target_dir.joinpath("reads.fastq")
+        )
+        _, pipeline = self.count_stat_calls()
+        self.assertEqual(
+            pipeline.sample_dict["s0"]["R1"],
+            str(self.target_dir.joinpath("reads.fastq")),
+        )
+        self.assertEqual(
+            pipeline.sample_dict["s0"]["reference"],
+            str(self.input_dir.joinpath("reference", "reference.fasta")),
+        )
+
+
+class TestSampleTable(unittest.TestCase):
+    """Testing the compact representation of the sample_dict"""
+
+    sample_dict = {
+        "sample1": {
+            "R1": "/data/run1/sample1_R1.fastq.gz",
+            "R2": "/data/run1/sample1_R2.fastq.gz",
+            "genus": "salmonella",
+        },
+        "sample2": {"assembly": "/data/run1/assemblies/sample2.fasta"},
+    }
+
+    def test_behaves_as_sample_dict(self) -> None:
+        table = SampleTable(self.sample_dict)
+        self.assertDictEqual(table, self.sample_dict)
+        self.assertIsInstance(table["sample1"], SampleRecord)
+        self.assertEqual(list(table["sample1"]), ["R1", "R2", "genus"])
+        self.assertNotIn("assembly", table["sample1"])
+        with self.assertRaises(KeyError):
+            table["sample2"]["R1"]
+        sample = table.setdefault("sample3", {})
+        sample["vcf"] = "/data/run1/sample3.vcf"
+        self.assertEqual(table["sample3"].to_dict(), {"vcf": "/data/run1/sample3.vcf"})
+        del table["sample1"]["genus"]
+        self.assertEqual(len(table["sample1"]), 2)
+
+    def test_records_are_dicts(self) -> None:
+        table = SampleTable(self.sample_dict)
+        self.assertIsInstance(table["sample1"], dict)
+        self.assertFalse(hasattr(table["sample1"], "__dict__"))
+        self.assertEqual(json.loads(json.dumps(table)), self.sample_dict)
+
+    def test_none_is_kept(self) -> None:
+        table = SampleTable({"sample1": {"R1": "/data/run1/sample1_R1.fastq.gz"}})
+        table["sample1"]["R2"] = None
+        table["sample1"].setdefault("assembly")
+        self.assertIsNone(table["sample1"]["R2"])
+        self.assertIsNone(table["sample1"]["assembly"])
+        self.assertEqual(yaml.safe_load(yaml.safe_dump(table))["sample1"]["R2"], None)
+
+    def test_insertion_order_is_kept(self) -> None:
+        record = SampleRecord({"genus": "salmonella", "R2": "/data/r2.fastq"})
+        record["R1"] = "/data/r1.fastq"
+        self.assertEqual(list(record), ["genus", "R2", "R1"])
+        self.assertEqual(list(json.loads(json.dumps(record))), ["genus", "R2", "R1"])
+
+    def test_yaml_dump_is_unchanged(self) -> None:
+        table = SampleTable(self.sample_dict)
+        self.assertEqual(yaml.dump(table), yaml.dump(self.sample_dict))
+        self.assertEqual(yaml.safe_load(yaml.safe_dump(table)), self.sample_dict)
+
+
+class TestClusterLogs(unittest.TestCase):
+    """Testing the per rule layout and the compaction of the cluster logs"""
+
+    def setUp(self) -> None:
+        self.log_dir = Path("fake_log").resolve()
+        self.cluster_log_dir = self.log_dir.joinpath("cluster")
+        self.index_db = self.log_dir.joinpath("cluster_logs.sqlite")
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.log_dir}")
+
+    def write_logs(self, jobids: range) -> None:
+        make_rule_log_dirs(self.cluster_log_dir, ["fastqc", "trim_reads"])
+        for jobid in jobids:
+            rule = "fastqc" if jobid % 2 else "trim_reads"
+            log_file = self.cluster_log_dir.joinpath(
+                rule, f"{rule}_sample=s{jobid}_{jobid}"
+            )
+            make_non_empty_file(log_file.with_suffix(".out"), f"out of job {jobid}")
+            make_non_empty_file(log_file.with_suffix(".err"), f"err of job {jobid}")
+
+    def test_cluster_log_options(self) -> None:
+        self.assertEqual(
+            cluster_log_options(Path("/out/log/cluster")),
+            "-o /out/log/cluster/{name}/{name}_{wildcards}_{jobid}.out "
+            "-e /out/log/cluster/{name}/{name}_{wildcards}_{jobid}.err",
+        )
+
+    def test_compact_and_lookup(self) -> None:
+        self.write_logs(range(1, 21))
+        archive = self.log_dir.joinpath("cluster_run1.tar")
+        report = compact_cluster_logs(self.cluster_log_dir, archive, self.index_db)
+        self.assertEqual(report["files"], 40)
+        self.assertTrue(archive.exists())
+        self.assertEqual(list(self.cluster_log_dir.iterdir()), [])
+
+        logs = lookup_cluster_logs(self.index_db, jobid=7)
+        self.assertEqual([log["stream"] for log in logs], ["err", "out"])
+        self.assertEqual(logs[0]["rule"], "fastqc")
+        self.assertEqual(
+            read_cluster_log(logs[1]["archive"], logs[1]["offset"], logs[1]["size"]),
+            b"out of job 7",
+        )
+        self.assertEqual(len(lookup_cluster_logs(self.index_db, rule="trim_reads")), 20)
+        self.assertEqual(
+            len(lookup_cluster_logs(self.index_db, member_like="%sample=s12_%")), 2
+        )
+
+    def test_index_is_shared_between_runs(self) -> None:
+        self.write_logs(range(1, 3))
+        compact_cluster_logs(
+            self.cluster_log_dir,
+            self.log_dir.joinpath("cluster_run1.tar"),
+            self.index_db,
+        )
+        self.write_logs(range(1, 3))
+        compact_cluster_logs(
+            self.cluster_log_dir,
+            self.log_dir.joinpath("cluster_run2.tar"),
+            self.index_db,
+        )
+        logs = lookup_cluster_logs(self.index_db, jobid=1)
+        self.assertEqual(len(logs), 4)
+        self.assertEqual(
+            {Path(log["archive"]).name for log in logs},
+            {"cluster_run1.tar", "cluster_run2.tar"},
+        )
+
+    def test_nothing_to_compact(self) -> None:
+        report = compact_cluster_logs(
+            self.cluster_log_dir, self.log_dir.joinpath("cluster.tar"), self.index_db
+        )
+        self.assertEqual(report["files"], 0)
+        self.assertFalse(self.log_dir.joinpath("cluster.tar").exists())
+
+
+class TestRunRegistry(unittest.TestCase):
+    """Testing the local registry of pipeline runs"""
+
+    def setUp(self) -> None:
+        self.registry_path = Path("fake_registry", "run_registry.sqlite").resolve()
+        self.registry = RunRegistry(self.registry_path)
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.registry_path.parent}")
+
+    def register(self, run_id: str, pipeline_name: str, samples: list[str]) -> None:
+        self.registry.register_run(
+            run_id, pipeline_name, "1.0", "/in", f"/out/{run_id}", samples
+        )
+
+    def test_lookup(self) -> None:
+        self.register("run1", "juno-assembly", ["s1", "s2"])
+        self.register("run2", "juno-typing", ["s2", "s3"])
+        self.registry.record_status("run1", "succeeded")
+        self.assertEqual(
+            [run["run_id"] for run in self.registry.find_runs(sample="s2")],
+            ["run2", "run1"],
+        )
+        runs = self.registry.find_runs(pipeline_name="juno-assembly")
+        self.assertEqual([run["status"] for run in runs], ["succeeded"])
+        self.assertEqual(self.registry.run_samples("run2"), ["s2", "s3"])
+        self.assertEqual(self.registry.find_runs(sample="s4"), [])
+
+    def test_lookup_by_date(self) -> None:
+        self.register("run1", "juno-assembly", ["s1"])
+        today = datetime.now().strftime("%Y-%m-%d")
+        self.assertEqual(len(self.registry.find_runs(since=today, until=today)), 1)
+        self.assertEqual(self.registry.find_runs(until="2000-01-01"), [])
+
+    def test_append_only(self) -> None:
+        self.register("run1", "juno-assembly", ["s1"])
+        connection = sqlite3.connect(self.registry_path)
+        try:
+            with self.assertRaises(sqlite3.DatabaseError):
+                connection.execute("UPDATE runs SET output_dir = '/elsewhere'")
+            with self.assertRaises(sqlite3.DatabaseError):
+                connection.execute("DELETE FROM run_status")
+        finally:
+            connection.close()
+        self.registry.record_status("run1", "failed")
+        self.registry.record_status("run1", "succeeded")
+        self.assertEqual(self.registry.find_runs()[0]["status"], "succeeded")
+
+    def test_registry_is_opt_in(self) -> None:
+        def registry(*extra_argv: str) -> Path | None:
+            pipeline = Pipeline(**default_args, argv=["-i", "fake_input", *extra_argv])
+            pipeline._parse_args()
+            return pipeline.run_registry
+
+        with mock.patch.dict(os.environ):
+            os.environ.pop("JUNO_RUN_REGISTRY", None)
+            self.assertIsNone(registry())
+            self.assertEqual(
+                registry("--run-registry", str(self.registry_path)),
+                self.registry_path,
+            )
+            os.environ["JUNO_RUN_REGISTRY"] = str(self.registry_path)
+            self.assertEqual(registry(), self.registry_path)
+            self.assertIsNone(registry("--no-run-registry"))
+
+
+class TestPerRunConfigFiles(unittest.TestCase):
+    """Testing that runs started from the same directory do not share config files"""
+
+    def setUp(self) -> None:
+        self.input_dir = Path("fake_per_run_input").resolve()
+        self.input_dir.mkdir()
+        make_non_empty_file(self.input_dir.joinpath("sample1_R1.fastq"))
+        make_non_empty_file(self.input_dir.joinpath("sample1_R2.fastq"))
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.input_dir}")
+
+    def make_pipeline(self) -> Pipeline:
+        pipeline = Pipeline(
+            argv=[
+                "-i",
+                str(self.input_dir),
+                "-o",
+                "fake_per_run_output",
+                "-n",
+                "--local",
+            ],
+            input_type="fastq",
+            pipeline_name="fake_pipeline",
+            pipeline_version="0.1",
+        )
+        pipeline.snakefile = str(Path("tests/Snakefile").resolve())
+        return pipeline
+
+    def test_unique_paths(self) -> None:
+        first, second = self.make_pipeline(), self.make_pipeline()
+        self.assertNotEqual(first.unique_id, second.unique_id)
+        self.assertNotEqual(first.sample_sheet, second.sample_sheet)
+        self.assertNotEqual(first.user_parameters_file, second.user_parameters_file)
+        self.assertEqual(
+            first.sample_sheet,
+            Path(f"config/sample_sheet_{first.unique_id}.yaml").resolve(),
+        )
+        self.assertEqual(
+            first.snakemake_config["sample_sheet"], str(first.sample_sheet)
+        )
+
+    def test_explicit_paths_are_kept(self) -> None:
+        pipeline = Pipeline(
+            pipeline_name="fake_pipeline",
+            pipeline_version="0.1",
+            sample_sheet=Path("sample_sheet.yaml"),
+        )
+        self.assertEqual(pipeline.sample_sheet, Path("sample_sheet.yaml"))
+
+    def test_per_run_files_are_removed(self) -> None:
+        pipeline = self.make_pipeline()
+        with mock.patch(
+            "juno_library.juno_library.snakemake", return_value=True
+        ) as snakemake:
+            pipeline.run()
+        # The sample sheet of the run existed while snakemake ran
+        self.assertEqual(
+            snakemake.call_args.kwargs["config"]["sample_sheet"],
+            str(pipeline.sample_sheet),
+        )
+        self.assertFalse(pipeline.sample_sheet.exists())
+        self.assertFalse(pipeline.user_parameters_file.exists())
+
+    def test_write_yaml_atomic(self) -> None:
+        yaml_file = self.input_dir.joinpath("config", "content.yaml")
+        # The directory is created if needed
+        write_yaml_atomic({"sample1": {"R1": "r1.fastq"}}, yaml_file)
+        with open(yaml_file) as f:
+            self.assertEqual(yaml.safe_load(f), {"sample1": {"R1": "r1.fastq"}})
+        self.assertEqual(list(yaml_file.parent.iterdir()), [yaml_file])
+
+
+class TestReferenceCache(unittest.TestCase):
+    """Testing the shared cache of references and their indexes"""
+
+    # Stand-in for an indexer (e.g. samtools faidx) that is always available
+    fake_index = ReferenceIndex(
+        [sys.executable, "-c", "import sys; open(sys.argv[1], 'w').write('index')"]
+        + ["{reference}.fake"],
+        ["{reference}.fake"],
+        "{reference}.fake",
+    )
+
+    def setUp(self) -> None:
+        self.test_dir = Path("fake_reference_cache_test").resolve()
+        self.cache_dir = self.test_dir.joinpath("cache")
+        self.input_dir = self.test_dir.joinpath("input")
+        for subdir in ["mapped_reads/duprem", "variants", "reference"]:
+            self.input_dir.joinpath(subdir).mkdir(parents=True)
+        self.reference = self.input_dir.joinpath("reference", "reference.fasta")
+        make_non_empty_file(self.reference, ">chr1\nACGT\n")
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.test_dir}")
+
+    def test_build_then_reuse(self) -> None:
+        indexes = {"fake": self.fake_index}
+        first = prepare_reference(self.reference, self.cache_dir, indexes)
+        self.assertEqual(first["report"]["fake"]["status"], "built")
+        self.assertTrue(Path(first["indexes"]["fake"]).is_file())
+        self.assertEqual(Path(first["reference"]).parent.name, first["sha256"])
+        second = prepare_reference(self.reference, self.cache_dir, indexes)
+        self.assertEqual(second["report"]["fake"]["status"], "cached")
+        self.assertEqual(second["indexes"], first["indexes"])
+
+    def test_content_addressed(self) -> None:
+        indexes = {"fake": self.fake_index}
+        # Same content elsewhere: same entry
+        copy = self.test_dir.joinpath("reference.fasta")
+        make_non_empty_file(copy, ">chr1\nACGT\n")
+        first = prepare_reference(self.reference, self.cache_dir, indexes)
+        self.assertEqual(
+            prepare_reference(copy, self.cache_dir, indexes)["reference"],
+            first["reference"],
+        )
+        # Changed content: new entry
+        make_non_empty_file(self.reference, ">chr1\nACGTT\n")
+        self.assertNotEqual(
+            prepare_reference(self.reference, self.cache_dir, indexes)["reference"],
+            first["reference"],
+        )
+
+    def test_dry_run_builds_nothing(self) -> None:
+        result = prepare_reference(
+            self.reference, self.cache_dir, {"fake": self.fake_index}, build=False
+        )
+        self.assertFalse(self.cache_dir.exists())
+        self.assertFalse(result["cached"])
+        self.assertEqual(result["indexes"]["fake"], result["reference"] + ".fake")
+        prepare_reference(self.reference, self.cache_dir, {"fake": self.fake_index})
+        result = prepare_reference(
+            self.reference, self.cache_dir, {"fake": self.fake_index}, build=False
+        )
+        self.assertTrue(result["cached"])
+
+    def test_failing_index_is_not_cached(self) -> None:
+        failing = ReferenceIndex([sys.executable, "-c", "pass"], ["{reference}.x"], "")
+        with self.assertRaises(FileNotFoundError):
+            prepare_reference(self.reference, self.cache_dir, {"x": failing})
+        with self.assertRaises(FileNotFoundError):
+            prepare_reference(self.reference, self.cache_dir, {"x": failing})
+
+    def test_pipeline_records_index_paths(self) -> None:
+        make_bam_file(self.input_dir.joinpath("mapped_reads", "duprem", "sample_A.bam"))
+        make_non_empty_file(self.input_dir.joinpath("variants", "sample_A.vcf"))
+        pipeline = Pipeline(
+            **default_args,
+            argv=["-i", str(self.input_dir), "--reference-cache", str(self.cache_dir)],
+            input_type=("bam", "vcf"),
+            reference_indexes=["fake"],
+        )
+        with mock.patch.dict(
+            "juno_library.juno_library.REFERENCE_INDEXES", {"fake": self.fake_index}
+        ):
+            pipeline.setup()
+        sample = pipeline.sample_dict["sample_A"]
+        self.assertTrue(sample["reference"].startswith(str(self.cache_dir)))
+        self.assertEqual(sample["reference_fake"], sample["reference"] + ".fake")
+        self.assertTrue(Path(sample["reference_fake"]).is_file())
+
+    def test_dry_run_keeps_reference(self) -> None:
+        make_bam_file(self.input_dir.joinpath("mapped_reads", "duprem", "sample_A.bam"))
+        make_non_empty_file(self.input_dir.joinpath("variants", "sample_A.vcf"))
+        pipeline = Pipeline(
+            **default_args,
+            argv=[
+                "-i",
+                str(self.input_dir),
+                "--reference-cache",
+                str(self.cache_dir),
+                "-n",
+            ],
+            input_type=("bam", "vcf"),
+            reference_indexes=["fake"],
+        )
+        with mock.patch.dict(
+            "juno_library.juno_library.REFERENCE_INDEXES", {"fake": self.fake_index}
+        ):
+            pipeline.setup()
+        sample = pipeline.sample_dict["sample_A"]
+        self.assertEqual(sample["reference"], str(self.reference))
+        self.assertNotIn("reference_fake", sample)
+        self.assertIn(
+            f"--bind {self.cache_dir}:{self.cache_dir}",
+            pipeline.snakemake_args["singularity_args"],
+        )
+
+
+class TestBamValidation(unittest.TestCase):
+    """Testing the validation of BAM files and their indexes"""
+
+    def setUp(self) -> None:
+        self.input_dir = Path("fake_bam_input").resolve()
+        self.input_dir.mkdir()
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.input_dir}")
+
+    def test_bgzf_eof_block(self) -> None:
+        self.assertEqual(bgzf_block(b""), BGZF_EOF)
+
+    def test_validate_bam(self) -> None:
+        bam = self.input_dir.joinpath("valid.bam")
+        make_bam_file(bam)
+        self.assertTrue(validate_bam(bam))
+        truncated = self.input_dir.joinpath("truncated.bam")
+        make_bam_file(truncated, eof=False)
+        self.assertFalse(validate_bam(truncated))
+        text = self.input_dir.joinpath("text.bam")
+        make_non_empty_file(text)
+        self.assertFalse(validate_bam(text))
+        not_bam = self.input_dir.joinpath("not_bam.bam")
+        not_bam.write_bytes(bgzf_block(b"@HD\tVN:1.6\n") + BGZF_EOF)
+        self.assertFalse(validate_bam(not_bam))
+        self.assertFalse(validate_bam(self.input_dir.joinpath("missing.bam")))
+
+    def test_validation_reads_constant_amount(self) -> None:
+        # Data after the first block is never read
+        bam = self.input_dir.joinpath("large.bam")
+        make_bam_file(bam)
+        content = bam.read_bytes()
+        large = content[: -len(BGZF_EOF)] + bgzf_block(os.urandom(60000)) * 200
+        bam.write_bytes(large + BGZF_EOF)
+        real_open = open
+        read_sizes: list[int] = []
+
+        class CountingFile:
+            def __init__(self, f: Any) -> None:
+                self.f = f
+
+            def __enter__(self) -> "CountingFile":
+                return self
+
+            def __exit__(self, *args: Any) -> None:
+                self.f.close()
+
+            def read(self, size: int = -1) -> bytes:
+                data: bytes = self.f.read(size)
+                read_sizes.append(len(data))
+                return data
+
+            def seek(self, *args: Any) -> int:
+                return int(self.f.seek(*args))
+
+        with mock.patch(
+            "builtins.open", lambda *args, **kwargs: CountingFile(real_open(*args))
+        ):
+            self.assertTrue(validate_bam(bam))
+        self.assertLess(sum(read_sizes), 1000)
+
+    def test_find_bam_index(self) -> None:
+        bam = self.input_dir.joinpath("sample.bam")
+        make_bam_file(bam)
+        self.assertEqual(find_bam_index(bam), (None, "missing"))
+        index = self.input_dir.joinpath("sample.bai")
+        make_non_empty_file(index)
+        os.utime(bam, (time.time() + 10, time.time() + 10))
+        self.assertEqual(find_bam_index(bam), (None, "stale"))
+        csi = self.input_dir.joinpath("sample.bam.csi")
+        make_non_empty_file(csi)
+        os.utime(csi, (time.time() + 20, time.time() + 20))
+        self.assertEqual(find_bam_index(bam), (str(csi), "fresh"))
+
+    def test_discovery(self) -> None:
+        make_bam_file(self.input_dir.joinpath("sample1.bam"))
+        make_non_empty_file(self.input_dir.joinpath("sample1.bam.bai"))
+        make_bam_file(self.input_dir.joinpath("sample2.bam"))
+        make_bam_file(self.input_dir.joinpath("sample3.bam"), eof=False)
+        pipeline = Pipeline(
+            **default_args, argv=["-i", str(self.input_dir)], input_type="bam"
+        )
+        pipeline.setup()
+        self.assertEqual(sorted(pipeline.sample_dict), ["sample1", "sample2"])
+        self.assertEqual(
+            pipeline.sample_dict["sample1"]["bam_index"],
+            str(self.input_dir.joinpath("sample1.bam.bai")),
+        )
+        self.assertNotIn("bam_index", pipeline.sample_dict["sample2"])
+
+
+class TestRecursiveDiscovery(unittest.TestCase):
+    """Testing the discovery of input files in subdirectories"""
+
+    def setUp(self) -> None:
+        self.input_dir = Path("fake_recursive_input").resolve()
+        for path in [
+            "run1/sample1_R1.fastq",
+            "run1/sample1_R2.fastq",
+            "run1/Undetermined_R1.fastq",
+            "run1/Undetermined_R2.fastq",
+            "run2/lane1/sample2_R1.fastq",
+            "run2/lane1/sample2_R2.fastq",
+            "run2/lane1/deeper/deepest/sample3_R1.fastq",
+            "run2/lane1/deeper/deepest/sample3_R2.fastq",
+            "sample4_R1.fastq",
+            "sample4_R2.fastq",
+        ]:
+            self.input_dir.joinpath(path).parent.mkdir(parents=True, exist_ok=True)
+            make_non_empty_file(self.input_dir.joinpath(path))
+        # A cycle
+        self.input_dir.joinpath("run2", "lane1", "loop").symlink_to(self.input_dir)
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.input_dir}")
+
+    def discover(self, *args: str) -> Pipeline:
+        pipeline = Pipeline(
+            **default_args,
+            argv=["-i", str(self.input_dir), *args],
+            input_type="fastq",
+        )
+        pipeline.setup()
+        return pipeline
+
+    def test_top_level_only_by_default(self) -> None:
+        self.assertEqual(list(self.discover().sample_dict), ["sample4"])
+
+    def test_recursive(self) -> None:
+        pipeline = self.discover("--recursive", "--exclude-pattern", "Undetermined*")
+        self.assertEqual(
+            sorted(pipeline.sample_dict), ["sample1", "sample2", "sample4"]
+        )
+        self.assertEqual(
+            pipeline.sample_dict["sample2"]["R1"],
+            str(self.input_dir.joinpath("run2", "lane1", "sample2_R1.fastq")),
+        )
+        deeper = self.discover("--recursive", "4", "--exclude-pattern", "Undet*")
+        self.assertIn("sample3", deeper.sample_dict)
+        self.assertEqual(len(deeper.sample_dict), 4)
+
+    def test_include_and_exclude(self) -> None:
+        pipeline = self.discover(
+            "--recursive",
+            "--include-pattern",
+            "run2/*",
+            "--exclude-pattern",
+            "deeper",
+        )
+        self.assertEqual(list(pipeline.sample_dict), ["sample2"])
+
+    def test_duplicate_samples(self) -> None:
+        duplicate = self.input_dir.joinpath("run3", "sample1_R1.fastq")
+        duplicate.parent.mkdir()
+        make_non_empty_file(duplicate)
+        with self.assertRaisesRegex(KeyError, "Multiple fastq files"):
+            self.discover("--recursive")
+        make_non_empty_file(self.input_dir.joinpath("run1", "sample5.fasta"))
+        make_non_empty_file(self.input_dir.joinpath("run3", "sample5.fasta"))
+        with self.assertRaisesRegex(KeyError, "Multiple .fasta files"):
+            Pipeline(
+                **default_args,
+                argv=["-i", str(self.input_dir), "--recursive"],
+                input_type="fasta",
+            ).setup()
+
+    def test_fingerprint_sees_deep_files(self) -> None:
+        first = self.discover("--recursive", "5")
+        deepest = self.input_dir.joinpath("run2", "lane1", "deeper", "deepest")
+        make_non_empty_file(deepest.joinpath("sample5_R1.fastq"))
+        make_non_empty_file(deepest.joinpath("sample5_R2.fastq"))
+        second = self.discover("--recursive", "5")
+        self.assertNotEqual(first.launch_fingerprint, second.launch_fingerprint)
+        self.assertIn("sample5", second.sample_dict)
+
+    def test_walk_dir_resolved(self) -> None:
+        files = walk_dir_resolved(self.input_dir, max_depth=1)
+        self.assertEqual(
+            sorted(os.path.relpath(path, self.input_dir) for _, path in files),
+            [
+                "run1/Undetermined_R1.fastq",
+                "run1/Undetermined_R2.fastq",
+                "run1/sample1_R1.fastq",
+                "run1/sample1_R2.fastq",
+                "sample4_R1.fastq",
+                "sample4_R2.fastq",
+            ],
+        )
+        # The cycle is followed once at most
+        self.assertEqual(len(walk_dir_resolved(self.input_dir, max_depth=20)), 10)
+
+
+class TestCapacityPlanning(unittest.TestCase):
+    """Testing the estimates of the resources of a run"""
+
+    def job(self, rule: str, **resources: Any) -> dict[str, Any]:
+        return dict(
+            {
+                "rule": rule,
+                "threads": 1,
+                "mem_gb": 4.0,
+                "runtime": 30,
+                "disk_mb": None,
+                "local": False,
+            },
+            **resources,
+        )
+
+    def test_cluster_estimates(self) -> None:
+        jobs = [self.job("assemble", threads=4, mem_gb=16.0)] * 10 + [
+            self.job("summarize", runtime=None)
+        ]
+        report = plan_capacity(
+            jobs,
+            total_input_bytes=10 * 1024**3,
+            free_output_bytes=100 * 1024**3,
+            time_limit=60,
+            max_concurrent_jobs=5,
+        )
+        self.assertEqual(report["cpu_hours"], 10 * 4 * 0.5 + 1)
+        self.assertEqual(report["max_job_mem_gb"], 16.0)
+        self.assertEqual(report["peak_mem_gb"], 5 * 16.0)
+        # 10 jobs of 30 minutes on 5 nodes (60) + summarize (60)
+        self.assertEqual(report["wall_time_hours"], 2.0)
+        self.assertEqual(report["output_bytes"], 30 * 1024**3)
+        self.assertTrue(report["fits"])
+
+    def test_problems(self) -> None:
+        jobs = [self.job("assemble", runtime=120, threads=8, disk_mb=2048)]
+        report = plan_capacity(
+            jobs,
+            total_input_bytes=0,
+            free_output_bytes=1024**3,
+            time_limit=60,
+            max_concurrent_jobs=4,
+            cores=4,
+            mem_gb=2.0,
+        )
+        self.assertFalse(report["fits"])
+        self.assertEqual(report["output_bytes_source"], "disk_mb")
+        self.assertEqual(len(report["warnings"]), 4)
+        self.assertIn("time limit", report["warnings"][0])
+        self.assertIn("GB is free", format_capacity_report(report))
+
+
+class TestPipelineServer(unittest.TestCase):
+    """Testing the warm server that runs pipelines for requests on a socket"""
+
+    def setUp(self) -> None:
+        self.tmp_dir = Path("fake_server_dir").resolve()
+        self.input_dir = self.tmp_dir.joinpath("input")
+        self.input_dir.mkdir(parents=True)
+        make_non_empty_file(self.input_dir.joinpath("sample1_R1.fastq"))
+        make_non_empty_file(self.input_dir.joinpath("sample1_R2.fastq"))
+        self.socket_path = self.tmp_dir.joinpath("server.sock")
+        pipeline_factory = partial(
+            Pipeline,
+            pipeline_name="fake_pipeline",
+            pipeline_version="0.1",
+            input_type="fastq",
+            snakefile=str(Path("tests/Snakefile").resolve()),
+        )
+        self.server = multiprocessing.get_context("fork").Process(
+            target=PipelineServer(pipeline_factory, self.socket_path).serve_forever
+        )
+        self.server.start()
+        for _ in range(200):
+            if self.socket_path.exists():
+                break
+            time.sleep(0.05)
+
+    def tearDown(self) -> None:
+        self.server.terminate()
+        self.server.join(10)
+        os.system(f"rm -rf {self.tmp_dir}")
+
+    def request(self, argv: list[str]) -> tuple[int, str]:
+        log_file = self.tmp_dir.joinpath("client.log")
+        with open(log_file, "w") as log:
+            exit_status = request_run(
+                argv,
+                self.socket_path,
+                cwd=str(self.tmp_dir),
+                fds=(0, log.fileno(), log.fileno()),
+            )
+        return exit_status, log_file.read_text()
+
+    def test_runs(self) -> None:
+        argv = ["-i", "input", "-o", "output", "--local", "-n"]
+        for _ in range(2):
+            exit_status, log = self.request(argv)
+            self.assertEqual(exit_status, 0)
+            self.assertIn("Finished running fake_pipeline pipeline!", log)
+        # Relative paths are resolved in the working directory of the client
+        self.assertIn(str(self.tmp_dir.joinpath("output", "fake_result.txt")), log)
+
+    def test_stalled_client(self) -> None:
+        # A client that connects but never sends its request
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stalled:
+            stalled.connect(str(self.socket_path))
+            start = time.monotonic()
+            exit_status, _ = self.request(
+                ["-i", "input", "-o", "output", "--local", "-n"]
+            )
+            self.assertEqual(exit_status, 0)
+            self.assertLess(time.monotonic() - start, REQUEST_TIMEOUT)
+
+    def test_failing_runs(self) -> None:
+        exit_status, log = self.request(["--local"])
+        self.assertEqual(exit_status, 2)
+        self.assertIn("the following arguments are required: -i/--input", log)
+        exit_status, log = self.request(["-i", "missing_input", "--local", "-n"])
+        self.assertEqual(exit_status, 1)
+        self.assertIn("AssertionError", log)
+
+    def test_shutdown(self) -> None:
+        self.server.terminate()
+        self.server.join(10)
+        self.assertEqual(self.server.exitcode, 0)
+        self.assertFalse(self.socket_path.exists())
+
+
+class TestPipelineConfig(unittest.TestCase):
+    """Testing pipelines that take their settings from a PipelineConfig"""
+
+    def setUp(self) -> None:
+        self.input_dir = Path("fake_config_input").resolve()
+        self.input_dir.mkdir()
+        for sample in ["sample1", "sample2"]:
+            make_non_empty_file(self.input_dir.joinpath(f"{sample}_R1.fastq"))
+            make_non_empty_file(self.input_dir.joinpath(f"{sample}_R2.fastq"))
+        self.pipeline_args: dict[str, Any] = dict(
+            pipeline_name="fake_pipeline",
+            pipeline_version="0.1",
+            input_type="fastq",
+            snakefile=str(Path("tests/Snakefile").resolve()),
+        )
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.input_dir} fake_config_output*")
+
+    def test_same_setup_as_argv(self) -> None:
+        from_argv = Pipeline(
+            **self.pipeline_args,
+            argv=["-i", str(self.input_dir), "-o", "fake_config_output", "--local"],
+        )
+        from_argv.setup()
+        from_config = Pipeline.from_config(
+            PipelineConfig(
+                input_dir=self.input_dir,
+                output_dir=Path("fake_config_output"),
+                local=True,
+            ),
+            **self.pipeline_args,
+        )
+        with mock.patch.object(from_config.parser, "parse_args") as parse_args:
+            from_config.setup()
+        parse_args.assert_not_called()
+        self.assertDictEqual(from_config.sample_dict, from_argv.sample_dict)
+        for attribute in [
+            "output_dir",
+            "local",
+            "time_limit",
+            "queue",
+            "recursive_depth",
+        ]:
+            self.assertEqual(
+                getattr(from_config, attribute), getattr(from_argv, attribute)
+            )
+        self.assertEqual(from_config.snakemake_args, from_argv.snakemake_args)
+
+    def test_unknown_extra_option(self) -> None:
+        pipeline = Pipeline.from_config(
+            PipelineConfig(input_dir=self.input_dir, extra={"species": "ecoli"}),
+            **self.pipeline_args,
+        )
+        with self.assertRaisesRegex(ValueError, "species"):
+            pipeline.setup()
+
+    def test_given_sample_dict(self) -> None:
+        sample_dict = {"sample1": {"R1": "/r1.fastq", "R2": "/r2.fastq"}}
+        pipeline = Pipeline.from_config(
+            PipelineConfig(input_dir=self.input_dir),
+            sample_dict=sample_dict,
+            **self.pipeline_args,
+        )
+        with mock.patch.object(Pipeline, "_Pipeline__build_sample_dict") as build:
+            pipeline.setup()
+        build.assert_not_called()
+        self.assertDictEqual(pipeline.sample_dict, sample_dict)
+        # The given samples are copied
+        pipeline.sample_dict["sample1"]["R1"] = "/other.fastq"
+        self.assertEqual(sample_dict["sample1"]["R1"], "/r1.fastq")
+
+    def test_run_batch(self) -> None:
+        configs = [
+            PipelineConfig(
+                input_dir=self.input_dir,
+                output_dir=Path(f"fake_config_output_{i}"),
+                local=True,
+                dryrun=True,
+            )
+            for i in range(2)
+        ]
+        configs.append(PipelineConfig(input_dir=Path("missing_input"), dryrun=True))
+        shared_caches = SharedCaches()
+        with mock.patch(
+            "juno_library.juno_library.validate_file_has_min_lines",
+            wraps=validate_file_has_min_lines,
+        ) as validate:
+            results = Pipeline.run_batch(
+                configs, shared_caches=shared_caches, **self.pipeline_args
+            )
+        self.assertEqual([r.successful for r in results], [True, True, False])
+        self.assertIn("does not exist", str(results[2].error))
+        # The second run reused the samples of the first one
+        self.assertEqual(validate.call_count, 4)
+        self.assertEqual(len(shared_caches.sample_tables), 1)
+
+    def test_shared_validations_and_metadata(self) -> None:
+        shared_caches = SharedCaches()
+        file_path = str(self.input_dir.joinpath("sample1_R1.fastq"))
+        check = mock.Mock(return_value=True)
+        self.assertTrue(shared_caches.validated("check", file_path, check))
+        self.assertTrue(shared_caches.validated("check", file_path, check))
+        self.assertEqual(check.call_count, 1)
+        # A changed file is checked again
+        make_non_empty_file(Path(file_path), content="changed\nfile\ncontent\n")
+        shared_caches.validated("check", file_path, check)
+        self.assertEqual(check.call_count, 2)
+        compute = mock.Mock(return_value={"repo": "url"})
+        shared_caches.metadata("git", compute)
+        self.assertEqual(shared_caches.metadata("git", compute), {"repo": "url"})
+        self.assertEqual(compute.call_count, 1)
+
+
+class TestCgmlstInput(unittest.TestCase):
+    """Testing the input from juno-cgmlst and its allele matrices"""
+
+    def setUp(self) -> None:
+        self.input_dir = Path("fake_cgmlst_input").resolve()
+        self.output_dir = Path("fake_cgmlst_output").resolve()
+        self.input_dir.joinpath("audit_trail").mkdir(parents=True)
+        self.write_table("scheme1", "sample1", ["locus1", "locus2"], ["1", "INF-7"])
+        self.write_table("scheme1", "sample2", ["locus2", "locus3"], ["LNF", "3"])
+        self.write_table("scheme2", "sample1", ["locus1"], ["4"])
+        self.write_table("scheme2", "sample2", ["locus1"], ["5"])
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.input_dir} {self.output_dir}")
+
+    def write_table(
+        self, scheme: str, sample: str, loci: list[str], calls: list[str]
+    ) -> None:
+        table = self.input_dir.joinpath("cgmlst", scheme, "per_sample", f"{sample}.tsv")
+        table.parent.mkdir(parents=True, exist_ok=True)
+        make_non_empty_file(
+            table,
+            "\t".join(["FILE", *loci]) + "\n" + "\t".join([sample, *calls]) + "\n",
+        )
+
+    def test_discovery(self) -> None:
+        results = discover_cgmlst_results(
+            self.input_dir.joinpath("cgmlst"), validate=lambda path: True
+        )
+        self.assertEqual(sorted(results), ["scheme1", "scheme2"])
+        self.assertEqual(sorted(results["scheme1"]), ["sample1", "sample2"])
+        self.assertEqual(
+            read_allele_calls(results["scheme1"]["sample1"]),
+            {"locus1": 1, "locus2": 7},
+        )
+
+    def test_missing_scheme_for_a_sample(self) -> None:
+        self.write_table("scheme2", "sample3", ["locus1"], ["4"])
+        pipeline = Pipeline(**default_args, argv=["-i", str(self.input_dir)])
+        with self.assertRaisesRegex(KeyError, "scheme1 are missing for sample sample3"):
+            pipeline.setup()
+
+    def launch(self) -> Pipeline:
+        snakefile = self.output_dir.joinpath("Snakefile")
+        snakefile.parent.mkdir(exist_ok=True)
+        make_non_empty_file(snakefile, "rule all:\n    input: []\n")
+        pipeline = Pipeline(
+            **default_args,
+            argv=["-i", str(self.input_dir), "-o", str(self.output_dir)]
+            + ["--local", "--cgmlst-matrix"],
+            sample_sheet=self.output_dir.joinpath("sample_sheet.yaml"),
+            user_parameters_file=self.output_dir.joinpath("user_parameters.yaml"),
+            snakefile=str(snakefile),
+        )
+        pipeline.run()
+        return pipeline
+
+    def test_allele_matrix(self) -> None:
+        pipeline = Pipeline(
+            **default_args,
+            argv=["-i", str(self.input_dir), "-o", str(self.output_dir)]
+            + ["--cgmlst-matrix"],
+        )
+        pipeline.setup()
+        matrix_file = pipeline.snakemake_config["cgmlst_matrices"]["scheme1"]
+        self.assertEqual(
+            matrix_file,
+            str(
+                self.output_dir.joinpath(
+                    "cgmlst_matrices", "scheme1", "allele_matrix.npz"
+                )
+            ),
+        )
+        samples, loci, alleles = load_allele_matrix(matrix_file)
+        self.assertEqual(samples, ["sample1", "sample2"])
+        self.assertEqual(loci, ["locus1", "locus2", "locus3"])
+        self.assertEqual(alleles.tolist(), [[1, 7, 0], [0, 0, 3]])
+
+        # Reused while the tables do not change
+        mtime = os.stat(matrix_file).st_mtime_ns
+        tables = pipeline.cgmlst_schemes["scheme1"]
+        cached_allele_matrix(Path(matrix_file).parent, tables)
+        self.assertEqual(os.stat(matrix_file).st_mtime_ns, mtime)
+        self.write_table("scheme1", "sample2", ["locus2", "locus3"], ["2", "3"])
+        cached_allele_matrix(Path(matrix_file).parent, tables)
+        self.assertEqual(load_allele_matrix(matrix_file)[2].tolist()[1], [0, 2, 3])
+
+    def test_allele_matrix_on_relaunch(self) -> None:
+        first_launch = self.launch()
+        matrix_file = first_launch.snakemake_config["cgmlst_matrices"]["scheme1"]
+        # Writing the matrices does not change the fingerprint
+        relaunch = self.launch()
+        self.assertTrue(relaunch.fast_relaunch)
+        self.assertEqual(
+            relaunch.snakemake_config["cgmlst_matrices"]["scheme1"], matrix_file
+        )
+        # A table rewritten in place: the samples are reused, the matrix is not
+        self.write_table("scheme1", "sample2", ["locus2", "locus3"], ["2", "3"])
+        relaunch = self.launch()
+        self.assertTrue(relaunch.fast_relaunch)
+        self.assertEqual(load_allele_matrix(matrix_file)[2].tolist()[1], [0, 2, 3])
+        # A new table (in per_sample, 4 levels deep) changes the fingerprint
+        self.write_table("scheme1", "sample3", ["locus1"], ["9"])
+        self.write_table("scheme2", "sample3", ["locus1"], ["9"])
+        relaunch = self.launch()
+        self.assertFalse(relaunch.fast_relaunch)
+        self.assertEqual(
+            load_allele_matrix(matrix_file)[0], ["sample1", "sample2", "sample3"]
+        )
+
+
+class TestSamplePrioritization(unittest.TestCase):
+    """Testing that the jobs of urgent samples run first"""
+
+    def setUp(self) -> None:
+        self.test_dir = Path("fake_prioritization").resolve()
+        self.input_dir = self.test_dir.joinpath("input")
+        self.output_dir = self.test_dir.joinpath("output")
+        self.input_dir.mkdir(parents=True, exist_ok=True)
+        for sample in ["s1", "s2", "s3", "s4", "s5"]:
+            make_non_empty_file(self.input_dir.joinpath(f"{sample}.fasta"), sample)
+        self.snakefile = self.test_dir.joinpath("Snakefile")
+        make_non_empty_file(
+            self.snakefile,
+            "import yaml\n"
+            'with open(config["sample_sheet"]) as f:\n'
+            "    SAMPLES = yaml.safe_load(f)\n"
+            'OUT = config["output_dir"]\n\n'
+            "rule all:\n"
+            '    input: OUT + "/summary.txt"\n\n'
+            "rule copy:\n"
+            '    input: lambda wildcards: SAMPLES[wildcards.sample]["assembly"]\n'
+            '    output: OUT + "/copy/{sample}.txt"\n'
+            '    shell: "cp {input} {output}"\n\n'
+            "rule report:\n"
+            '    input: OUT + "/copy/{sample}.txt"\n'
+            '    output: OUT + "/report/{sample}.txt"\n'
+            '    shell: "cp {input} {output} && echo {wildcards.sample} >> " + OUT + "/order.txt"\n\n'
+            "rule summary:\n"
+            '    input: expand(OUT + "/report/{sample}.txt", sample=SAMPLES)\n'
+            '    output: OUT + "/summary.txt"\n'
+            '    shell: "cat {input} > {output}"\n',
+        )
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.test_dir}")
+
+    def test_prioritize_samples(self) -> None:
+        metadata: dict[str, dict[str, Any]] = {
+            "s1": {"genus": "x"},
+            "s2": {"priority": 1.0},
+            "s3": {"priority": float("nan")},
+            "s4": {"priority": "2"},
+        }
+        priorities = priorities_from_metadata(metadata)
+        self.assertEqual(priorities, {"s2": 1, "s3": 0, "s4": 2})
+        sample_dict = {sample: {"assembly": f"{sample}.fasta"} for sample in metadata}
+        prioritized = prioritize_samples(sample_dict, priorities)
+        self.assertEqual(list(prioritized), ["s4", "s2", "s1", "s3"])
+        self.assertEqual(prioritized["s1"]["priority"], 0)
+        with self.assertRaisesRegex(ValueError, "whole number"):
+            priorities_from_metadata({"s1": {"priority": 0.5}})
+        with self.assertRaisesRegex(ValueError, "should be a number"):
+            priorities_from_metadata({"s1": {"priority": "urgent"}})
+
+    def test_priority_targets(self) -> None:
+        jobs = [
+            {"output": ["a.bam"], "input": ["a.fq"], "wildcards": {"sample": "a"}},
+            {"output": ["a.vcf"], "input": ["a.bam"], "wildcards": {"sample": "a"}},
+            {"output": ["b.bam"], "input": ["b.fq"], "wildcards": {"sample": "b"}},
+            {"output": ["all.tsv"], "input": ["a.vcf", "b.bam"], "wildcards": {}},
+        ]
+        self.assertEqual(priority_targets(jobs, ["a"]), {"a": ["a.vcf"]})
+
+    def test_urgent_samples_run_first(self) -> None:
+        priority_file = self.test_dir.joinpath("priorities.tsv")
+        make_non_empty_file(priority_file, "sample\tpriority\ns4\t10\ns2\t5\n")
+        pipeline = Pipeline(
+            **default_args,
+            argv=[
+                "-i",
+                str(self.input_dir),
+                "-o",
+                str(self.output_dir),
+                "--local",
+                "--priority-file",
+                str(priority_file),
+                "--snakemake-args",
+                "cores=1",
+                "nodes=1",
+            ],
+            input_type="fasta",
+            sample_sheet=self.test_dir.joinpath("sample_sheet.yaml"),
+            user_parameters_file=self.test_dir.joinpath("user_parameters.yaml"),
+            snakefile=str(self.snakefile),
+        )
+        with mock.patch.object(Pipeline, "_make_snakemake_report", return_value=True):
+            pipeline.run()
+        self.assertEqual(pipeline.urgent_samples, ["s4", "s2"])
+        self.assertEqual(
+            pipeline.snakemake_args["prioritytargets"],
+            [str(self.output_dir.joinpath("report", f"{s}.txt")) for s in ["s4", "s2"]],
+        )
+        with open(self.output_dir.joinpath("order.txt")) as f:
+            self.assertEqual(set(f.read().split()[:2]), {"s2", "s4"})
+        audit_trail = self.output_dir.joinpath("audit_trail")
+        with open(audit_trail.joinpath("sample_sheet.yaml")) as f:
+            sample_sheet = yaml.safe_load(f)
+        self.assertEqual(list(sample_sheet)[:2], ["s4", "s2"])
+        self.assertEqual(sample_sheet["s4"]["priority"], 10)
+        with open(audit_trail.joinpath("log_prioritization.yaml")) as f:
+            log = yaml.safe_load(f)
+        self.assertEqual(log["urgent_samples"], {"s4": 10, "s2": 5})
+        self.assertEqual(log["priority_targets"], 2)
+
+
+class TestRetries(unittest.TestCase):
+    """Testing the resubmission of jobs killed by LSF with more memory or time"""
+
+    def setUp(self) -> None:
+        self.test_dir = Path("fake_retries").resolve()
+        self.input_dir = self.test_dir.joinpath("input")
+        self.output_dir = self.test_dir.joinpath("output")
+        self.bin_dir = self.test_dir.joinpath("bin")
+        self.input_dir.mkdir(parents=True, exist_ok=True)
+        self.bin_dir.mkdir()
+        make_non_empty_file(self.input_dir.joinpath("s1.fasta"), "s1")
+        self.snakefile = self.test_dir.joinpath("Snakefile")
+        make_non_empty_file(
+            self.snakefile,
+            "import yaml\n"
+            'with open(config["sample_sheet"]) as f:\n'
+            "    SAMPLES = yaml.safe_load(f)\n"
+            'OUT = config["output_dir"]\n\n'
+            "rule all:\n"
+            '    input: expand(OUT + "/copy/{sample}.txt", sample=SAMPLES)\n\n'
+            "rule copy:\n"
+            '    input: lambda wildcards: SAMPLES[wildcards.sample]["assembly"]\n'
+            '    output: OUT + "/copy/{sample}.txt"\n'
+            "    resources: mem_gb=2\n"
+            '    shell: "cp {input} {output}"\n',
+        )
+        # Stand-ins for bsub and bjobs: jobs that request less than 5G are
+        # killed for their memory, the others run right away
+        make_non_empty_file(
+            self.bin_dir.joinpath("bsub"),
+            f"#!{sys.executable}\n"
+            "import argparse, subprocess, sys, time\n"
+            "parser = argparse.ArgumentParser()\n"
+            "for option in ['-q', '-n', '-o', '-e', '-R', '-M', '-W']:\n"
+            "    parser.add_argument(option, action='append')\n"
+            "args, command = parser.parse_known_args()\n"
+            "job_id = str(time.time_ns())\n"
+            "with open(args.o[0], 'a') as log:\n"
+            "    if int(args.M[0].rstrip('G')) < 5:\n"
+            "        log.write('TERM_MEMLIMIT: job killed after reaching LSF memory usage limit.\\n')\n"
+            "        status = 'EXIT'\n"
+            "    else:\n"
+            "        status = 'DONE' if subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode == 0 else 'EXIT'\n"
+            f"with open('{self.bin_dir}/' + job_id, 'w') as f:\n"
+            "    f.write(status)\n"
+            "print(f'Job <{job_id}> is submitted to queue <{args.q[0]}>.')\n",
+        )
+        make_non_empty_file(
+            self.bin_dir.joinpath("bjobs"),
+            f"#!/bin/sh\ncat {self.bin_dir}/$4\n",
+        )
+        make_non_empty_file(
+            self.bin_dir.joinpath("bhist"),
+            f"#!/bin/sh\ncat {self.bin_dir}/history_$2\n",
+        )
+        for command in ["bsub", "bjobs", "bhist"]:
+            self.bin_dir.joinpath(command).chmod(0o755)
+
+    def tearDown(self) -> None:
+        os.system(f"rm -rf {self.test_dir}")
+
+    def test_kills(self) -> None:
+        report = (
+            "TERM_MEMLIMIT: job killed after reaching LSF memory usage limit.\n"
+            "Exited with exit code 130.\n"
+        )
+        self.assertEqual(count_kills(report * 2), {"mem_gb": 2, "time_limit": 0})
+        rule_log_dir = self.test_dir.joinpath("log", "assemble")
+        rule_log_dir.mkdir(parents=True)
+        log_name = "assemble_sample=s1_3.out"
+        make_non_empty_file(rule_log_dir.joinpath(log_name), report * 2)
+        make_non_empty_file(rule_log_dir.joinpath("assemble_sample=s10_4.out"), report)
+        # The first kill happened before this run
+        kills = job_kills(
+            rule_log_dir, "assemble", "sample=s1", {log_name: len(report)}
+        )
+        self.assertEqual(kills, {"mem_gb": 1, "time_limit": 0})
+        self.assertEqual(escalate(4, 2.0, 3, 16), 16)
+        self.assertEqual(escalate(32, 2.0, 1, 16), 32)
+
+    def test_escalating_resources(self) -> None:
+        resources = escalating_resources(
+            {
+                "assemble": {"mem_gb": 4, "time_limit": 30},
+                "qc": {"mem_gb": lambda wildcards, attempt: attempt},
+            },
+            self.test_dir.joinpath("log"),
+            time_limit=60,
+            max_mem_gb=16,
+            max_time_limit=240,
+        )
+        # The time limit that a rule declares is its first request
+        self.assertEqual(resources["assemble"]["time_limit"].base, 30)
+        self.assertEqual(resources["assemble"]["mem_gb"].base, 4)
+        self.assertEqual(resources["qc"]["time_limit"].base, 60)
+        self.assertNotIn("mem_gb", resources["qc"])
+
+    def test_job_status(self) -> None:
+        make_non_empty_file(self.bin_dir.joinpath("1"), "RUN")
+        make_non_empty_file(self.bin_dir.joinpath("2"), "DONE")
+        make_non_empty_file(self.bin_dir.joinpath("3"), "EXIT")
+        # Jobs 4 and 5 were purged from bjobs, only their history is left
+        make_non_empty_file(
+            self.bin_dir.joinpath("history_4"),
+            "Done successfully. The CPU time used is 1.0 seconds.",
+        )
+        with mock.patch.dict(
+            os.environ, PATH=f"{self.bin_dir}{os.pathsep}{os.environ['PATH']}"
+        ):
+            statuses = [
+                lsf_job_status(f"Job <{job_id}> is submitted to queue <bio>.")
+                for job_id in range(1, 6)
+            ]
+        self.assertEqual(
+            statuses, ["running", "success", "failed", "success", "failed"]
+        )
+        self.assertEqual(lsf_job_status("not a job id"), "failed")
+
+    def test_memory_escalation(self) -> None:
+        pipeline = Pipeline(
+            **default_args,
+            argv=[
+                "-i",
+                str(self.input_dir),
+                "-o",
+                str(self.output_dir),
+                "--no-containers",
+                "--no-run-registry",
+                "--retries",
+                "2",
+            ],
+            input_type="fasta",
+            sample_sheet=self.test_dir.joinpath("sample_sheet.yaml"),
+            user_parameters_file=self.test_dir.joinpath("user_parameters.yaml"),
+            snakefile=str(self.snakefile),
+        )
+        with mock.patch.dict(
+            os.environ, PATH=f"{self.bin_dir}{os.pathsep}{os.environ['PATH']}"
+        ), mock.patch.object(Pipeline, "_make_snakemake_report", return_value=True):
+            pipeline.run()
+        self.assertTrue(self.output_dir.joinpath("copy", "s1.txt").exists())
+        with open(self.output_dir.joinpath("audit_trail", "log_retries.yaml")) as f:
+            report = yaml.safe_load(f)
+        self.assertEqual(report["killed_jobs"], 1)
+        self.assertEqual(report["mem_gb_kills"], 2)
+        # 2 GB, then 4 GB (both killed) and 8 GB
+        self.assertEqual(report["jobs"][0]["mem_gb"], 8)
+        self.assertEqual(report["jobs"][0]["wildcards"], "sample=s1")
+
+
 if __name__ == "__main__":
     unittest.main()